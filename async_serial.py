@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+asyncio serial engine. Alternative to Reader for asyncio applications: port
+is read by the event loop (no threads), so many ports and timers can run in
+one thread. The GUI uses it through AsyncModel (reader_mode 'asyncio').
+
+Usage:
+    port = AsyncSerial('/dev/ttyUSB0', 115200)
+    await port.open()
+    await port.write('help')
+    async for data, decoded in port:
+        print(decoded, end='')
+'''
+
+# System imports
+import  os
+import  asyncio
+import  logging
+
+# PySerial imports
+import  serial
+from    serial.serialutil   import SerialException
+
+from config import config
+from line_decoder import LineDecoder
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSerial:
+    '''
+    Serial port driven by asyncio event loop. On POSIX port is watched with
+    loop.add_reader(), on other systems it's read in the default executor.
+    Received chunks are available through async iteration as (bytes,
+    decoded text) tuples, or are passed to the receive callback.
+    '''
+
+    def __init__(self, port=None, baudrate=None, receive=None):
+        '''
+        Args:
+            receive: function called in the loop with every received chunk
+                of bytes (not decoded, not available for iteration) and
+                with empty bytes when the port is lost.
+        '''
+        self._port      = port or config['port']
+        self._br        = baudrate or config['baudrate']
+        self.eol        = config['eol'][0]
+
+        # Non-blocking reads and writes
+        self.ser        = serial.Serial(baudrate=self._br, timeout=0,
+                write_timeout=0, bytesize=config['bytesize'],
+                parity=config['parity'], stopbits=config['stopbits'])
+        self.decoder    = LineDecoder(config['encoding'],
+                config['decode_errors'], config['eol'][config['rx_eol']],
+                config['rx_max_line'])
+        self.counters   = {'received': 0, 'delivered': 0, 'discarded': 0}
+        self.receive    = receive
+
+        self._loop      = None
+        self._chunks    = asyncio.Queue()
+        self._paused    = False
+        self._watching  = False
+        # Reading task for systems without selectable port
+        self._task      = None
+
+    @property
+    def is_open(self):
+        return self.ser.isOpen()
+
+    async def open(self):
+        '''
+        Open port and start reading.
+        Raises:
+            SerialException if port can't be opened.
+        '''
+        self._loop = asyncio.get_running_loop()
+        self.ser.port = self._port
+        self.ser.open()
+        self.decoder.reset()
+        self._watch()
+
+    async def close(self):
+        self._unwatch()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.ser.close()
+        # Wake up iterators
+        if not self.receive:
+            self._chunks.put_nowait(None)
+
+    async def set_port(self, port):
+        '''
+        Change port. If port was open, the new one is opened.
+        '''
+        was_open = self.is_open
+        if was_open:
+            await self.close()
+            self._chunks = asyncio.Queue()
+
+        self._port = port
+        if was_open:
+            await self.open()
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def br(self):
+        return self._br
+
+    @br.setter
+    def br(self, baudrate):
+        if int(baudrate) in serial.Serial.BAUDRATES:
+            self._br = int(baudrate)
+            self.ser.baudrate = self._br
+
+    def set_eol(self, index):
+        if 0 <= index < len(config['eol']):
+            self.eol = config['eol'][index]
+
+    def pause(self):
+        '''
+        Stop reading. Data is kept in the driver buffer until resume().
+        '''
+        self._paused = True
+        self._unwatch()
+
+    def resume(self):
+        self._paused = False
+        if self.is_open:
+            self._watch()
+
+    async def write(self, data):
+        '''
+        Write data to the port. Strings are encoded and followed by the
+        configured end of line.
+        Args:
+            data: str or bytes.
+        '''
+        if isinstance(data, str):
+            data = (data + self.eol).encode(config['encoding'])
+
+        view = memoryview(data)
+        while view:
+            try:
+                written = self._write_some(view)
+            except (OSError, SerialException) as e:
+                logger.error('Fail writing to port: {}'.format(e))
+                raise
+            view = view[written:]
+            if view:
+                await self._writable()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._chunks.get()
+        if chunk is None:
+            raise StopAsyncIteration
+
+        return chunk
+
+#==============================================================================
+# Utils
+#==============================================================================
+
+    def _selectable(self):
+        return os.name == 'posix' and hasattr(self.ser, 'fileno')
+
+    def _watch(self):
+        if self._paused or self._watching:
+            return None
+
+        if self._selectable():
+            self._loop.add_reader(self.ser.fileno(), self._on_readable)
+        elif not self._task:
+            self._task = self._loop.create_task(self._read_executor())
+        self._watching = True
+
+    def _unwatch(self):
+        if not self._watching:
+            return None
+
+        if self._selectable() and self.is_open:
+            self._loop.remove_reader(self.ser.fileno())
+        self._watching = False
+
+    def _write_some(self, data):
+        '''
+        Write as much as the port accepts without blocking.
+        Returns:
+            Number of written bytes.
+        '''
+        if not self._selectable():
+            return self.ser.write(data) or 0
+
+        try:
+            return os.write(self.ser.fileno(), data)
+        except BlockingIOError:
+            return 0
+
+    async def _writable(self):
+        if not self._selectable():
+            await asyncio.sleep(0.001)
+            return None
+
+        ready = self._loop.create_future()
+        fd = self.ser.fileno()
+        self._loop.add_writer(fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            self._loop.remove_writer(fd)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.ser.fileno(), config['read_chunk'])
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            logger.error('Can\'t read from serial port: {}'.format(e))
+            data = b''
+
+        if not data:
+            # Device disappeared
+            self._unwatch()
+            self.ser.close()
+            self._lost()
+            return None
+
+        self._received(data)
+
+    async def _read_executor(self):
+        self.ser.timeout = 0.1
+        while self.is_open:
+            if self._paused:
+                await asyncio.sleep(0.05)
+                continue
+
+            try:
+                data = await self._loop.run_in_executor(None, self.ser.read,
+                        config['read_chunk'])
+            except SerialException as e:
+                logger.error('Can\'t read from serial port: {}'.format(e))
+                self._lost()
+                break
+
+            if data:
+                self._received(data)
+
+    def _lost(self):
+        if self.receive:
+            self.receive(b'')
+        else:
+            self._chunks.put_nowait(None)
+
+    def _received(self, data):
+        self.counters['received'] += len(data)
+        if self.receive:
+            self.receive(data)
+            self.counters['delivered'] += len(data)
+            return None
+
+        try:
+            decoded = self.decoder.feed_text(data)
+        except UnicodeError as e:
+            logger.warn('Fail to decode bytes. Error: {}'.format(e))
+            self.counters['discarded'] += len(data)
+            return None
+
+        self._chunks.put_nowait((data, decoded))
+        self.counters['delivered'] += len(data)
+
+
+def qt_event_loop(app, interval=10):
+    '''
+    Run asyncio event loop together with Qt event loop. If qasync is
+    installed its QEventLoop is used, otherwise asyncio loop is stepped by
+    QTimer every 'interval' ms.
+    Args:
+        app: QApplication.
+    Returns:
+        asyncio event loop set as current one.
+    '''
+    try:
+        import qasync
+    except ImportError:
+        qasync = None
+
+    if qasync:
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+        return loop
+
+    from PyQt5.QtCore import QTimer
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    def step():
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+
+    timer = QTimer(app)
+    timer.timeout.connect(step)
+    timer.start(interval)
+
+    return loop
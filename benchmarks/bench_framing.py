@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Throughput of frame decoders (SLIP, COBS, length prefixed) with and without
+CRC on random frames fed in reads of 4 KiB.
+
+Run:
+    python3 ./benchmarks/bench_framing.py [megabytes] [frame size]
+'''
+
+import  os
+import  sys
+import  time
+import  random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    framing             import make_decoder
+from    framing             import CRCS
+
+
+def slip(payload):
+    return payload.replace(b'\xDB', b'\xDB\xDD').replace(b'\xC0',
+            b'\xDB\xDC') + b'\xC0'
+
+
+def cobs(payload):
+    out = bytearray()
+    for block in payload.split(b'\0'):
+        while len(block) >= 254:
+            out += b'\xFF' + block[:254]
+            block = block[254:]
+        out += bytes([len(block) + 1]) + block
+
+    return bytes(out) + b'\0'
+
+
+def length(payload):
+    return len(payload).to_bytes(2, 'big') + payload
+
+
+def main():
+    size = int(float(sys.argv[1] if len(sys.argv) > 1 else 8)*1024*1024)
+    frame_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    rnd = random.Random(0)
+    frames = [rnd.randbytes(frame_size) for _ in range(1024)]
+
+    for name, encode in [('slip', slip), ('cobs', cobs),
+            ('length', length)]:
+        for crc in [None, 'crc16', 'crc32']:
+            stream = b''.join(encode(frame + (CRCS[crc][0](frame) if crc
+                else b'')) for frame in frames)
+            stream *= max(1, size//len(stream))
+
+            decoder = make_decoder(name, crc)
+            count = 0
+            start = time.perf_counter()
+            for i in range(0, len(stream), 4096):
+                count += len(decoder.feed(stream[i:i + 4096]))
+            elapsed = time.perf_counter() - start
+
+            print('{:6} {:5}: {:6.1f} MB/s, {:7.0f} frames/s'.format(name,
+                crc or '-', len(stream)/elapsed/1e6, count/elapsed))
+
+
+if __name__ == '__main__':
+    main()
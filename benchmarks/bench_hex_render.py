@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Micro-benchmark of HEX rendering. Compares old per-character implementation
+of Model.add_html_colors with Highlighter and HexRenderer and checks that
+both produce the same rows.
+
+Run:
+    python3 ./benchmarks/bench_hex_render.py [chunk size] [repeats]
+'''
+
+import  os
+import  sys
+import  random
+import  timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    hex_render          import HexRenderer
+from    highlight           import Highlighter
+
+CLR_SET = {
+    0x0A: '#0000AA',
+    0x0D: '#00AA00'
+}
+RULES = [{'pattern': '{:02X}'.format(byte), 'kind': 'hex', 'color': color}
+        for byte, color in CLR_SET.items()]
+
+
+def add_html_colors(string, clr_set=CLR_SET, bytes_in_row=16):
+    '''
+    Previous implementation of Model.add_html_colors (reference).
+    '''
+    i = 0
+    line = list(string)
+    result = list()
+
+    sub_str = list()
+    for i, sym in enumerate(line):
+        if ord(sym) in clr_set.keys():
+            sub_str.append('<span style="color: {}">'.format(
+                clr_set[ord(sym)]))
+            sub_str.append('{0:02x}'.format(ord(sym)).upper())
+            sub_str.append('</span>')
+        else:
+            sub_str.append('{0:02x}'.format(ord(sym)).upper())
+
+        if (i + 1)%2 == 0:
+            sub_str.append(' ')
+
+        if (i + 1)%bytes_in_row == 0:
+            result.append(''.join(sub_str))
+            sub_str = list()
+
+    if sub_str:
+        result.append(''.join(sub_str))
+
+    return result
+
+
+def make_chunks(size):
+    '''
+    Generate test chunks: printable text with line endings and plain text
+    without highlighted bytes.
+    '''
+    rnd = random.Random(0)
+    text = bytearray()
+    while len(text) < size:
+        line = bytes(rnd.randrange(0x20, 0x7F) for _ in range(
+            rnd.randrange(8, 80)))
+        text += line + b'\r\n'
+
+    plain = bytes(rnd.randrange(0x20, 0x7F) for _ in range(size))
+
+    return {'lines': bytes(text[:size]), 'plain': plain}
+
+
+def render(renderer, highlighter, data):
+    return renderer.render(data, highlighter.feed(data))
+
+
+def check(data):
+    highlighter = Highlighter(RULES)
+    for width in [1, 2, 3, 7, 16, 32]:
+        ref = add_html_colors(data.decode('latin-1'), bytes_in_row=width)
+        out = render(HexRenderer(width), highlighter, data)
+        if ref != out:
+            raise AssertionError('Output differs for row width {}'.format(
+                width))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    renderer = HexRenderer(16)
+    highlighter = Highlighter(RULES)
+    for name, data in make_chunks(size).items():
+        check(data)
+        for length in range(0, 40):
+            check(data[:length])
+
+        string = data.decode('latin-1')
+        old = min(timeit.repeat(lambda: add_html_colors(string),
+            number=repeats, repeat=3))
+        new = min(timeit.repeat(lambda: render(renderer, highlighter, data),
+            number=repeats, repeat=3))
+
+        print('{:6} {:7} B: old {:8.1f} MB/s, new {:8.1f} MB/s, x{:.1f}'.format(
+            name, size, size*repeats/old/1e6, size*repeats/new/1e6, old/new))
+
+
+if __name__ == '__main__':
+    main()
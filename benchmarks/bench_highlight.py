@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Throughput of Highlighter depending on the number of literal rules with
+random first symbols and with a shared prefix. Rules starting with up to
+MAX_REGEX_BRANCHES different symbols are matched by one trie regex, others
+by rolling hash of their prefixes in NumPy (cost doesn't grow with the
+number of rules). For comparison plain alternation of all rules in one
+regex is measured too.
+
+Run:
+    python3 ./benchmarks/bench_highlight.py [megabytes]
+'''
+
+import  os
+import  re
+import  sys
+import  time
+import  random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    highlight           import Highlighter
+from    highlight           import MAX_REGEX_BRANCHES
+
+
+def throughput(function, data, chunk=4096):
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk):
+        function(data[i:i + chunk])
+
+    return len(data)/(time.perf_counter() - start)/1e6
+
+
+def main():
+    size = int(float(sys.argv[1] if len(sys.argv) > 1 else 1)*1024*1024)
+
+    rnd = random.Random(0)
+    data = bytes(rnd.randrange(0x20, 0x7F) for _ in range(size))
+
+    print('Regex is used up to {} first symbols.'.format(
+        MAX_REGEX_BRANCHES))
+    for prefix in ['', 'ERR']:
+        for count in [2, 10, 30, 100, 1000, 10000]:
+            words = {prefix + ''.join(chr(rnd.randrange(0x21, 0x7F))
+                for _ in range(rnd.randrange(3, 10))) for _ in range(count)}
+            rules = [{'pattern': word, 'kind': 'text', 'color': '#AA0000'}
+                    for word in words]
+
+            start = time.perf_counter()
+            highlighter = Highlighter(rules)
+            compiled = time.perf_counter() - start
+            engine = type(highlighter.automaton).__name__ if \
+                    highlighter.automaton else 'regex'
+
+            alternation = re.compile(b'|'.join(re.escape(word.encode())
+                for word in words))
+
+            print('{:5} rules {:5}: {:11} {:6.1f} MB/s (compiled in '
+                  '{:.2f} s), alternation {:6.1f} MB/s'.format(count,
+                      repr(prefix), engine,
+                      throughput(highlighter.feed, data), compiled,
+                      throughput(lambda chunk: list(
+                          alternation.finditer(chunk)), data)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Loss test of the serial reader over pseudo terminal pair. Numbered lines are
+written to the master side with the rate of the given baudrate (8N1, 10 bits
+per byte), everything put in the model queue is compared with sent data and
+capture counters are printed for lossless and flushing modes.
+
+Run:
+    python3 ./benchmarks/bench_lossless.py [baudrate] [seconds]
+'''
+
+import  os
+import  sys
+import  time
+import  logging
+import  contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    config              import config
+from    model               import Model
+
+logging.disable(logging.INFO)
+
+
+def feed(master, rate, seconds, sent):
+    '''
+    Write numbered lines with average rate of 'rate' bytes per second.
+    '''
+    start = time.perf_counter()
+    n = 0
+    while time.perf_counter() - start < seconds:
+        # Amount of data which should be written till now
+        due = int((time.perf_counter() - start)*rate) - len(sent)
+        chunk = bytearray()
+        while len(chunk) < due:
+            chunk += b'%08d 0123456789abcdefghijklmnopqrstuvwxyz\r\n' % n
+            n += 1
+        if chunk:
+            os.write(master, chunk)
+            sent += chunk
+        time.sleep(0.001)
+
+
+def run(lossless, baudrate, seconds):
+    config['lossless'] = lossless
+
+    master, slave = os.openpty()
+    model = Model()
+    model.set_port(os.ttyname(slave))
+    model.start_reading()
+    model.start()
+
+    sent = bytearray()
+    feed(master, baudrate/10, seconds, sent)
+    # Let reader catch up
+    time.sleep(0.5)
+
+    model.stop()
+    model.join()
+    os.close(master)
+    os.close(slave)
+
+    received = list()
+    q = model.get_queue()
+    while q.qsize():
+        received.append(q.get_nowait()[0])
+    received = ''.join(received).encode('ASCII')
+
+    stats = model.capture_stats()
+    return (('lossless={:5}: sent {} B, received {} B, delivered {} B, '
+           'discarded {} B, identical: {}').format(str(lossless), len(sent),
+               stats['received'], stats['delivered'], stats['discarded'],
+               received == bytes(sent)))
+
+
+def main():
+    baudrate = int(sys.argv[1]) if len(sys.argv) > 1 else 921600
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for lossless in [True, False]:
+        # Model echoes received data to stdout
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                result = run(lossless, baudrate, seconds)
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
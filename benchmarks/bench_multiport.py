@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+CPU usage of monitoring many ports: one PortMux thread for all ports, one
+asyncio event loop thread with AsyncSerial per port and one Reader thread
+per port. Every port gets a short line every 10 ms over pseudo terminal
+pair.
+
+Run:
+    python3 ./benchmarks/bench_multiport.py [seconds]
+'''
+
+import  os
+import  sys
+import  time
+import  asyncio
+import  logging
+import  threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    multiport           import PortMux
+from    async_serial        import AsyncSerial
+from    reader              import Reader
+
+logging.disable(logging.INFO)
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+
+def feed(masters, seconds):
+    '''
+    Write line to every port each 10 ms and measure CPU time.
+    Returns:
+        CPU usage in percents.
+    '''
+    start, cpu = time.perf_counter(), cpu_time()
+    while time.perf_counter() - start < seconds:
+        for master in masters:
+            os.write(master, b'T=23.5 H=41.0 P=1013\n')
+        time.sleep(0.01)
+
+    return (cpu_time() - cpu)/(time.perf_counter() - start)*100
+
+
+def run_mux(ports, seconds):
+    received = [0]
+    mux = PortMux()
+    mux.subscribe('data', lambda name, data, decoded: received.__setitem__(
+        0, received[0] + len(data)))
+    mux.start()
+
+    pairs = [os.openpty() for _ in range(ports)]
+    for _, slave in pairs:
+        mux.add_port(os.ttyname(slave))
+
+    usage = feed([master for master, _ in pairs], seconds)
+
+    mux.stop()
+    mux.join()
+    for master, slave in pairs:
+        os.close(master)
+        os.close(slave)
+
+    return usage, received[0]
+
+
+def run_asyncio(ports, seconds):
+    received = [0]
+    pairs = [os.openpty() for _ in range(ports)]
+    loop = asyncio.new_event_loop()
+
+    async def read(port):
+        await port.open()
+        async for data, decoded in port:
+            received[0] += len(data)
+
+    tasks = [loop.create_task(read(AsyncSerial(os.ttyname(slave))))
+            for _, slave in pairs]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    usage = feed([master for master, _ in pairs], seconds)
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    for task in tasks:
+        task.cancel()
+    loop.close()
+    for master, slave in pairs:
+        os.close(master)
+        os.close(slave)
+
+    return usage, received[0]
+
+
+def run_threads(ports, seconds):
+    received = [0]
+    pairs = [os.openpty() for _ in range(ports)]
+    readers = list()
+    for _, slave in pairs:
+        reader = Reader(os.ttyname(slave))
+        reader.subscribe('data', lambda data, decoded: received.__setitem__(
+            0, received[0] + len(data)))
+        reader.set_port(reader.port)
+        reader.start_reading()
+        reader.start()
+        readers.append(reader)
+
+    usage = feed([master for master, _ in pairs], seconds)
+
+    for reader in readers:
+        reader.stop()
+        reader.join()
+    for master, slave in pairs:
+        os.close(master)
+        os.close(slave)
+
+    return usage, received[0]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    for ports in [1, 4, 8, 16]:
+        mux, mux_bytes = run_mux(ports, seconds)
+        aio, aio_bytes = run_asyncio(ports, seconds)
+        threads, threads_bytes = run_threads(ports, seconds)
+        print('{:2} ports: one thread {:5.1f}% CPU ({} B), asyncio '
+              '{:5.1f}% CPU ({} B), thread per port {:5.1f}% CPU '
+              '({} B)'.format(ports, mux, mux_bytes, aio, aio_bytes, threads,
+                  threads_bytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+End-to-end benchmark of the receive pipeline: synthetic traffic is written
+to the master side of a pseudo terminal pair by a separate process, Model
+reads the slave side and View shows data (offscreen Qt platform, the usual
+GUI timer drives rendering). For every pattern and rate reports sustained
+throughput, byte loss, byte-to-display latency (p50/p99, weighted by
+bytes), CPU usage and RSS of the monitor process as JSON. Bytes dropped
+or spilled by the queue on overflow are reported too (see --policy).
+
+Patterns:
+    text    - sensor like lines
+    binary  - random bytes
+    burst   - text lines sent in bursts every 100 ms
+
+Run:
+    python3 ./benchmarks/bench_pipeline.py [--rates 11520,92160]
+        [--patterns text,binary,burst] [--seconds 5]
+        [--policy spill|drop_oldest|drop_newest] [--out results.json]
+'''
+
+import  os
+import  sys
+import  json
+import  time
+import  random
+import  logging
+import  platform
+import  argparse
+import  resource
+import  multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from    PyQt5.QtCore        import QTimer
+from    PyQt5.QtWidgets     import QApplication
+
+from    config              import config
+from    chunk_buffer        import ChunkBuffer
+from    model               import Model
+from    view                import View
+
+logging.disable(logging.INFO)
+
+# Period of bursts (seconds)
+BURST   = 0.1
+
+
+def make_data(pattern, size):
+    rnd = random.Random(0)
+    if pattern == 'binary':
+        return bytes(rnd.getrandbits(8) for _ in range(size))
+
+    data = bytearray()
+    n = 0
+    while len(data) < size:
+        data += b'%08d T=%.1f H=%.1f P=%d status ok\r\n' % (n,
+                rnd.uniform(-20, 40), rnd.uniform(0, 100),
+                rnd.randrange(950, 1050))
+        n += 1
+
+    return bytes(data[:size])
+
+
+def feed(master, pattern, rate, seconds, records):
+    '''
+    Write data with average rate of 'rate' bytes per second. Runs in a
+    separate process, (time, bytes sent so far) of every write are sent
+    back through 'records' connection.
+    '''
+    data = make_data(pattern, int(rate*seconds) + 1)
+    period = BURST if pattern == 'burst' else 0.001
+    sent = list()
+
+    start = time.monotonic()
+    written = 0
+    while written < len(data):
+        due = min(len(data), int((time.monotonic() - start)*rate))
+        while written < due:
+            written += os.write(master, data[written:due])
+        sent.append((time.monotonic(), written))
+        time.sleep(period)
+
+    records.send(sent)
+    records.close()
+
+
+class SizedBuffer(ChunkBuffer):
+    '''
+    Model queue which remembers number of received bytes of taken items.
+    '''
+
+    def __init__(self):
+        ChunkBuffer.__init__(self)
+        # Sizes of items taken but not shown yet
+        self.taken = list()
+        # Dropped bytes already accounted
+        self.dropped = 0
+
+    def get_nowait(self):
+        item, size = self.get_entry()
+        self.taken.append(size)
+        return item
+
+
+class BenchModel(Model):
+
+    def __init__(self):
+        Model.__init__(self)
+        self.queue = SizedBuffer()
+
+
+def percentile(weighted, fraction):
+    '''
+    Args:
+        weighted: sorted list of (value, weight).
+    '''
+    total = sum(weight for _, weight in weighted)
+    if not total:
+        return None
+
+    seen = 0
+    for value, weight in weighted:
+        seen += weight
+        if seen >= fraction*total:
+            return value
+
+    return weighted[-1][0]
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as fn:
+            return int(fn.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1e6
+    except (OSError, ValueError):
+        return None
+
+
+def run(app, pattern, rate, seconds):
+    master, slave = os.openpty()
+
+    model = BenchModel()
+    model.set_port(os.ttyname(slave))
+    model.start_reading()
+    model.start()
+
+    view = View()
+    view.set_end_cmd(lambda: None)
+    view.set_queue(model.get_queue())
+    view.show()
+
+    # Time when every received byte is shown
+    shown = list()
+    pane = view.main_pane
+    append = pane.appendText
+
+    def append_text(data):
+        append(data)
+        now = time.monotonic()
+        # Dropped bytes are reported before the taken ones, they advance
+        # the stream without being shown
+        dropped = model.queue.counters['dropped']
+        if dropped > model.queue.dropped:
+            shown.append((None, dropped - model.queue.dropped))
+            model.queue.dropped = dropped
+        shown.extend((now, size) for size in model.queue.taken)
+        model.queue.taken.clear()
+    pane.appendText = append_text
+
+    records, child_records = multiprocessing.Pipe(False)
+    feeder = multiprocessing.Process(target=feed, args=(master, pattern,
+        rate, seconds, child_records))
+
+    cpu = os.times()
+    start = time.monotonic()
+    feeder.start()
+    # Let GUI catch up after the feeder is done
+    QTimer.singleShot(int((seconds + 1)*1000), app.quit)
+    app.exec_()
+    wall = time.monotonic() - start
+    cpu_end = os.times()
+
+    sent = records.recv()
+    feeder.join()
+    model.stop()
+    model.join()
+    stats = model.queue.stats()
+    model.queue.close()
+    view.timer.stop()
+    view.close()
+    os.close(master)
+    os.close(slave)
+
+    # Latency of every shown byte: time of showing minus time of writing
+    latencies = list()
+    index, position = 0, 0
+    for when, size in shown:
+        end = position + size
+        while position < end and index < len(sent):
+            written_at, written = sent[index]
+            count = min(end, written) - position
+            if when is not None:
+                latencies.append((when - written_at, count))
+            position += count
+            if position >= written:
+                index += 1
+    latencies.sort()
+
+    total_sent = sent[-1][1] if sent else 0
+    total_shown = sum(size for when, size in shown if when is not None)
+    times = [when for when, _ in shown if when is not None]
+    first, last = (sent[0][0], times[-1]) if sent and times else (0, 0)
+
+    return {
+        'pattern': pattern,
+        'rate': rate,
+        'seconds': seconds,
+        'sent_bytes': total_sent,
+        'shown_bytes': total_shown,
+        'lost_bytes': total_sent - total_shown,
+        'dropped_bytes': stats['dropped'],
+        'spilled_bytes': stats['spilled'],
+        'throughput_bps': total_shown/(last - first) if last > first else 0,
+        'latency_p50_ms': 1000*(percentile(latencies, 0.5) or 0),
+        'latency_p99_ms': 1000*(percentile(latencies, 0.99) or 0),
+        'cpu_percent': 100*((cpu_end.user - cpu.user) + (cpu_end.system -
+            cpu.system))/wall,
+        'rss_mb': rss_mb(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline benchmark.')
+    parser.add_argument('--rates', default='11520,92160,460800',
+            help='comma separated rates, bytes per second')
+    parser.add_argument('--patterns', default='text,binary,burst',
+            help='comma separated patterns: text, binary, burst')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--policy', choices=['spill', 'drop_oldest',
+        'drop_newest'], help='queue overflow policy')
+    parser.add_argument('--out', help='write results to the file')
+    args = parser.parse_args()
+    if args.policy:
+        config['queue_policy'] = args.policy
+
+    # Feeder process inherits the pseudo terminal
+    multiprocessing.set_start_method('fork')
+    app = QApplication(sys.argv[:1])
+
+    # Model echoes received text to stdout, keep it for the report
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    results = list()
+    try:
+        for pattern in args.patterns.split(','):
+            for rate in args.rates.split(','):
+                results.append(run(app, pattern, int(rate), args.seconds))
+                print(json.dumps(results[-1]), file=sys.stderr)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: config[key] for key in ['read_chunk',
+            'render_budget_ms', 'render_min_chars', 'scrollback_lines',
+            'queue_max_bytes', 'queue_chunk', 'queue_policy']},
+        'results': results,
+    }
+
+    if args.out:
+        with open(args.out, 'w') as fn:
+            json.dump(report, fn, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Cost of the plot buffer: parsing of CSV lines and decimation of the last
+samples to pixel columns for growing number of kept samples. Decimation
+time should stay the same whatever number of samples is shown.
+
+Run:
+    python3 ./benchmarks/bench_plot.py [samples] [width]
+'''
+
+import  os
+import  sys
+import  time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import  numpy as np
+
+from    plot                import PlotBuffer
+
+
+def main():
+    samples = int(float(sys.argv[1]) if len(sys.argv) > 1 else 1 << 20)
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    buffer = PlotBuffer(samples, 4)
+    buffer.set_enabled(True)
+
+    # Parsing, reads of 100 lines as from the reader thread
+    lines = ''.join('{},{:.3f},{}\n'.format(i, np.sin(i/100), i % 1000)
+            for i in range(10000))
+    chunks = [lines[i:i + 2000] for i in range(0, len(lines), 2000)]
+    start = time.perf_counter()
+    for chunk in chunks:
+        buffer.feed(chunk)
+    elapsed = time.perf_counter() - start
+    print('feed: {:8.0f} lines/s'.format(10000/elapsed))
+
+    # Decimation with more and more samples in the buffer
+    buffer.clear()
+    rnd = np.random.default_rng(0)
+    for shown in [10**4, 10**5, 10**6, buffer.capacity]:
+        if shown > buffer.capacity or shown <= buffer.count:
+            continue
+        buffer.append(rnd.standard_normal((shown - buffer.count, 4),
+            dtype=np.float32), 4)
+        start = time.perf_counter()
+        for _ in range(20):
+            buffer.columns(width)
+        elapsed = (time.perf_counter() - start)/20
+        print('columns: {:8} samples -> {} px: {:6.2f} ms'.format(shown,
+            width, elapsed*1000))
+
+if __name__ == '__main__':
+    main()
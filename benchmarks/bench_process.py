@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Read latency of the reader thread (Reader in the GUI process) and of the
+reader process (reader_process.py) while the GUI process is busy. Lines
+with the send time are written to the master side of a pseudo terminal by
+a separate process, the slave side is read by the reader; the main process
+runs threads executing Python code (like formatting and rendering), which
+compete for the GIL with the reader thread. Reports latency from writing to
+reading (p50/p99/max, ms) and number of received lines for both modes as
+JSON.
+
+Run:
+    python3 ./benchmarks/bench_process.py [--seconds 5] [--rate 2000]
+        [--busy 2] [--out results.json]
+'''
+
+import  os
+import  sys
+import  json
+import  time
+import  tty
+import  queue
+import  logging
+import  argparse
+import  threading
+import  multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    config              import config
+from    reader              import Reader
+from    reader_process      import ProcessReader
+
+logging.disable(logging.INFO)
+
+
+def feed(fd, rate, seconds):
+    '''
+    Write a line with the send time (monotonic ns) rate times per second.
+    '''
+    period = 1/rate
+    deadline = time.monotonic() + seconds
+    next_time = time.monotonic()
+    while next_time < deadline:
+        os.write(fd, b'%d\n' % time.monotonic_ns())
+        next_time += period
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def busy(stop):
+    # Pure Python work holding the GIL, like rendering of a large chunk
+    while not stop.is_set():
+        sum(i*i for i in range(10000))
+
+
+class StampReader(Reader):
+    '''
+    Reader collecting read time and text of every chunk.
+    '''
+
+    def __init__(self, port):
+        Reader.__init__(self, port)
+        self.chunks = queue.SimpleQueue()
+
+    def deliver(self, data, decoded, stamp=None):
+        self.chunks.put((stamp, decoded))
+        Reader.deliver(self, data, decoded, stamp)
+
+
+def latencies(chunks):
+    '''
+    Returns:
+        Latency (ms) of every received line.
+    '''
+    result = list()
+    for stamp, text in chunks:
+        for line in text.split('\n'):
+            if line.isdigit():
+                result.append((stamp - int(line))/1e6)
+    return result
+
+
+def run(mode, args):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+
+    if mode == 'thread':
+        reader = StampReader(port)
+        reader.set_port(port)
+        reader.start_reading()
+        reader.start()
+    else:
+        config['port'] = port
+        reader = ProcessReader()
+        reader.start()
+        reader.set_port(port)
+        reader.start_reading()
+
+    stop = threading.Event()
+    workers = [threading.Thread(target=busy, args=(stop,), daemon=True)
+            for _ in range(args.busy)]
+    for worker in workers:
+        worker.start()
+
+    writer = multiprocessing.Process(target=feed, args=(master, args.rate,
+        args.seconds))
+    writer.start()
+    writer.join()
+    time.sleep(0.5)
+    stop.set()
+
+    chunks = list()
+    if mode == 'thread':
+        while not reader.chunks.empty():
+            chunks.append(reader.chunks.get())
+    else:
+        while True:
+            try:
+                msg = reader.queue.get_nowait()
+            except queue.Empty:
+                break
+            chunks.append((msg[5], msg[0]))
+
+    reader.stop()
+    os.close(master)
+    os.close(slave)
+
+    values = sorted(latencies(chunks))
+    if not values:
+        return {'mode': mode, 'lines': 0}
+    return {
+        'mode': mode,
+        'lines': len(values),
+        'p50_ms': round(values[len(values)//2], 3),
+        'p99_ms': round(values[int(len(values)*0.99)], 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rate', type=int, default=2000,
+            help='lines per second')
+    parser.add_argument('--busy', type=int, default=2,
+            help='number of busy threads in the GUI process')
+    parser.add_argument('--out', help='write results to JSON file')
+    args = parser.parse_args()
+
+    config['rx_eol'] = 1
+    results = {
+        'seconds': args.seconds,
+        'rate': args.rate,
+        'busy': args.busy,
+        'results': [run(mode, args) for mode in ('thread', 'process')],
+    }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as fn:
+            fn.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Benchmark of the serial reader thread over pseudo terminal pair. For every
+reader mode ('asyncio' - AsyncModel) prints CPU usage while the line is idle
+and latency from writing bytes to the port till they appear in the model
+queue.
+
+Run:
+    python3 ./benchmarks/bench_reader.py [idle seconds] [number of probes]
+'''
+
+import  os
+import  sys
+import  time
+import  logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    config              import config
+from    model               import Model
+from    model               import AsyncModel
+
+logging.disable(logging.INFO)
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+
+def run(mode, idle, probes):
+    config['reader_mode'] = mode
+
+    master, slave = os.openpty()
+    model = AsyncModel() if mode == 'asyncio' else Model()
+    model.set_port(os.ttyname(slave))
+    model.start_reading()
+    model.start()
+
+    # Idle line
+    start, cpu = time.perf_counter(), cpu_time()
+    time.sleep(idle)
+    idle_cpu = (cpu_time() - cpu)/(time.perf_counter() - start)*100
+
+    # Latency of small writes
+    latency = list()
+    for _ in range(probes):
+        start = time.perf_counter()
+        os.write(master, b'ping\n')
+        model.get_queue().get(timeout=5)
+        latency.append((time.perf_counter() - start)*1e3)
+        time.sleep(0.01)
+
+    model.stop()
+    model.join()
+    os.close(master)
+    os.close(slave)
+
+    latency.sort()
+    print('{:8}: idle CPU {:5.2f}%, latency p50 {:.3f} ms, p99 {:.3f} ms'.format(
+        mode, idle_cpu, latency[len(latency)//2],
+        latency[int(len(latency)*0.99)]))
+
+
+def main():
+    idle = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    probes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    for mode in ['poll', 'blocking', 'asyncio']:
+        run(mode, idle, probes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Benchmark of the text console scrollback. Appends chunks of log-like text
+and chunks without new lines (binary stream shown as is) and prints append
+rate and memory held by the scrollback, both should stay flat once the
+limits are reached.
+
+Run:
+    python3 ./benchmarks/bench_scrollback.py [number of chunks]
+'''
+
+import  os
+import  sys
+import  time
+import  tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    config              import config
+from    scrollback          import Scrollback
+
+
+CHUNKS = {
+    'lines': 'I (12345) wifi: state: run -> auth (b0)\r\n'*2,
+    'no newline': 'x'*84,
+}
+
+
+def run(name, chunk, chunks):
+    print(name)
+    tracemalloc.start()
+    scrollback = Scrollback(config['scrollback_lines'],
+            config['scrollback_bytes'], config['rx_max_line'])
+
+    step = chunks//10
+    start = time.perf_counter()
+    for i in range(1, chunks + 1):
+        scrollback.append(chunk)
+        if i % step == 0:
+            now = time.perf_counter()
+            current, _ = tracemalloc.get_traced_memory()
+            print('{:9} chunks: {:8.0f} appends/s, {:7} lines, {:7.1f} MB'.format(
+                i, step/(now - start), len(scrollback), current/2**20))
+            start = time.perf_counter()
+
+    del scrollback
+    tracemalloc.stop()
+
+
+def main():
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    for name, chunk in CHUNKS.items():
+        run(name, chunk, chunks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Time of finding a pattern at the very end of the spooled stream (worst case
+for forward search) for text, HEX and regex patterns. The stream is written
+through StreamSpool, so it's split into segment files like the received
+one, with the budget large enough to keep all of it.
+
+Run:
+    python3 ./benchmarks/bench_search.py [megabytes]
+'''
+
+import  os
+import  sys
+import  time
+import  threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from    config              import config
+from    search              import StreamSpool
+from    search              import StreamSearch
+
+
+def make_stream(spool, megabytes):
+    line = b'T=23.5 H=41.0 P=1013 status ok\r\n'
+    block = line*(1024*1024//len(line))
+    for _ in range(megabytes):
+        spool.write(block)
+    spool.write(b'MARKER \xde\xad\xbe\xef end\n')
+    spool.flush()
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+
+    # Kept part of the spool is at least (SEGMENTS - 1)/SEGMENTS of budget
+    spool = StreamSpool(max(config['search_spool_max'],
+        2*(megabytes + 1)*1024*1024))
+    try:
+        make_stream(spool, megabytes)
+
+        found = threading.Event()
+        search = StreamSearch(spool.directory)
+        search.subscribe('found', lambda offset, length: found.set())
+        search.start()
+
+        for pattern, kind in [('MARKER', 'text'), ('DE AD BE EF', 'hex'),
+                (r'MARKER .{4} end', 'regex'), ('absent', 'text')]:
+            found.clear()
+            start = time.perf_counter()
+            search.find(pattern, kind)
+            found.wait()
+            print('{:6} {:18} {:7.3f} s'.format(kind, pattern,
+                time.perf_counter() - start))
+
+        search.stop()
+    finally:
+        spool.close()
+
+
+if __name__ == '__main__':
+    main()
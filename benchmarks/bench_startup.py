@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Compare startup time and memory (max RSS) of headless capture and GUI. Each
+path is started in a new interpreter which imports everything needed and
+creates reader (and window for GUI) without opening the port.
+
+Run:
+    python3 ./benchmarks/bench_startup.py [repeats]
+'''
+
+import  os
+import  sys
+import  time
+import  subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+PATHS = {
+    'headless': '''
+import headless
+from reader import Reader
+Reader()
+''',
+    'gui': '''
+import sys
+from PyQt5.QtWidgets import QApplication
+from view import View
+from model import Model
+app = QApplication(sys.argv)
+View()
+Model()
+''',
+}
+
+
+def measure(code):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status:
+        raise RuntimeError('Process failed with status {}'.format(status))
+
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss/1024
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    for name, code in PATHS.items():
+        results = [measure(code) for _ in range(repeats)]
+        print('{:8}: startup {:6.1f} ms, max RSS {:6.1f} MB'.format(name,
+            min(r[0] for r in results)*1e3, min(r[1] for r in results)))
+
+
+if __name__ == '__main__':
+    main()
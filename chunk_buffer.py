@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Bounded buffer between the reader thread and the GUI, replaces unbounded
+queue.Queue. Items are aggregated into chunks (lists of items) of about
+'chunk' received bytes, so the buffer holds few large objects and overflow
+is handled per chunk. Size of the buffer is counted in received bytes of
+its items.
+
+put() never blocks the producer. When the buffer is full:
+    'drop_oldest' - the oldest chunks are dropped,
+    'drop_newest' - the new item is dropped,
+    'spill'       - complete chunks are written to a temporary file and read
+                    back in order when the consumer catches up (new items
+                    are dropped when the spill file reaches its limit).
+Dropped bytes are counted, so they can be reported.
+
+Chunks are pickled and written to the spill file by a separate thread
+without holding the lock, so put() doesn't wait for the disk. Chunks
+waiting for the spill thread stay in memory (at most max_bytes of them, new
+items are dropped beyond that) and the consumer takes them directly when it
+gets to them before they are written.
+'''
+
+# System imports
+import  os
+import  queue
+import  pickle
+import  struct
+import  logging
+import  tempfile
+import  threading
+import  collections
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+SPILL       = 'spill'
+POLICIES    = [DROP_OLDEST, DROP_NEWEST, SPILL]
+
+# Spilled chunk: length of pickled chunk, followed by the chunk
+SPILLED     = struct.Struct('<I')
+
+
+class Chunk:
+    '''
+    Items put back to back. Items are taken from the front by position.
+    '''
+
+    __slots__ = ('items', 'sizes', 'size', 'position')
+
+    def __init__(self, items=None, sizes=None):
+        self.items      = items or list()
+        self.sizes      = sizes or list()
+        # Received bytes of not taken items
+        self.size       = sum(self.sizes)
+        self.position   = 0
+
+    def __len__(self):
+        return len(self.items) - self.position
+
+
+class ChunkBuffer:
+    '''
+    Bounded FIFO with one producer and one consumer, compatible with the
+    part of queue.Queue interface used by consoles (put(), get(),
+    get_nowait(), qsize(), empty()).
+    '''
+
+    def __init__(self, max_bytes=None, policy=None, chunk=None,
+            spill_max=None):
+        '''
+        Args (config values are used for None):
+            max_bytes: maximum received bytes of items kept in memory.
+            policy: 'drop_oldest', 'drop_newest' or 'spill'.
+            chunk: received bytes aggregated into one chunk.
+            spill_max: maximum size of the spill file (bytes).
+        Raises:
+            ValueError for unknown policy.
+        '''
+        max_bytes = max_bytes or config['queue_max_bytes']
+        policy = policy or config['queue_policy']
+        chunk = chunk or config['queue_chunk']
+        spill_max = spill_max or config['queue_spill_max']
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy: {}.'.format(policy))
+
+        self.max_bytes  = max_bytes
+        self.policy     = policy
+        self.chunk      = chunk
+        self.spill_max  = spill_max
+        # Received bytes put, dropped and written to the spill file
+        self.counters   = {'put': 0, 'dropped': 0, 'spilled': 0}
+
+        # Complete chunks in memory, chunks in the spill file (offset,
+        # length, received bytes, number of items), complete chunks waiting
+        # for the spill thread and chunk being filled.
+        # Order of items: memory, spill file, writing, tail.
+        self._memory    = collections.deque()
+        self._spill     = collections.deque()
+        self._writing   = collections.deque()
+        self._tail      = Chunk()
+        # Received bytes and number of items in memory (writing included)
+        # and in the spill file, received bytes waiting for the spill thread
+        self._size      = 0
+        self._count     = 0
+        self._spill_size = 0
+        self._spill_count = 0
+        self._writing_size = 0
+        # Spill file (created on first use) and its end
+        self._spill_fd  = None
+        self._spill_end = 0
+        self._lock      = threading.Lock()
+        self._cond      = threading.Condition(self._lock)
+        # Spill thread (started on first use) waits for chunks on this
+        self._spiller   = None
+        self._spill_cond = threading.Condition(self._lock)
+        self._closed    = False
+
+    def put(self, item, size=1):
+        '''
+        Add item, never blocks.
+        Args:
+            item: any object (picklable for 'spill' policy).
+            size: received bytes of the item.
+        Returns:
+            False if item is dropped.
+        '''
+        with self._cond:
+            self.counters['put'] += size
+            if self._size + size > self.max_bytes and \
+                    not self._make_room(size):
+                self.counters['dropped'] += size
+                return False
+
+            tail = self._tail
+            tail.items.append(item)
+            tail.sizes.append(size)
+            tail.size += size
+            self._size += size
+            self._count += 1
+            if tail.size >= self.chunk:
+                self._seal()
+
+            self._cond.notify()
+
+        return True
+
+    def _make_room(self, size):
+        '''
+        Apply overflow policy.
+        Returns:
+            True if item of the size can be added.
+        '''
+        if self.policy == DROP_OLDEST:
+            while self._size + size > self.max_bytes:
+                if not self._memory:
+                    if not self._tail.size:
+                        break
+                    self._seal()
+                    continue
+                chunk = self._memory.popleft()
+                self.counters['dropped'] += chunk.size
+                self._size -= chunk.size
+                self._count -= len(chunk)
+            return self._size + size <= self.max_bytes
+
+        if self.policy == SPILL:
+            if self._writing_size + size > self.max_bytes:
+                # Spill thread doesn't keep up with the disk
+                return False
+            # Start spilling, from now on the tail goes to the file when it's
+            # complete
+            if not (self._spill or self._writing) and self._tail.size:
+                self._seal(spill=True)
+            return True
+
+        return False
+
+    def _seal(self, spill=False):
+        '''
+        Move the tail to memory or hand it to the spill thread. Once
+        something is spilled, next chunks are spilled too, so order is kept.
+        '''
+        tail, self._tail = self._tail, Chunk()
+        if not (spill or self._spill or self._writing):
+            self._memory.append(tail)
+            return None
+
+        self._writing.append(tail)
+        self._writing_size += tail.size
+        if self._spiller is None:
+            self._spiller = threading.Thread(target=self._run_spill,
+                    daemon=True)
+            self._spiller.start()
+        self._spill_cond.notify()
+
+    def _run_spill(self):
+        '''
+        Spill thread: write chunks handed by _seal() to the spill file.
+        Pickling and writing are done without holding the lock.
+        '''
+        while True:
+            with self._lock:
+                self._spill_cond.wait_for(lambda: self._writing or
+                        self._closed)
+                if self._closed:
+                    return None
+                chunk = self._writing[0]
+                offset = self._spill_end
+
+            data = pickle.dumps((chunk.items, chunk.sizes),
+                    pickle.HIGHEST_PROTOCOL)
+            length = SPILLED.size + len(data)
+            error = None
+            if offset + length > self.spill_max:
+                # Spill file is full, chunk is lost
+                error = False
+            else:
+                try:
+                    if self._spill_fd is None:
+                        self._spill_fd = tempfile.TemporaryFile(prefix='pysm-')
+                    os.pwrite(self._spill_fd.fileno(),
+                            SPILLED.pack(len(data)) + data, offset)
+                except OSError as e:
+                    error = e
+
+            with self._lock:
+                if not self._writing or self._writing[0] is not chunk:
+                    # Taken by the consumer or the buffer is closed
+                    continue
+                self._writing.popleft()
+                self._writing_size -= chunk.size
+                # Written or dropped items don't take memory
+                self._size -= chunk.size
+                self._count -= len(chunk)
+                if error is not None:
+                    if error:
+                        logger.error('Fail to spill received data: {}'.format(
+                            error))
+                    self.counters['dropped'] += chunk.size
+                    continue
+
+                self._spill.append((offset, length, chunk.size, len(chunk)))
+                self._spill_end = offset + length
+                self._spill_size += chunk.size
+                self._spill_count += len(chunk)
+                self.counters['spilled'] += chunk.size
+
+    def _load(self):
+        '''
+        Read the oldest spilled chunk back to memory. Called by the consumer
+        when memory is empty, file is read without holding the lock.
+        Returns:
+            False if nothing is spilled.
+        '''
+        with self._cond:
+            if not self._spill:
+                return False
+            offset, length, size, count = self._spill[0]
+
+        data = os.pread(self._spill_fd.fileno(), length, offset)
+        items, sizes = pickle.loads(data[SPILLED.size:])
+
+        with self._cond:
+            self._spill.popleft()
+            self._memory.appendleft(Chunk(items, sizes))
+            self._spill_size -= size
+            self._spill_count -= count
+            self._size += size
+            self._count += count
+            if not self._spill and not self._writing:
+                # Nothing is left in the file, start from its beginning
+                self._spill_end = 0
+
+        return True
+
+    def get_entry(self):
+        '''
+        Take the oldest item.
+        Returns:
+            (item, received bytes of the item).
+        Raises:
+            queue.Empty if buffer is empty.
+        '''
+        with self._cond:
+            if not self._memory and not self._spill:
+                if self._writing:
+                    # Not written yet, the spill thread drops its copy
+                    chunk = self._writing.popleft()
+                    self._writing_size -= chunk.size
+                    self._memory.append(chunk)
+                    if not self._writing:
+                        self._spill_end = 0
+                elif self._tail.size:
+                    self._seal()
+            loaded = bool(self._memory) or not self._spill
+
+        if not loaded:
+            self._load()
+
+        with self._cond:
+            if not self._memory:
+                raise queue.Empty
+
+            chunk = self._memory[0]
+            item = chunk.items[chunk.position]
+            size = chunk.sizes[chunk.position]
+            # Taken item isn't referenced by the buffer
+            chunk.items[chunk.position] = None
+            chunk.position += 1
+            chunk.size -= size
+            if not len(chunk):
+                self._memory.popleft()
+            self._size -= size
+            self._count -= 1
+
+        return item, size
+
+    def get_nowait(self):
+        return self.get_entry()[0]
+
+    def get(self, block=True, timeout=None):
+        '''
+        Take the oldest item, wait for it if buffer is empty.
+        Raises:
+            queue.Empty if nothing is put in time.
+        '''
+        if block:
+            with self._cond:
+                if not self._cond.wait_for(self.qsize, timeout):
+                    raise queue.Empty
+
+        return self.get_nowait()
+
+    def qsize(self):
+        '''
+        Returns:
+            Number of items in memory and in the spill file.
+        '''
+        return self._count + self._spill_count
+
+    def empty(self):
+        return not self.qsize()
+
+    def stats(self):
+        '''
+        Returns:
+            Dictionary with counters and received bytes kept in memory
+            ('size') and in the spill file ('spill_size').
+        '''
+        with self._cond:
+            stats = dict(self.counters)
+            stats['size'] = self._size
+            stats['spill_size'] = self._spill_size
+
+        return stats
+
+    def close(self):
+        '''
+        Stop the spill thread and remove the spill file.
+        '''
+        with self._cond:
+            self._closed = True
+            self._spill_cond.notify()
+        if self._spiller is not None and \
+                self._spiller is not threading.current_thread():
+            self._spiller.join()
+
+        with self._cond:
+            if self._spill_fd is not None:
+                self._spill_fd.close()
+                self._spill_fd = None
+            self._spill.clear()
+            self._spill_end = self._spill_size = self._spill_count = 0
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Formatting of received chunks for the consoles, shared by the reader
+thread (Model), the port monitor (MuxModel) and the reader process
+(ChildReader), so every console gets the same messages.
+'''
+
+# System imports
+import  time
+
+from config import config
+from hex_render import HexRenderer
+from highlight import Highlighter
+from metrics import Histogram
+
+
+class ChunkFormatter:
+    '''
+    Converts chunks of one stream into messages of console queues:
+        [decoded text, HEX representation, offset of the chunk in the
+        stream (None if stream isn't spooled), highlighted parts started in
+        the previous chunks (number of bytes before this chunk and color),
+        time of putting in the queue, time of reading]
+    Highlighting state is kept between chunks, so one formatter is used
+    per stream.
+    '''
+
+    def __init__(self, hex_time=None):
+        '''
+        Args:
+            hex_time: histogram of formatting time (us), updated only by the
+                thread calling format(); formatter has its own if None.
+        '''
+        # Converter of received bytes to HEX representation
+        self.hex_renderer = HexRenderer(config['hex_bytes_in_row'])
+        self.highlighter = Highlighter()
+        self.hex_time   = hex_time or Histogram('us')
+
+    def format(self, data, decoded, spool=None, stamp=None):
+        '''
+        Args:
+            data: received bytes.
+            decoded: decoded text of the bytes.
+            spool: StreamSpool the chunk is written to (None - stream isn't
+                spooled).
+            stamp: time of reading (time.monotonic_ns()), now if None.
+        Returns:
+            Message for the console queue.
+        '''
+        begin = time.perf_counter_ns()
+        spans = self.highlighter.feed(data) if config['hex_colors'] else ()
+        hex_repr = self.hex_renderer.render(data, spans)
+        # Matches started in the previous chunks: number of bytes before
+        # this chunk and color
+        carry = [(-start, color) for start, end, color in spans if start < 0]
+        self.hex_time.record((time.perf_counter_ns() - begin)//1000)
+
+        offset = spool.offset - len(data) if spool else None
+        # Monotonic clock is shared by processes, so queue age is valid in
+        # the main process too
+        return [decoded, hex_repr, offset, carry, time.monotonic(),
+                stamp or time.monotonic_ns()]
@@ -28,15 +28,142 @@ config = {
         # STOPBITS_TWO)
         'stopbits': s.STOPBITS_ONE,
 
+        # Reading mode: 'blocking' - thread sleeps until data arrives,
+        # 'poll' - port is checked every 5 ms, 'asyncio' - port is watched
+        # by asyncio event loop of the GUI model (async_serial.py), other
+        # readers read as in 'blocking' mode
+        'reader_mode': 'blocking',
+        # Maximum number of bytes read at once
+        'read_chunk': 64*1024,
+        # Lossless capture: input buffer is never flushed after reading
+        'lossless': True,
+        # Encoding of received data
+        'encoding': 'utf-8',
+        # Bytes which can't be decoded: 'replace' - replaced with U+FFFD,
+        # 'escape' - shown as \xNN
+        'decode_errors': 'escape',
+        # Delimiter of received lines, index in 'eol' list (0 - data is shown
+        # as it arrives, without framing)
+        'rx_eol': 0,
+        # Incomplete line longer than this is shown as is, without new line
+        # (the console wraps it at this length)
+        'rx_max_line': 64*1024,
+        # Binary framing of received bytes instead of text decoding: None,
+        # 'slip', 'cobs' or 'length' (length of payload with CRC before it,
+        # frame_length_size bytes in frame_length_order). Optional CRC at the
+        # end of frame: None, 'crc16' (CCITT, initial 0xFFFF, big endian) or
+        # 'crc32' (zlib, little endian). Longer frames are dropped.
+        'framing': None,
+        'frame_crc': None,
+        'frame_length_size': 2,
+        'frame_length_order': 'big',
+        'frame_max': 64*1024,
+
         # Settings
         #======================================================================
         'scan_timeout': 3,
+        # Interval (seconds) of port list checks when udev isn't available
+        'scan_interval': 1,
+        # Scrollback of the text and HEX consoles. When one of the limits is
+        # reached the oldest lines are dropped (0 - no limit on size)
+        'scrollback_lines': 100000,
+        'scrollback_bytes': 32*1024*1024,
+        # Buffer of received data waiting for the consoles: maximum received
+        # bytes kept in memory, received bytes aggregated into one chunk and
+        # overflow policy: 'drop_oldest', 'drop_newest' or 'spill' (to a
+        # temporary file of at most queue_spill_max bytes)
+        'queue_max_bytes': 8*1024*1024,
+        'queue_chunk': 64*1024,
+        'queue_policy': 'spill',
+        'queue_spill_max': 1024*1024*1024,
+        # Read, decode and format received data in a child process
+        # (reader_process.py), formatted data is passed to the GUI through
+        # a shared memory ring of process_ring_size bytes. Commands to the
+        # child time out after process_timeout seconds. Raw bytes for 'data'
+        # subscribers (fan-out, file transfer) wait for the pipe in a buffer
+        # of process_forward_max bytes, newer bytes are dropped when it's full.
+        'reader_process': False,
+        'process_ring_size': 16*1024*1024,
+        'process_timeout': 5,
+        'process_forward_max': 4*1024*1024,
+        # Time (ms) which consoles can spend on drawing received data in one
+        # GUI tick and minimum number of characters drawn per tick
+        'render_budget_ms': 30,
+        'render_min_chars': 4096,
+        # Show arrival time of every line (seconds since the first line) in
+        # the text console
+        'line_times': False,
+        # Minimal time (seconds) between records in session index
+        'record_interval': 0.01,
+        # Continuous compressed log of received bytes for long runs
+        # (rotating_log.py): directory (None - not logged), codec ('gzip' or
+        # 'zstd', zstd requires zstandard module) and level, size of
+        # uncompressed chunk compressed at once (unit of seeking) and time
+        # (seconds) after which incomplete chunk is written anyway. File is
+        # rotated when it reaches size (bytes) or age (seconds, 0 - never),
+        # the oldest files are removed to keep the directory within the
+        # budget (bytes, 0 - no limit). Received bytes are dropped if more
+        # than log_max_pending bytes wait for compression.
+        'log_dir': None,
+        'log_codec': 'gzip',
+        'log_level': 6,
+        'log_chunk': 256*1024,
+        'log_flush': 1.0,
+        'log_max_size': 64*1024*1024,
+        'log_max_age': 3600,
+        'log_budget': 1024*1024*1024,
+        'log_max_pending': 64*1024*1024,
+        # Sync log files to disk after every chunk (survives power loss)
+        'log_fsync': True,
+        # Speed of session replay: 1 - original timing, 0 - as fast as
+        # possible
+        'replay_speed': 1.0,
+        # Minimal time (ms) between sent commands (0 - commands queued back
+        # to back are written at once, up to tx_max_batch bytes)
+        'tx_pacing_ms': 0,
+        'tx_max_batch': 4096,
+        # File transfer: chunk of raw transfer (bytes), time (seconds) to
+        # wait for XMODEM/YMODEM receiver response and number of attempts
+        # to send a block
+        'transfer_chunk': 4096,
+        'transfer_timeout': 10,
+        'transfer_retries': 10,
+        # Spool received stream to temporary files, so it can be searched
+        # beyond the scrollback. At most search_spool_max bytes (the last
+        # ones, at least 7/8 of it) are kept, 0 - no limit
+        'search_spool': True,
+        'search_spool_max': 256*1024*1024,
+        # Size of the chunk scanned at once and maximum length of the regex
+        # match which is found across chunk boundary
+        'search_chunk': 16*1024*1024,
+        'search_overlap': 4096,
+        # Fan-out server re-broadcasting received bytes to local clients
+        # (fanout.py): address ('PORT', 'HOST:PORT' or Unix socket path,
+        # None - disabled), maximum number of clients and bytes buffered
+        # per client (more is dropped for the slow client)
+        'fanout_address': None,
+        'fanout_max_clients': 16,
+        'fanout_client_buffer': 4*1024*1024,
+        # Port of local HTTP endpoint with pipeline metrics (0 - disabled)
+        'metrics_port': 0,
+        # Plot of numbers found in received lines: number of kept samples
+        # (power of two), maximum number of channels (numbers taken from one
+        # line), shown samples (0 - all kept) and refresh rate
+        'plot_capacity': 1 << 20,
+        'plot_channels': 4,
+        'plot_window': 0,
+        'plot_fps': 20,
         # HEX console coloring
         'hex_colors': True,
         'hex_bytes_in_row': 16,
-        # Colors definition for highlitning
-        'clr_set':  {
-            0x0A: '#0000AA',
-            0x0D: '#00AA00'
-        }
+        # Highlighting rules of both consoles. Kind is 'text', 'hex' (bytes,
+        # e.g. 'DE AD BE EF') or 'regex' (matched against received bytes in
+        # HEX console and against decoded text in text console)
+        'highlight_rules': [
+            {'pattern': '0A', 'kind': 'hex', 'color': '#0000AA'},
+            {'pattern': '0D', 'kind': 'hex', 'color': '#00AA00'},
+        ],
+        # Maximum length of the regex match which is found across boundary
+        # of received chunks
+        'highlight_overlap': 256,
 }
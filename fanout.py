@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Local server sharing the port with other programs. Received bytes are
+re-broadcast to every client connected over TCP or Unix socket, bytes sent
+by clients are written to the port (through Writer, like commands of the
+GUI). Clients are serviced by one selector thread.
+
+Every client has its own buffer, so a slow client doesn't delay the reader
+or other clients: broadcast() only appends to the buffers, when buffer of a
+client exceeds fanout_client_buffer the new data is dropped for this client
+(and counted).
+
+Address is 'PORT' or 'HOST:PORT' for TCP (host defaults to 127.0.0.1) or
+path of Unix socket (contains '/').
+
+Run as a client (stream goes to stdout, stdin is sent to the port):
+    python3 ./fanout.py 127.0.0.1:7000
+'''
+
+# System imports
+import  os
+import  sys
+import  stat
+import  socket
+import  logging
+import  selectors
+import  threading
+import  collections
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    '''
+    Args:
+        address: 'PORT', 'HOST:PORT' or path of Unix socket.
+    Returns:
+        (socket family, address for bind()/connect()).
+    Raises:
+        ValueError if address is invalid.
+    '''
+    address = str(address)
+    if '/' in address:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix sockets aren\'t supported.')
+        return socket.AF_UNIX, address
+
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Invalid address: {}.'.format(address))
+    if not 0 <= port < 65536:
+        raise ValueError('Invalid port: {}.'.format(port))
+
+    return socket.AF_INET, (host.strip('[]') or '127.0.0.1', port)
+
+
+class Client:
+    '''
+    Connected client: socket and bytes waiting to be sent to it.
+    '''
+
+    def __init__(self, sock, name):
+        self.sock       = sock
+        self.name       = name
+        self.pending    = collections.deque()
+        # Bytes in pending, offset of unsent part of the first item
+        self.size       = 0
+        self.offset     = 0
+        # Bytes sent to the client, received from it and dropped
+        self.counters   = {'sent': 0, 'received': 0, 'dropped': 0}
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class FanoutServer(threading.Thread):
+    '''
+    Thread serving clients of the fan-out server.
+    Events:
+        'clients': number of connected clients
+    '''
+
+    def __init__(self, address, write=None):
+        '''
+        Args:
+            address: address to listen on (see parse_address()).
+            write: function called with bytes received from clients
+                (e.g. Writer.send), data is discarded if None.
+        Raises:
+            ValueError if address is invalid, OSError if it can't be bound.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.write      = write
+        self.running    = True
+        self.max_buffer = config['fanout_client_buffer']
+        self.clients    = dict()
+        # Counters of disconnected clients
+        self.counters   = {'sent': 0, 'received': 0, 'dropped': 0}
+        # Clients are changed by the thread, their buffers by broadcast()
+        self._lock      = threading.Lock()
+
+        family, self.address = parse_address(address)
+        self.family     = family
+        if family == socket.AF_INET:
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self._remove_stale(self.address)
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.sock.bind(self.address)
+            self.sock.listen()
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+        if family == socket.AF_INET:
+            # Port 0 - bound to a free port
+            self.address = self.sock.getsockname()[:2]
+
+        self._selector  = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ, None)
+        # Thread is woken up by writing to the pipe when data is queued
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, self)
+
+    @staticmethod
+    def _remove_stale(path):
+        # Socket left by the previous run
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def run(self):
+        '''
+        Run thread. Accepts clients, reads from them and sends buffered
+        data to clients which can take it.
+        '''
+        while self.running:
+            for key, events in self._selector.select():
+                if key.data is None:
+                    self._accept()
+                elif key.data is self:
+                    self._process_wake()
+                else:
+                    if events & selectors.EVENT_READ:
+                        self._receive(key.data)
+                    if events & selectors.EVENT_WRITE and \
+                            key.data.name in self.clients:
+                        self._send(key.data)
+
+        for client in list(self.clients.values()):
+            self._close(client)
+        self._selector.close()
+        self.sock.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        if self.family != socket.AF_INET:
+            self._remove_stale(self.address)
+
+    def _accept(self):
+        try:
+            sock, address = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError as e:
+            logger.error('Fail to accept client: {}'.format(e))
+            return None
+
+        if len(self.clients) >= config['fanout_max_clients']:
+            logger.warning('Too many clients, connection is refused.')
+            sock.close()
+            return None
+
+        sock.setblocking(False)
+        if self.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            name = '{}:{}'.format(*address[:2])
+        else:
+            name = 'unix:{}'.format(sock.fileno())
+
+        client = Client(sock, name)
+        with self._lock:
+            self.clients[name] = client
+        self._selector.register(client, selectors.EVENT_READ, client)
+        logger.debug('Client {} is connected.'.format(name))
+        self.notify('clients', len(self.clients))
+
+    def _receive(self, client):
+        try:
+            data = client.sock.recv(config['read_chunk'])
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError as e:
+            logger.debug('Fail to read from {}: {}'.format(client.name, e))
+            data = b''
+
+        if not data:
+            self._close(client)
+            return None
+
+        client.counters['received'] += len(data)
+        if self.write:
+            self.write(data)
+
+    def _send(self, client):
+        '''
+        Send as much of the buffered data as the client takes.
+        '''
+        while True:
+            with self._lock:
+                if not client.pending:
+                    break
+                data = memoryview(client.pending[0])[client.offset:]
+
+            try:
+                sent = client.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                return None
+            except OSError as e:
+                logger.debug('Fail to send to {}: {}'.format(client.name, e))
+                self._close(client)
+                return None
+
+            client.counters['sent'] += sent
+            with self._lock:
+                client.size -= sent
+                if sent < len(data):
+                    client.offset += sent
+                    return None
+                client.pending.popleft()
+                client.offset = 0
+
+        # Everything is sent, wait only for reading
+        self._selector.modify(client, selectors.EVENT_READ, client)
+
+    def _process_wake(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        for client in list(self.clients.values()):
+            if client.size:
+                self._selector.modify(client, selectors.EVENT_READ |
+                        selectors.EVENT_WRITE, client)
+
+    def _close(self, client):
+        with self._lock:
+            if self.clients.pop(client.name, None) is None:
+                return None
+            for name, value in client.counters.items():
+                self.counters[name] += value
+        try:
+            self._selector.unregister(client)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        logger.debug('Client {} is disconnected.'.format(client.name))
+        self.notify('clients', len(self.clients))
+
+    def broadcast(self, data, decoded=None):
+        '''
+        Queue received bytes for every client, never blocks. Can be
+        subscribed to 'data' event of Reader.
+        Args:
+            data: received bytes.
+            decoded: ignored.
+        '''
+        if not data:
+            return None
+
+        with self._lock:
+            if not self.clients:
+                return None
+            for client in self.clients.values():
+                if client.size + len(data) > self.max_buffer:
+                    client.counters['dropped'] += len(data)
+                    continue
+                client.pending.append(data)
+                client.size += len(data)
+
+        try:
+            os.write(self._wake_w, b'x')
+        except BlockingIOError:
+            # Thread is already woken up
+            pass
+
+    def stats(self):
+        '''
+        Returns:
+            Dictionary with number of clients and bytes sent to, received
+            from and dropped for all clients (also disconnected) and bytes
+            waiting in client buffers ('pending').
+        '''
+        with self._lock:
+            stats = dict(self.counters)
+            stats['clients'] = len(self.clients)
+            stats['pending'] = 0
+            for client in self.clients.values():
+                for name, value in client.counters.items():
+                    stats[name] += value
+                stats['pending'] += client.size
+
+        return stats
+
+    def stop(self):
+        '''
+        Stop thread, all clients are disconnected.
+        '''
+        self.running = False
+        try:
+            os.write(self._wake_w, b'x')
+        except (BlockingIOError, OSError):
+            pass
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        server thread.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
+
+
+def connect(address):
+    '''
+    Connect to the server, copy the stream to stdout and stdin to the
+    server until the server closes the connection. Input is sent as soon as
+    it's read (not by lines), end of input is passed to the server, which
+    closes the connection then.
+    '''
+    family, address = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+
+    def send():
+        fd = sys.stdin.fileno()
+        try:
+            while True:
+                data = os.read(fd, 4096)
+                if not data:
+                    break
+                sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            # Connection is closed
+            pass
+
+    threading.Thread(target=send, daemon=True).start()
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: {} HOST:PORT|PATH'.format(sys.argv[0]))
+        sys.exit(1)
+
+    connect(sys.argv[1])
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Decoders of binary framed protocols: SLIP (RFC 1055), COBS and length
+prefixed frames, optionally followed by CRC-16 (CCITT, initial value 0xFFFF,
+big endian) or CRC-32 (zlib, little endian).
+
+Received bytes are appended to one reusable buffer of the decoder, frames
+are found by searching the buffer in place and read through memoryview, so
+the only copy is the payload of the complete frame. Consumed bytes are
+dropped from the front of the buffer once per feed().
+'''
+
+# System imports
+import  abc
+import  zlib
+import  binascii
+import  logging
+
+logger = logging.getLogger(__name__)
+
+SLIP_END        = 0xC0
+SLIP_ESC        = 0xDB
+SLIP_ESC_END    = 0xDC
+SLIP_ESC_ESC    = 0xDD
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF).to_bytes(2, 'big')
+
+
+def crc32(data):
+    return zlib.crc32(data).to_bytes(4, 'little')
+
+
+# Name -> (function, size)
+CRCS = {
+    'crc16': (crc16, 2),
+    'crc32': (crc32, 4),
+}
+
+
+class FrameDecoder(abc.ABC):
+    '''
+    Base class of frame decoders. Subclasses implement _parse().
+    Counters:
+        'frames': valid frames,
+        'crc_errors': frames with wrong CRC (dropped),
+        'framing_errors': invalid encoding, too short or too long frames
+        (dropped).
+    '''
+
+    def __init__(self, crc=None, max_frame=64*1024):
+        '''
+        Args:
+            crc: None, 'crc16' or 'crc32', CRC is checked and removed.
+            max_frame: longer frames are dropped.
+        '''
+        if crc is not None and crc not in CRCS:
+            raise ValueError('Unknown CRC: {}.'.format(crc))
+
+        self.crc        = crc
+        self.max_frame  = max_frame
+        self.buffer     = bytearray()
+        self.counters   = {'frames': 0, 'crc_errors': 0, 'framing_errors': 0}
+
+    def reset(self):
+        self.buffer.clear()
+
+    @property
+    def errors(self):
+        return self.counters['crc_errors'] + self.counters['framing_errors']
+
+    def feed(self, data):
+        '''
+        Args:
+            data: received bytes-like object.
+        Returns:
+            List of payloads (bytes) of complete valid frames.
+        '''
+        buffer = self.buffer
+        buffer += data
+
+        frames = list()
+        with memoryview(buffer) as view:
+            consumed = self._parse(buffer, view, frames)
+        # Buffer can't be resized while view exists
+        if consumed:
+            del buffer[:consumed]
+
+        if len(buffer) > 2*self.max_frame:
+            # No delimiter for too long, start over
+            self.counters['framing_errors'] += 1
+            buffer.clear()
+
+        return frames
+
+    @abc.abstractmethod
+    def _parse(self, buffer, view, frames):
+        '''
+        Find complete frames in the buffer and append their payloads to
+        frames (see _check()).
+        Returns:
+            Number of consumed bytes.
+        '''
+
+    def _check(self, frame, frames):
+        '''
+        Check CRC of the frame and append its payload to frames.
+        '''
+        if not frame:
+            return None
+        if len(frame) > self.max_frame:
+            self.counters['framing_errors'] += 1
+            return None
+
+        if self.crc:
+            function, size = CRCS[self.crc]
+            if len(frame) < size:
+                self.counters['framing_errors'] += 1
+                return None
+            with memoryview(frame) as view:
+                valid = function(view[:-size]) == view[-size:]
+            if not valid:
+                self.counters['crc_errors'] += 1
+                return None
+            frame = frame[:-size]
+
+        self.counters['frames'] += 1
+        frames.append(frame)
+
+
+class SlipDecoder(FrameDecoder):
+    '''
+    SLIP: frames end with 0xC0, 0xC0 and 0xDB in payload are escaped as
+    0xDB 0xDC and 0xDB 0xDD. Empty frames (leading END) are skipped.
+    '''
+
+    def _parse(self, buffer, view, frames):
+        start = 0
+        while True:
+            end = buffer.find(SLIP_END, start)
+            if end < 0:
+                return start
+
+            frame = bytes(view[start:end])
+            if SLIP_ESC in frame:
+                frame = self._unescape(frame)
+            if frame is not None:
+                self._check(frame, frames)
+            start = end + 1
+
+    def _unescape(self, frame):
+        # Every ESC starts escape pair, so pairs are replaced left to right
+        unescaped = frame.replace(b'\xDB\xDC', b'\xC0').replace(b'\xDB\xDD',
+                b'\xDB')
+        if unescaped.count(SLIP_ESC) != frame.count(b'\xDB\xDD'):
+            self.counters['framing_errors'] += 1
+            return None
+
+        return unescaped
+
+
+class CobsDecoder(FrameDecoder):
+    '''
+    COBS: frames end with 0x00, payload doesn't contain zeros. Every block
+    starts with a code byte: distance to the next zero (0xFF - block of 254
+    bytes without zero).
+    '''
+
+    def _parse(self, buffer, view, frames):
+        start = 0
+        while True:
+            end = buffer.find(0, start)
+            if end < 0:
+                return start
+
+            if end > start:
+                frame = self._decode(view, start, end)
+                if frame is not None:
+                    self._check(frame, frames)
+            start = end + 1
+
+    def _decode(self, view, start, end):
+        frame = bytearray()
+        i = start
+        while i < end:
+            code = view[i]
+            if i + code > end:
+                # Block runs past the delimiter
+                self.counters['framing_errors'] += 1
+                return None
+            frame += view[i + 1:i + code]
+            i += code
+            if code != 0xFF and i < end:
+                frame.append(0)
+
+        return bytes(frame)
+
+
+class LengthDecoder(FrameDecoder):
+    '''
+    Length prefixed frames: unsigned length of payload (with CRC) followed by
+    payload. Frame with impossible length is skipped by one byte to find
+    the next valid header.
+    '''
+
+    def __init__(self, crc=None, max_frame=64*1024, size=2, byteorder='big'):
+        '''
+        Args:
+            size: length field size (bytes).
+            byteorder: 'big' or 'little'.
+        '''
+        FrameDecoder.__init__(self, crc, max_frame)
+        self.size       = size
+        self.byteorder  = byteorder
+        self.min_frame  = CRCS[crc][1] if crc else 1
+
+    def _parse(self, buffer, view, frames):
+        size = self.size
+        start = 0
+        while len(view) - start >= size:
+            length = int.from_bytes(view[start:start + size], self.byteorder)
+            if not self.min_frame <= length <= self.max_frame:
+                self.counters['framing_errors'] += 1
+                start += 1
+                continue
+
+            end = start + size + length
+            if end > len(view):
+                break
+            self._check(bytes(view[start + size:end]), frames)
+            start = end
+
+        return start
+
+
+# Name -> decoder class
+DECODERS = {
+    'slip': SlipDecoder,
+    'cobs': CobsDecoder,
+    'length': LengthDecoder,
+}
+
+
+def make_decoder(name, crc=None, max_frame=64*1024, **kwargs):
+    '''
+    Create decoder by name ('slip', 'cobs' or 'length'), extra arguments are
+    passed to LengthDecoder.
+    Raises:
+        ValueError for unknown decoder or CRC.
+    '''
+    if name not in DECODERS:
+        raise ValueError('Unknown framing: {}.'.format(name))
+
+    if name == 'length':
+        return LengthDecoder(crc, max_frame, **kwargs)
+
+    return DECODERS[name](crc, max_frame)
+
+
+def format_frame(frame):
+    '''
+    Text representation of the frame for the text console.
+    '''
+    return '[{}] {}'.format(len(frame), frame.hex(' ').upper())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Capture from serial port without GUI. Doesn't import Qt, received data is
+streamed to stdout or to the file.
+'''
+
+# System imports
+import  sys
+import  time
+import  queue
+import  logging
+
+from    config              import config
+from    metrics             import metrics
+from    reader              import Reader
+from    writer              import Writer
+from    fanout              import FanoutServer
+
+logger = logging.getLogger(__name__)
+
+
+def run(args):
+    '''
+    Read from the port until interrupted or duration expires.
+    Args:
+        args: parsed command line arguments (port, baudrate, out, raw,
+        record, replay, duration).
+    Returns:
+        Exit code.
+    '''
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else
+            logging.WARNING)
+
+    # Data is written by the main thread, so slow output doesn't block
+    # reader
+    chunks = queue.SimpleQueue()
+    errors = list()
+
+    if config['metrics_port']:
+        metrics.serve(config['metrics_port'])
+
+    reader = Reader(args.port, args.baudrate)
+    if args.raw:
+        reader.subscribe('data', lambda data, decoded: chunks.put(data))
+    else:
+        reader.subscribe('data', lambda data, decoded: chunks.put(
+            decoded.encode('utf-8')))
+    reader.subscribe('error', errors.append)
+
+    if args.record and not reader.start_recording(args.record):
+        logger.error(errors[0])
+        return 1
+    if config['log_dir'] and not reader.start_logging(config['log_dir']):
+        logger.error(errors[0])
+        return 1
+
+    # Local clients get received bytes, their data is written to the port
+    server = None
+    if config['fanout_address']:
+        writer = Writer(reader)
+        writer.subscribe('error', logger.error)
+        try:
+            server = FanoutServer(config['fanout_address'], writer.send)
+        except (OSError, ValueError) as e:
+            logger.error('Can\'t serve on {}: {}'.format(
+                config['fanout_address'], e))
+            return 1
+        reader.subscribe('data', server.broadcast)
+        writer.start()
+        server.start()
+
+    if args.replay:
+        reader.start_replay(args.replay, config['replay_speed'])
+    else:
+        reader.set_port(reader.port)
+        reader.start_reading()
+    if errors:
+        logger.error(errors[0])
+        return 1
+
+    if args.out == '-':
+        out = sys.stdout.buffer
+    else:
+        out = open(args.out, 'ab')
+
+    reader.start()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                chunk = chunks.get(timeout=0.5)
+            except queue.Empty:
+                if not reader.is_alive():
+                    break
+                # Whole session is replayed
+                if args.replay and reader.ser.finished:
+                    break
+                continue
+
+            out.write(chunk)
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.stop()
+        reader.join()
+        if server:
+            server.stop()
+            server.join()
+        while not chunks.empty():
+            out.write(chunks.get())
+        out.flush()
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    logger.info('Capture stats: {}'.format(reader.capture_stats()))
+
+    return 1 if errors else 0
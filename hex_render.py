@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+
+class HexRenderer:
+    '''
+    Converts raw bytes received from serial port into rows of HEX
+    representation with HTML color tags. Whole chunk is converted by one
+    bytes.hex() call and cut into rows, color tags are inserted only around
+    highlighted ranges.
+    '''
+
+    def __init__(self, bytes_in_row=16):
+        '''
+        Args:
+            bytes_in_row: number of bytes in one row of HEX view.
+        '''
+        self.bytes_in_row   = int(bytes_in_row)
+        # Color -> opening tag
+        self._tags          = dict()
+
+    @staticmethod
+    def _column(index):
+        # Every byte takes two characters, every second byte in the chunk is
+        # followed by space
+        return index*2 + index//2
+
+    def render(self, data, spans=()):
+        '''
+        Convert chunk of bytes into rows of HEX representation. Every two
+        bytes are grouped and separated by space, highlighted ranges are
+        wrapped in color tags.
+        Args:
+            data: bytes-like object.
+            spans: sorted not overlapping (start, end, color) ranges of the
+                chunk to highlight, ranges started before the chunk are
+                highlighted from its beginning.
+        Returns:
+            List of strings, one per row.
+        '''
+        if not data:
+            return []
+
+        data = bytes(data)
+        step = self.bytes_in_row
+        text = data.hex(' ', -2).upper() + ' '
+
+        if step % 2 == 0:
+            # All rows have the same width
+            width = self._column(step)
+            result = [text[i:i + width] for i in range(0, len(text), width)]
+            # Last byte on odd position isn't followed by separator
+            if len(data) % 2:
+                result[-1] = result[-1][:-1]
+        else:
+            column = self._column
+            result = [text[column(start):column(min(start + step,
+                len(data)))] for start in range(0, len(data), step)]
+
+        if spans:
+            self._highlight(result, spans, len(data))
+
+        return result
+
+    def _highlight(self, rows, spans, size):
+        '''
+        Wrap highlighted ranges of rows in color tags. Range crossing row
+        boundary is split into per row parts.
+        '''
+        step = self.bytes_in_row
+        tags = self._tags
+
+        # Row which is being built, its pieces and column of its first byte.
+        # Column of the byte is index*2 + index//2 (see _column()).
+        current, pieces, text, position, base = None, None, '', 0, 0
+        for start, end, color in spans:
+            tag = tags.get(color)
+            if tag is None:
+                tag = tags[color] = '<span style="color: {}">'.format(color)
+
+            if start < 0:
+                start = 0
+            if end > size:
+                end = size
+            while start < end:
+                row = start//step
+                if row != current:
+                    if pieces is not None:
+                        pieces.append(text[position:])
+                        rows[current] = ''.join(pieces)
+                    current, pieces, text, position = row, [], rows[row], 0
+                    base = row*step*2 + row*step//2
+
+                row_end = (row + 1)*step
+                if end < row_end:
+                    row_end = end
+                first = start*2 + start//2 - base
+                # Range ends after the last byte, separator isn't colored
+                last = row_end*2 + (row_end - 1)//2 - base
+                pieces += (text[position:first], tag, text[first:last],
+                        '</span>')
+                position = last
+                start = row_end
+
+        if pieces is not None:
+            pieces.append(text[position:])
+            rows[current] = ''.join(pieces)
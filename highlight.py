@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Highlighting of user defined byte sequences, strings and regular expressions
+in the received stream. All rules are compiled once:
+    - literal rules (text and HEX) starting with few different symbols are
+      merged into one trie shaped regular expression together with regex
+      rules;
+    - other literal rule sets are matched by rolling hash of their prefixes
+      computed with NumPy (HashMatcher), so cost per byte doesn't depend on
+      the number of rules (Aho-Corasick automaton in Python is used without
+      NumPy).
+Stream is fed chunk by chunk, matches crossing chunk boundaries are found
+(automaton state or tail of the previous chunk is kept).
+'''
+
+# System imports
+import  re
+import  logging
+from    collections         import deque
+
+try:
+    import  numpy as np
+except ImportError:
+    np = None
+
+from config import config
+from search import compile_pattern
+from search import HEX
+from search import REGEX
+
+logger = logging.getLogger(__name__)
+
+# Literal rules are matched by regex engine while their trie starts with at
+# most this many symbols (alternatives are tried one by one at every
+# position, so cost grows with their number), otherwise by HashMatcher or by
+# Automaton without NumPy (both cost the same for any number of rules, the
+# numbers are measured by bench_highlight.py)
+MAX_REGEX_BRANCHES = 8 if np is not None else 32
+
+# Maximum length of pattern prefix hashed by HashMatcher, longer prefixes
+# are rarer in the stream, but cost one vector operation per symbol
+PREFIX      = 4
+# Multiplier of the rolling hash (odd, bits are well mixed)
+HASH_BASE   = 0x9E3779B97F4A7C15
+HASH_MASK   = (1 << 64) - 1
+
+
+class HashMatcher:
+    '''
+    Literal patterns matched with NumPy. Patterns are found by their prefix
+    of up to PREFIX symbols: hash of every window of every prefix length is
+    computed from the hash of the shorter window (one vector operation per
+    length), windows whose hash can belong to a prefix are found by lookup
+    in a bit filter and only patterns with this prefix are compared. Cost
+    per symbol depends on PREFIX, not on the number or length of patterns.
+    Interface is the same as Automaton, state is the tail of the previous
+    chunk.
+    '''
+
+    def __init__(self, patterns):
+        '''
+        Args:
+            patterns: dictionary {pattern (bytes or str): value}.
+        '''
+        # (prefix length, hash of prefix) -> list of (pattern, value)
+        self.patterns = dict()
+        for pattern, value in patterns.items():
+            prefix = pattern[:PREFIX]
+            key = (len(prefix), self._hash(prefix))
+            self.patterns.setdefault(key, list()).append((pattern, value))
+        self.prefixes = {length for length, _ in self.patterns}
+        self.max_len = max(map(len, patterns))
+
+        # At most 1/256 of the filter is set (up to 4M entries), it's
+        # indexed by the high bits of hash
+        bits = min(22, max(16, (512*len(self.patterns)).bit_length()))
+        self.shift  = np.uint64(64 - bits)
+        self.base   = np.uint64(HASH_BASE)
+        self.filter = np.zeros(1 << bits, dtype=bool)
+        for _, value in self.patterns:
+            self.filter[value >> (64 - bits)] = True
+
+    @staticmethod
+    def _hash(pattern):
+        # Every symbol is multiplied by the base too, so it moves the high
+        # bits of the hash
+        value = 0
+        for symbol in Automaton._symbols(pattern):
+            value = (value*HASH_BASE + (symbol + 1)*HASH_BASE) & HASH_MASK
+        return value
+
+    def scan(self, data, state=0):
+        '''
+        Find all patterns in the data.
+        Args:
+            data: bytes or str.
+            state: tail of the previous chunks (0 - no tail).
+        Returns:
+            List of (start, end, value) and new state. Start is negative for
+            matches started in the previous chunks.
+        '''
+        buf = state + data if state else data
+        shift = len(buf) - len(data)
+        tail = buf[len(buf) - self.max_len + 1:] if self.max_len > 1 else 0
+        if isinstance(buf, str):
+            symbols = np.frombuffer(buf.encode('utf-32-le'), dtype=np.uint32)
+        else:
+            symbols = np.frombuffer(bytes(buf), dtype=np.uint8)
+
+        result = list()
+        size = len(symbols)
+        patterns = self.patterns
+        with np.errstate(over='ignore'):
+            symbols = (symbols.astype(np.uint64) + np.uint64(1))*self.base
+            hashes = symbols
+            for length in range(1, min(max(self.prefixes), size) + 1):
+                # Hashes of windows of this length
+                if length > 1:
+                    hashes = hashes[:size - length + 1]*self.base + \
+                            symbols[length - 1:]
+                if length not in self.prefixes:
+                    continue
+
+                # Indexes fit into int64, take() with them is several times
+                # faster than indexing with uint64
+                candidates = np.flatnonzero(self.filter.take(
+                    (hashes >> self.shift).view(np.int64)))
+                for start, key in zip(candidates.tolist(),
+                        hashes[candidates].tolist()):
+                    for pattern, value in patterns.get((length, key), ()):
+                        # Matches ending in the tail are already found
+                        end = start + len(pattern)
+                        if end > shift and buf[start:end] == pattern:
+                            result.append((start - shift, end - shift,
+                                value))
+
+        return result, tail
+
+        with np.errstate(over='ignore'):
+            symbols = (symbols.astype(np.uint64) + np.uint64(1))*self.base
+            # Hashes of prefixes starting at every position
+            hashes = symbols[:count]
+            for i in range(1, self.prefix):
+                hashes = hashes*self.base + symbols[i:i + count]
+
+        # Indexes fit into int64, take() with them is several times faster
+        # than indexing with uint64
+        candidates = np.flatnonzero(self.filter.take(
+            (hashes >> self.shift).view(np.int64)))
+        patterns = self.patterns
+        for start, key in zip(candidates.tolist(),
+                hashes[candidates].tolist()):
+            for pattern, value in patterns.get(key, ()):
+                # Matches ending in the tail are already found
+                end = start + len(pattern)
+                if end > shift and buf[start:end] == pattern:
+                    result.append((start - shift, end - shift, value))
+
+        return result, tail
+
+
+class Automaton:
+    '''
+    Aho-Corasick automaton over literal patterns. Transitions are stored as
+    full tables over compressed alphabet (symbols not used in any pattern
+    share one class), so every input symbol costs one table lookup.
+    '''
+
+    def __init__(self, patterns):
+        '''
+        Args:
+            patterns: dictionary {pattern (bytes or str): value}.
+        '''
+        symbols = sorted({symbol for pattern in patterns
+            for symbol in self._symbols(pattern)})
+        # Symbol -> class, class 0 is for unused symbols
+        self.classes = {symbol: i + 1 for i, symbol in enumerate(symbols)}
+        # Translation table for bytes input
+        self.table = None
+        if all(symbol < 256 for symbol in symbols):
+            self.table = bytes(self.classes.get(b, 0) for b in range(256))
+        width = len(symbols) + 1
+
+        # Trie
+        goto = [dict()]
+        # State -> tuple of (length, value) of patterns ending in the state
+        output = [()]
+        for pattern, value in patterns.items():
+            state = 0
+            for symbol in self._symbols(pattern):
+                cls = self.classes[symbol]
+                if cls not in goto[state]:
+                    goto[state][cls] = len(goto)
+                    goto.append(dict())
+                    output.append(())
+                state = goto[state][cls]
+            output[state] += ((len(pattern), value),)
+
+        # Failure links are folded into the transition tables (breadth first,
+        # so tables of shorter suffixes are ready)
+        fail = [0]*len(goto)
+        self.delta = [None]*len(goto)
+        self.delta[0] = [goto[0].get(cls, 0) for cls in range(width)]
+        states = deque(goto[0].values())
+        while states:
+            state = states.popleft()
+            link = fail[state]
+            output[state] += output[link]
+            self.delta[state] = [goto[state].get(cls, self.delta[link][cls])
+                    for cls in range(width)]
+            for cls, child in goto[state].items():
+                fail[child] = self.delta[link][cls]
+                states.append(child)
+
+        # Longest pattern first
+        self.output = [tuple(sorted(out, reverse=True, key=lambda x: x[0]))
+                for out in output]
+
+    @staticmethod
+    def _symbols(pattern):
+        if isinstance(pattern, str):
+            return [ord(ch) for ch in pattern]
+        return pattern
+
+    def scan(self, data, state=0):
+        '''
+        Find all patterns in the data.
+        Args:
+            data: bytes or str.
+            state: state after the previous chunk.
+        Returns:
+            List of (start, end, value) and new state. Start is negative for
+            matches started in the previous chunks.
+        '''
+        if isinstance(data, str) or self.table is None:
+            classes = [self.classes.get(symbol, 0) for symbol in
+                    self._symbols(data)]
+        else:
+            classes = bytes(data).translate(self.table)
+
+        result = list()
+        delta = self.delta
+        output = self.output
+        for end, cls in enumerate(classes, 1):
+            state = delta[state][cls]
+            if output[state]:
+                for length, value in output[state]:
+                    result.append((end - length, end, value))
+
+        return result, state
+
+
+class Highlighter:
+    '''
+    Finds highlighted parts of the stream. Works either on bytes (HEX
+    console) or on decoded text (text console).
+    Rules are dictionaries:
+        'pattern': string (HEX bytes for 'hex' kind),
+        'kind': 'text', 'hex' or 'regex',
+        'color': HTML color.
+    '''
+
+    def __init__(self, rules=None, text=False):
+        '''
+        Args:
+            rules: list of rules, default is taken from config.
+            text: match decoded text instead of bytes.
+        '''
+        self.text = text
+        self._empty = '' if text else b''
+
+        # Literal -> color
+        literals = dict()
+        # (regex source, color)
+        regexes = list()
+        for rule in (config['highlight_rules'] if rules is None else rules):
+            try:
+                value = self._compile_rule(rule)
+            except (KeyError, ValueError, UnicodeError) as e:
+                logger.warning('Invalid highlighting rule {}: {}'.format(
+                    rule, e))
+                continue
+
+            if value is None:
+                continue
+            if isinstance(value, (bytes, str)):
+                literals.setdefault(value, rule['color'])
+            else:
+                regexes.append((value.pattern, rule['color']))
+
+        self.literals   = literals
+        self.automaton  = None
+        # Regex group name -> color
+        self.colors     = dict()
+
+        groups = list()
+        if len({literal[:1] for literal in literals}) > MAX_REGEX_BRANCHES:
+            self.automaton = HashMatcher(literals) if np is not None else \
+                    Automaton(literals)
+        elif literals:
+            groups.append(self._group('lit', self._trie(literals)))
+
+        for i, (source, color) in enumerate(regexes):
+            name = 'r{}'.format(i)
+            self.colors[name] = color
+            groups.append(self._group(name, source))
+
+        self.regex = re.compile(self._join(groups)) if groups else None
+
+        # Regex matches can cross chunk boundary only within the tail
+        self.overlap = 0
+        if regexes:
+            self.overlap = config['highlight_overlap']
+        elif self.regex:
+            self.overlap = max(map(len, literals)) - 1
+
+        self.reset()
+
+    def reset(self):
+        self._state = 0
+        self._tail  = self._empty
+        # End of the last found span relative to the end of the fed data
+        # (None - nothing is found), spans found again in the tail of the
+        # previous chunk are dropped
+        self._end   = None
+
+    def _compile_rule(self, rule):
+        '''
+        Returns:
+            Literal (bytes or str), compiled regex or None if rule doesn't
+            apply to this kind of data.
+        '''
+        value = compile_pattern(rule['pattern'], rule.get('kind', 'text'))
+        if not self.text:
+            return value
+
+        if rule.get('kind') == HEX:
+            # Bytes which can't be decoded are never shown as is
+            try:
+                return value.decode(config['encoding'])
+            except UnicodeError:
+                return None
+        if rule.get('kind') == REGEX:
+            return re.compile(rule['pattern'])
+
+        return rule['pattern']
+
+    def _group(self, name, source):
+        if self.text:
+            return '(?P<{}>{})'.format(name, source)
+        return '(?P<{}>'.format(name).encode() + source + b')'
+
+    def _join(self, parts):
+        return ('|' if self.text else b'|').join(parts)
+
+    def _trie(self, literals):
+        '''
+        Build regex matching any of the literals, common prefixes are
+        merged, so alternatives are checked only after the shared prefix.
+        '''
+        root = dict()
+        for literal in literals:
+            node = root
+            for i in range(len(literal)):
+                node = node.setdefault(literal[i:i + 1], dict())
+            # End of literal
+            node[None] = None
+
+        def build(node):
+            alternatives = [re.escape(key) + build(child) for key, child in
+                    sorted(node.items(), key=lambda x: x[0] or self._empty)
+                    if key is not None]
+            if not alternatives:
+                return self._empty
+
+            if len(alternatives) == 1 and None not in node:
+                return alternatives[0]
+
+            source = self._join(alternatives)
+            if self.text:
+                source = '(?:' + source + ')'
+            else:
+                source = b'(?:' + source + b')'
+            if None in node:
+                source += '?' if self.text else b'?'
+
+            return source
+
+        return build(root)
+
+    def spans(self, data):
+        '''
+        Find highlighted parts of the standalone piece of data (e.g. one line
+        of text).
+        Returns:
+            Sorted list of not overlapping (start, end, color).
+        '''
+        state, tail = self._state, self._tail
+        self.reset()
+        try:
+            return self.feed(data)
+        finally:
+            self._state, self._tail = state, tail
+
+    def feed(self, data):
+        '''
+        Find highlighted parts of the next chunk of the stream.
+        Returns:
+            Sorted list of not overlapping (start, end, color), positions are
+            relative to the chunk; matches started in the previous chunks
+            have negative start.
+        '''
+        if not data:
+            return []
+
+        found = list()
+        if self.automaton:
+            matches, self._state = self.automaton.scan(data, self._state)
+            found.extend(matches)
+
+        if self.regex:
+            tail = self._tail
+            buf = tail + data
+            shift = len(tail)
+            # Start after spans of the previous chunks
+            position = shift
+            if self._end is not None:
+                position = max(0, shift + self._end)
+            literals, colors = self.literals, self.colors
+            for match in self.regex.finditer(buf, position):
+                start, end = match.span()
+                if end <= shift or end == start:
+                    continue
+                name = match.lastgroup
+                if name == 'lit':
+                    color = literals[match.group()]
+                else:
+                    color = colors[name]
+                found.append((start - shift, end - shift, color))
+            self._tail = buf[-self.overlap:] if self.overlap else \
+                    self._empty
+
+        result = found
+        if found and self.automaton:
+            # Leftmost longest match wins
+            found.sort(key=lambda x: (x[0], -x[1]))
+            result = [found[0]]
+            for span in found[1:]:
+                if span[0] >= result[-1][1]:
+                    result.append(span)
+
+        if self._end is not None:
+            result = [span for span in result if span[0] >= self._end]
+        if result:
+            self._end = result[-1][1] - len(data)
+        elif self._end is not None:
+            self._end -= len(data)
+
+        return result
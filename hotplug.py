@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Background serial port discovery. Port list is kept in cache and only
+changes (added and removed ports) are reported. On Linux with pyudev device
+add/remove events are used, otherwise ports are rescanned periodically in
+the watcher thread (on Linux only when /dev changes).
+'''
+
+# System imports
+import  os
+import  sys
+import  logging
+import  threading
+
+# PySerial imports
+import  serial.tools.list_ports
+
+try:
+    import  pyudev
+except ImportError:
+    pyudev = None
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class PortWatcher(threading.Thread):
+    '''
+    Thread watching for serial ports.
+    Events:
+        'ports_changed': list of added ports (ListPortInfo), list of removed
+        port names
+    '''
+
+    def __init__(self, interval=None):
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.interval   = interval or config['scan_interval']
+        # Port name -> ListPortInfo
+        self._ports     = dict()
+        self._lock      = threading.Lock()
+        self._stopped   = threading.Event()
+        # Modification time of /dev when ports were scanned
+        self._dev_mtime = None
+
+    @property
+    def ports(self):
+        '''
+        Returns:
+            Cached list of ports (ListPortInfo) sorted by name.
+        '''
+        with self._lock:
+            return [self._ports[name] for name in sorted(self._ports)]
+
+    def run(self):
+        self.rescan()
+
+        if pyudev and sys.platform.startswith('linux'):
+            self._watch_udev()
+        else:
+            self._watch_poll()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch_udev(self):
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by('tty')
+        monitor.start()
+
+        while not self._stopped.is_set():
+            # Timeout to check stop flag
+            device = monitor.poll(timeout=self.interval)
+            if device is not None and device.action in ['add', 'remove']:
+                self.rescan()
+
+    def _watch_poll(self):
+        while not self._stopped.wait(self.interval):
+            if self._dev_changed():
+                self.rescan()
+
+    def _dev_changed(self):
+        '''
+        Check if device nodes were added or removed. Walking sysfs is
+        expensive, so on Linux ports are rescanned only if /dev changed.
+        '''
+        if not sys.platform.startswith('linux'):
+            return True
+
+        try:
+            mtime = os.stat('/dev').st_mtime_ns
+        except OSError:
+            return True
+
+        changed = mtime != self._dev_mtime
+        self._dev_mtime = mtime
+
+        return changed
+
+    def rescan(self):
+        '''
+        Scan ports and report changes.
+        '''
+        found = {port.device: port for port in
+                serial.tools.list_ports.comports()}
+
+        with self._lock:
+            added = [found[name] for name in sorted(found)
+                    if name not in self._ports]
+            removed = [name for name in sorted(self._ports)
+                    if name not in found]
+            self._ports = found
+
+        if added or removed:
+            logger.info('Ports added: {}, removed: {}.'.format(
+                [port.device for port in added], removed))
+            self.notify('ports_changed', added, removed)
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        watcher thread.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import  codecs
+
+# Policies for bytes which can't be decoded
+ERRORS = {
+    # Replace with U+FFFD
+    'replace': 'replace',
+    # Show as \xNN
+    'escape': 'backslashreplace',
+}
+
+
+class LineDecoder:
+    '''
+    Streaming decode and framing stage. Bytes are decoded with incremental
+    codec, so characters split between reads aren't lost, and text is cut
+    into lines by delimiter. Every call scans only new text, incomplete line
+    is kept till the next call.
+    '''
+
+    def __init__(self, encoding='utf-8', errors='escape', eol='\n',
+            max_line=64*1024):
+        '''
+        Args:
+            encoding: name of the codec.
+            errors: 'replace', 'escape' or name of codec error handler.
+            eol: line delimiter, empty string - no framing.
+            max_line: incomplete line longer than this is emitted as is.
+        '''
+        self.encoding   = encoding
+        self.errors     = ERRORS.get(errors, errors)
+        self.eol        = eol
+        self.max_line   = max_line
+
+        self._decoder   = codecs.getincrementaldecoder(encoding)(self.errors)
+        # Parts of incomplete line, their length and last characters which
+        # can be the beginning of delimiter
+        self._tail      = list()
+        self._tail_len  = 0
+        self._tail_end  = ''
+        # Last line returned by split() is cut at max_line, not at delimiter
+        self.cut        = False
+
+    def decode(self, data):
+        '''
+        Decode chunk of bytes. Incomplete multibyte sequence at the end is
+        kept in the decoder.
+        '''
+        return self._decoder.decode(data)
+
+    def feed(self, data):
+        '''
+        Decode chunk of bytes and cut it into lines.
+        Args:
+            data: bytes.
+        Returns:
+            List of complete lines without delimiters. Without delimiter
+            every chunk is returned as is.
+        '''
+        text = self.decode(data)
+        if not self.eol:
+            return [text] if text else []
+
+        return self.split(text)
+
+    def feed_text(self, data):
+        '''
+        Decode chunk of bytes into text ready for the consoles: complete
+        lines followed by '\n', without delimiter the chunk as is. Line cut
+        at max_line isn't followed by '\n', the device didn't send it, so
+        the console continues (and wraps) the line.
+        Args:
+            data: bytes.
+        Returns:
+            Decoded text, empty if no line is complete.
+        Raises:
+            UnicodeError if bytes can't be decoded (decoder is reset).
+        '''
+        try:
+            lines = self.feed(data)
+        except UnicodeError:
+            self.reset()
+            raise
+
+        if not self.eol:
+            return ''.join(lines)
+
+        text = ''.join(line + '\n' for line in lines)
+        return text[:-1] if self.cut else text
+
+    def split(self, text):
+        '''
+        Cut text into lines. Text after the last delimiter is kept and
+        prepended to the first line found by the next call.
+        Returns:
+            List of complete lines without delimiters.
+        '''
+        eol = self.eol
+        size = len(eol)
+        lines = list()
+        start = 0
+        self.cut = False
+
+        # Delimiter split between previous and this text
+        if size > 1 and self._tail_end:
+            probe = self._tail_end + text[:size - 1]
+            index = probe.find(eol)
+            if index != -1 and index < len(self._tail_end):
+                cut = len(self._tail_end) - index
+                lines.append(self._take_tail()[:-cut])
+                start = size - cut
+
+        index = text.find(eol, start)
+        while index != -1:
+            if self._tail:
+                lines.append(self._take_tail() + text[start:index])
+            else:
+                lines.append(text[start:index])
+            start = index + size
+            index = text.find(eol, start)
+
+        if start < len(text):
+            rest = text[start:]
+            self._tail.append(rest)
+            self._tail_len += len(rest)
+            self._tail_end = (self._tail_end + rest)[-(size - 1):] \
+                    if size > 1 else ''
+
+            if self._tail_len >= self.max_line:
+                lines.append(self._take_tail())
+                self.cut = True
+
+        return lines
+
+    def flush(self):
+        '''
+        Returns:
+            Incomplete line (and undecoded bytes) kept by decoder.
+        '''
+        text = self._decoder.decode(b'', final=True)
+        if self.eol:
+            lines = self.split(text)
+            lines.append(self._take_tail())
+            return self.eol.join(lines)
+
+        return text
+
+    def reset(self):
+        self._decoder.reset()
+        self._take_tail()
+
+    def _take_tail(self):
+        line = ''.join(self._tail)
+        self._tail      = list()
+        self._tail_len  = 0
+        self._tail_end  = ''
+
+        return line
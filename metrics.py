@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Pipeline instrumentation: meters (totals and recent rate) and histograms
+with power of two buckets. Metrics are kept in the module registry
+'metrics', every metric is updated by one thread (reader or GUI), so
+recording is a few integer operations without locks.
+
+Snapshot can be dumped to JSON or served on local HTTP endpoint:
+    metrics.serve(9100)
+    curl http://127.0.0.1:9100/metrics
+'''
+
+# System imports
+import  json
+import  time
+import  logging
+import  threading
+from    http.server         import BaseHTTPRequestHandler
+from    http.server         import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds used to calculate recent rate of the meter
+WINDOW  = 5
+
+
+class Meter:
+    '''
+    Total of recorded values and their rate over the last seconds.
+    '''
+
+    def __init__(self, unit=''):
+        self.unit   = unit
+        self.total  = 0
+        # Sums of values recorded in the last WINDOW + 1 seconds
+        self._slots = [0]*(WINDOW + 1)
+        self._second = int(time.monotonic())
+
+    def add(self, value=1):
+        self.total += value
+
+        second = int(time.monotonic())
+        if second != self._second:
+            self._advance(second)
+        self._slots[second % len(self._slots)] += value
+
+    def _advance(self, second):
+        # Clear slots of the seconds without records
+        for i in range(self._second + 1, min(second, self._second +
+                len(self._slots)) + 1):
+            self._slots[i % len(self._slots)] = 0
+        self._second = second
+
+    def rate(self):
+        '''
+        Returns:
+            Average per second over the last WINDOW complete seconds.
+        '''
+        # Slots aren't changed here, meter is updated by another thread
+        size = len(self._slots)
+        last = self._second
+        second = int(time.monotonic())
+
+        total = sum(self._slots[i % size] for i in range(second - WINDOW,
+            second) if last - size < i <= last)
+
+        return total/WINDOW
+
+    def snapshot(self):
+        return {'total': self.total, 'rate': self.rate(), 'unit': self.unit}
+
+
+class Histogram:
+    '''
+    Distribution of non-negative integer values. Bucket i counts values
+    with bit length i, i.e. values in [2**(i - 1), 2**i).
+    '''
+
+    def __init__(self, unit=''):
+        self.unit       = unit
+        self.buckets    = [0]*65
+        self.count      = 0
+        self.sum        = 0
+        self.max        = 0
+
+    def record(self, value):
+        value = int(value)
+        self.buckets[min(value.bit_length(), 64)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction, since=None):
+        '''
+        Args:
+            fraction: 0.5 for median etc.
+            since: copy of buckets, only values recorded after it are
+                taken into account.
+        Returns:
+            Upper bound of the bucket containing the percentile.
+        '''
+        buckets = self.buckets
+        if since is not None:
+            buckets = [now - then for now, then in zip(buckets, since)]
+
+        count = sum(buckets)
+        if not count:
+            return 0
+
+        rank = fraction*count
+        seen = 0
+        for i, value in enumerate(buckets):
+            seen += value
+            if seen >= rank:
+                return min((1 << i) - 1, self.max)
+
+        return self.max
+
+    def snapshot(self):
+        return {
+            'unit': self.unit,
+            'count': self.count,
+            'mean': self.sum/self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            # Upper bound of the bucket -> count
+            'buckets': {(1 << i) - 1: count for i, count in
+                enumerate(self.buckets) if count},
+        }
+
+
+class Metrics:
+    '''
+    Registry of meters, histograms and gauges (last value) created on
+    first use.
+    '''
+
+    def __init__(self):
+        self.meters     = dict()
+        self.histograms = dict()
+        self.gauges     = dict()
+        # Histogram name -> buckets at the previous summary()
+        self._summary   = dict()
+        self.started    = time.time()
+        self._lock      = threading.Lock()
+        self._server    = None
+
+    def meter(self, name, unit=''):
+        meter = self.meters.get(name)
+        if meter is None:
+            with self._lock:
+                meter = self.meters.setdefault(name, Meter(unit))
+
+        return meter
+
+    def histogram(self, name, unit=''):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name,
+                        Histogram(unit))
+
+        return histogram
+
+    def snapshot(self):
+        '''
+        Returns:
+            Dictionary with all metrics.
+        '''
+        with self._lock:
+            meters = dict(self.meters)
+            histograms = dict(self.histograms)
+
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'meters': {name: meter.snapshot() for name, meter in
+                meters.items()},
+            'histograms': {name: histogram.snapshot() for name, histogram
+                in histograms.items()},
+            'gauges': dict(self.gauges),
+        }
+
+    def summary(self):
+        '''
+        Short string with the main pipeline metrics. Percentiles are
+        calculated over values recorded since the previous call.
+        '''
+        rx = self.meter('rx_bytes', 'B').rate()
+
+        summary = 'In {} | Queue {} (p99 age {:.0f} ms) | Render p99 ' \
+                '{:.1f} ms'.format(format_rate(rx),
+                        self.gauges.get('queue_depth', 0),
+                        self._recent('queue_age', 0.99)/1000,
+                        self._recent('render_time', 0.99)/1000)
+        if self.gauges.get('queue_spilled'):
+            summary += ' | Spilled {} B'.format(
+                    self.gauges['queue_spilled'])
+        if self.gauges.get('queue_dropped'):
+            summary += ' | Dropped {} B'.format(
+                    self.gauges['queue_dropped'])
+        if 'frame_errors' in self.gauges:
+            summary += ' | Frames {:.0f}/s, {} errors'.format(
+                    self.meter('frames').rate(), self.gauges['frame_errors'])
+
+        return summary
+
+    def _recent(self, name, fraction):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            return 0
+
+        since = self._summary.get(name)
+        self._summary[name] = list(histogram.buckets)
+
+        return histogram.percentile(fraction, since)
+
+    def dump(self, path):
+        '''
+        Write snapshot to JSON file.
+        '''
+        with open(path, 'w') as fn:
+            json.dump(self.snapshot(), fn, indent=2)
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serve JSON snapshot over HTTP (GET /metrics) in a daemon thread.
+        Returns:
+            True if server is started.
+        '''
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.rstrip('/') not in ['', '/metrics']:
+                    self.send_error(404)
+                    return None
+
+                body = json.dumps(registry.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.error('Can\'t serve metrics on port {}: {}'.format(port,
+                e))
+            return False
+
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                daemon=True).start()
+        logger.info('Metrics are served on http://{}:{}/metrics.'.format(
+            host, self._server.server_address[1]))
+
+        return True
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def format_rate(value):
+    for unit in ['B/s', 'kB/s', 'MB/s']:
+        if value < 1000:
+            return '{:.0f} {}'.format(value, unit)
+        value /= 1000
+
+    return '{:.0f} GB/s'.format(value)
+
+
+# Registry of the application
+metrics = Metrics()
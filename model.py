@@ -2,31 +2,40 @@
 # coding=utf-8
 
 # System imports
-import  sys
-import  glob
-import  queue
-import  select
+import  asyncio
 import  logging
-import  threading
-from    time                import sleep
-from    sys                 import exit
-
-# PyQt5 imports
-from    PyQt5.QtCore        import pyqtSignal
-from    PyQt5.QtCore        import QObject
 
 # PySerial imports
 import  serial
-import  serial.tools.list_ports
 from    serial.serialutil   import SerialException
 
+# PyQt5 imports
+from    PyQt5.QtCore        import pyqtSignal
+from    PyQt5.QtCore        import QObject
+
 from config import config
+from chunk_format import ChunkFormatter
+from reader import Reader
+from multiport import PortMux
+from hotplug import PortWatcher
+from search import StreamSearch
+from writer import Writer
+from transfer import FileTransfer
+from plot import PlotBuffer
+from chunk_buffer import ChunkBuffer
+from reader_process import ProcessReader
+from async_serial import AsyncSerial
+from metrics import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class Model(threading.Thread, QObject):
+class Model(Reader, QObject):
+    '''
+    Reader thread for GUI. Events are re-emitted as Qt signals and received
+    data is converted to HEX representation and put in the queue.
+    '''
 
     # Signal emitted when port configuratin changes
     port_conf_change = pyqtSignal(object)
@@ -40,251 +49,159 @@ class Model(threading.Thread, QObject):
     data_ready = pyqtSignal(object)
 
     def __init__(self):
-        threading.Thread.__init__(self)
+        Reader.__init__(self)
         QObject.__init__(self)
-        # Queue with data (lines) received from serial port
-        self.queue      = queue.Queue()
-        self.paused = threading.Event()
-        self.paused.clear()
+        # Bounded buffer with data (lines) received from serial port
+        self.queue      = ChunkBuffer()
+        # Highlighting and HEX representation of received data
+        self.formatter  = ChunkFormatter(metrics.histogram('hex_time', 'us'))
+        # Numbers of received lines, parsed only while plot is shown
+        self.plot       = PlotBuffer()
+
+        self.subscribe('port_conf_change', self.port_conf_change.emit)
+        self.subscribe('update_device_list', self.update_device_list.emit)
+        self.subscribe('error', self.error.emit)
+        self.subscribe('data_ready', self.data_ready.emit)
+
+        if config['search_spool']:
+            self.start_spool()
+
+    def deliver(self, data, decoded, stamp=None):
+        '''
+        Put formatted chunk in the queue (see ChunkFormatter).
+        '''
+        result = self.formatter.format(data, decoded, self.spool, stamp)
+
+        print(decoded, end='')
+        self.queue.put(result, len(data))
+        self.plot.feed(decoded)
+        Reader.deliver(self, data, decoded, stamp)
+
+    def get_queue(self):
+        return self.queue
 
-        # Set configuration from config file
-        self.set_configuration(config['port'], config['baudrate'], 
-                config['parity'], config['bytesize'], config['stopbits'],
-                config['timeout'], config['eol'][0])
-
-        # PySerial object
-        self.ser = serial.Serial(baudrate=self._br, timeout=self.timeout,
-                bytesize=self._bytesize, parity=self._parity,
-                stopbits=self._stopbits)
-        # Flag for main cycle
-        self.running    = True
-        self.current_ports = []
-
-    def set_configuration(self, port=None, br=9600, parity=serial.PARITY_NONE, 
-            bytesize=serial.EIGHTBITS, stopbits=serial.STOPBITS_ONE, timeout=3,
-            eol='\n'):
-        self._port      = port or config['port']
-        self._br        = br or config['baudrate']
-        self._parity    = parity or config['parity']
-        self._bytesize  = bytesize or config['bytesize']
-        self._stopbits  = stopbits or config['stopbits']
-        self.timeout    = timeout or config['timeout']
-        self.eol        = eol or config['eol'][0]
+    def set_plotting(self, value):
+        self.plot.set_enabled(value)
+
+
+class AsyncModel(Model):
+    '''
+    Model reading the port with AsyncSerial (reader_mode 'asyncio'): the
+    model thread runs asyncio event loop watching the port instead of
+    blocking reads, received bytes go through the same pipeline as in
+    Model. Port control called from other threads is executed in the loop,
+    commands are written by Writer directly to the port.
+    '''
+
+    def __init__(self):
+        Model.__init__(self)
+        self.loop       = asyncio.new_event_loop()
+        self.aser       = AsyncSerial(self._port, self._br, self.receive)
+        # Only reading is done by the loop, Writer thread waits for the port
+        self.aser.ser.write_timeout = None
+        self.ser        = self.aser.ser
 
     def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.aser.close())
+        self.loop.close()
+        self.terminate()
+
+    def _call(self, coro):
         '''
-        Run thread.
-        In every iteration trying to read one line from serial port and put
-        it in queue.
+        Execute coroutine in the loop and wait for it.
+        Raises:
+            Exception raised by the coroutine.
         '''
-        try:
-            while self.running:
-                data = b''
-
-                self.paused.wait()
-                if not self.running:
-                    break
-
-                # If we doesn't choose any port and want to close the program
-                if not self.ser.isOpen():
-                    if not self.open_port():
-                        self.pause()
-                        continue
-
-                select.select([self.ser], [], [], 0.005)
-                size = self.ser.in_waiting
-                if size:
-                    try:
-                        data = self.read(size)
-                    except SerialException as e:
-                        logger.error('Error occured while reading data. ' + str(e))
-                        self.pause()
-                    except (OSError, TypeError) as e:
-                        logger.error('Can\'t read from serial port.')
-                        self.close_port()
-                        self.emit_error(2, 'Can\'t read from serial port.')
-                else:
-                    # sleep(0.005)
-                    continue
-
-                if data:
-                    decoded = ''
-                    try:
-                        decoded = data.decode('ASCII')
-                    except UnicodeError as e:
-                        logger.warn('Fail to decode bytes. Error: {}'.format(
-                            e))
-                        continue
-
-                    # One not formated and formated string for hex
-                    # representation
-                    hex_repr = self.add_html_colors(decoded)
-
-                    result = [decoded, hex_repr]
-
-                    print(decoded, end='')
-                    self.queue.put(result)
-        except KeyboardInterrupt:
-            if self.ser:
-                self.ser.close()
-            exit()
-        self.terminate()
+        if self.loop.is_closed():
+            coro.close()
+            return None
+        if not self.is_alive():
+            # Thread isn't started yet
+            return self.loop.run_until_complete(coro)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(config['timeout'])
+
+    def _call_soon(self, function, *args):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(function, *args)
+        elif not self.loop.is_closed():
+            function(*args)
+
+    def receive(self, data):
+        if data:
+            Model.receive(self, data)
+            return None
+
+        logger.error('Can\'t read from serial port.')
+        self.emit_error(2, 'Can\'t read from serial port.')
 
     def open_port(self):
-        if not self.ser.port:
+        if not self._port:
             self.emit_error(0, 'Port is not set.')
             return False
 
-        if self.ser:
-            logger.debug('Opening port {}.'.format(self._port))
-            try:
-                self.ser.open()
-                self.resume()
-            except SerialException as e:
-                self.emit_error(0, 'Can\'t open port: ' + str(self._port) + '.')
-                logger.debug('Fail to open port: {}'.format(e))
-                return False
+        logger.debug('Opening port {}.'.format(self._port))
+        try:
+            self._call(self.aser.open())
+        except (SerialException, OSError) as e:
+            self.emit_error(0, 'Can\'t open port: ' + str(self._port) + '.')
+            logger.debug('Fail to open port: {}'.format(e))
+            return False
 
+        self.decoder.reset()
+        if self.framer:
+            self.framer.reset()
+        self._overruns_base = self.driver_overruns() or 0
+        self.resume()
         return True
 
     def close_port(self):
-        if self.ser:
-            try:
-                self.ser.close()
-            except SerialException as e:
-                self.emit_error(1, 'Can\'t close port: ' + str(port) + '.')
-                logger.debug('Fail to close port: {}'.format(e))
-
-    def pause(self):
-        logger.debug('Pausing...')
-        if self.paused.isSet():
-            self.paused.clear()
+        try:
+            self._call(self.aser.close())
+        except SerialException as e:
+            self.emit_error(1, 'Can\'t close port: ' + str(self._port) + '.')
+            logger.debug('Fail to close port: {}'.format(e))
 
-    def resume(self):
-        logger.debug('Resuming...')
-        if not self.paused.isSet():
-            self.paused.set()
+    def set_port(self, port):
+        logger.debug('Set new port: {}.'.format(port))
+        if self.ser.isOpen():
+            self.close_port()
+        self._port = port
+        self._call(self.aser.set_port(port))
 
     def start_reading(self):
         logger.debug('Start reading...')
         if self.ser.isOpen():
-            self.ser.close()
-
+            self.close_port()
         if not self.open_port():
             self.pause()
-            return
-        else:
-            self.resume()
+
+    def pause(self):
+        logger.debug('Pausing...')
+        self.paused.clear()
+        self._call_soon(self.aser.pause)
+
+    def resume(self):
+        logger.debug('Resuming...')
+        self.paused.set()
+        self._call_soon(self.aser.resume)
 
     def stop(self):
-        '''
-        Stop thread.
-        '''
         logger.debug('Stopping...')
         self.running = False
-
-        if not self.paused.isSet():
-            self.paused.set()
-
-    def terminate(self):
-        if self.ser:
-            self.ser.close()
-
-    def scan_ports(self):
-        '''
-        Scans serial ports and if found changes in ports list (new one, one
-        dissapear etc.) update current port list.
-        Returns:
-            True if update.
-        '''
-        found_ports = self.list_serial_ports()
-        if found_ports != self.current_ports:
-            self.current_ports = found_ports
-            self.emit_update_device_list(self.current_ports)
-
-            return True
-
-        return False
-
-
-    def list_serial_ports(self):
-        """
-        Lists serial port names
-        """
-        return serial.tools.list_ports.comports()
-
-#==============================================================================
-# PySerial communication
-#==============================================================================
-    def read(self, size=1):
-        '''
-        Read all bytes in waiting buffer. 
-        Args:
-            size: integer specify number of bytes to read. Default is 1.
-        Returns:
-            String
-        '''
-        data = None
-
-        if self.ser.isOpen():
-            # logger.debug('Size to read: {}.'.format(size))
+        if self.is_alive():
             try:
-                data = self.ser.read(size)
-                self.ser.flushInput()
-            except TypeError as e:
-                logger.error('Error while reading: {}.'.format(e))
-                self.emit_error(2, 'Fail reading from port: {}'.format(
-                    self._port))
-        else:
-            logger.info('Can\'t read from the port. Port isn\'t open.')
-
-        return data
-
-    def readline(self):
-        '''
-        Read line from serial port. Read byte by byte until program get '\n'
-        symbol.
-        Returns:
-            String
-        '''
-        data = b''
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            except RuntimeError:
+                # Already stopped, the loop is closed by the thread
+                pass
 
-        if self.ser.isOpen():
-            try:
-                data = self.ser.readline()
-                self.ser.flushInput()
-            except SerialException as e:
-                logger.error(('Exception occured, while reading line from ' 
-                        'serial port.'))
-                self.emit_error(2, 'Fail reading from port: {}'.format(
-                    self._port))
-        else:
-            logger.info('Can\'t read from the port. Port isn\'t open.')
-
-        return data
-
-    def write(self, data):
-        '''
-        Write data to serial port.
-        Args:
-            data: data to send
-        '''
-        if self.ser.isOpen():
-            try:
-                self.ser.write(bytes(data, config['encode']) + 
-                               bytes(self.get_eol(), config['encode']))
-                self.ser.flushOutput()
-            except SerialException as e:
-                logger.error(('Exception occured, while writing to serial port.'
-                        '{}').format(e))
-                self.emit_error(3, 'Fail writing to port: {}'.format(
-                    self._port))
-        else:
-            logger.info('Can\'t write to the port. Port isn\'t open.')
-
-#==============================================================================
-# Attributes
-#==============================================================================
+    def start_replay(self, path, speed=1.0):
+        self.emit_error(0, 'Sessions can\'t be replayed by asyncio reader.')
+        return False
 
     @property
     def br(self):
@@ -292,142 +209,160 @@ class Model(threading.Thread, QObject):
 
     @br.setter
     def br(self, baudrate):
-        self.ser.reset_input_buffer()
         if int(baudrate) in serial.Serial.BAUDRATES:
             self._br = baudrate
-            self.ser.baudrate = baudrate
+            self.aser.br = baudrate
 
         self.emit_port_conf_change(self.port_config())
 
-    @property
-    def port(self):
-        return self._port
 
-    # @port.setter
-    def set_port(self, port):
-        logger.debug('Set new port: {}.'.format(port))
-        if self.ser and self.ser.isOpen():
-            self.close_port()
+class ProcessModel(ProcessReader, QObject):
+    '''
+    Reader running in a child process (see reader_process.py), for GUI.
+    Has the same signals and queue as Model, received lines are parsed for
+    the plot when they are taken from the queue.
+    '''
 
-        if self.ser.port != port:
-            self._port = port
-            self.ser.port = port
-        else:
-            return None
+    port_conf_change = pyqtSignal(object)
+    update_device_list = pyqtSignal(object)
+    error = pyqtSignal(object)
+    # Emitted when recording or logging is started or stopped by the child
+    # (commands don't wait for it)
+    recording_changed = pyqtSignal(object)
+    logging_changed = pyqtSignal(object)
+
+    def __init__(self):
+        # Numbers of received lines, parsed only while plot is shown
+        self.plot       = PlotBuffer()
+        ProcessReader.__init__(self, self.plot.feed)
+        QObject.__init__(self)
+
+        self.subscribe('port_conf_change', self.port_conf_change.emit)
+        self.subscribe('update_device_list', self.update_device_list.emit)
+        self.subscribe('error', self.error.emit)
+        self.subscribe('recording', self.recording_changed.emit)
+        self.subscribe('logging', self.logging_changed.emit)
 
     def get_queue(self):
         return self.queue
 
-    def set_eol(self, index):
-        if index < len(config['eol']) and index >= 0:
-            self.eol = config['eol'][index]
-        else:
-            logger.error('Can\t set up this type of End Of Line. Because it\'s '
-                    'not in standart list.')
-
-    def get_eol(self):
-        return self.eol
-
-#==============================================================================
-# Utils
-#==============================================================================
-    
-    def add_html_colors(self, string):
-        '''
-        Use predifiend dictionary to find regex at the string and add color HTML
-        tags to them.
-        Args:
-            string: String to parse
-        Returns:
-            HTML parsed string.
-        '''
+    def set_plotting(self, value):
+        self.plot.set_enabled(value)
 
-        i = 0
-        line = list(string)
-        result = list()
-
-        sub_str = list()
-        for i, sym in enumerate(line):
-            if ord(sym) in config['clr_set'].keys():
-                sub_str.append('<span style="color: {}">'.format(
-                    config['clr_set'][ord(sym)]))
-                sub_str.append('{0:02x}'.format(ord(sym)).upper())
-                sub_str.append('</span>')
-            else:
-                sub_str.append('{0:02x}'.format(ord(sym)).upper())
-
-            if (i + 1)%2 == 0:
-                sub_str.append(' ')
-
-            if (i + 1)%config['hex_bytes_in_row'] == 0:
-                result.append(''.join(sub_str))
-                sub_str = list()
-
-        if sub_str:
-            result.append(''.join(sub_str))
-
-        return result
-
-
-    def divide_text_in_blocks(self, string, length=4):
-        """
-        Divide string into substring of the 'length'.
-        Args:
-            string: string to divide.
-        Returns:
-            Divided string.
-        """
-        if length < 0:
-            return None
 
-        if len(string) < length:
-            return string
+class MuxModel(PortMux, QObject):
+    '''
+    Thread monitoring several ports for GUI. Every port has its own queue
+    with decoded text and HEX representation.
+    '''
 
-        return ' '.join(string[i:i + length] for i in range(
-            0, len(string), length))
+    # Emitted to indecate that error occured
+    error = pyqtSignal(object)
+    # Emitted when port is closed (by request or device is disconnected)
+    port_closed = pyqtSignal(object)
 
+    def __init__(self):
+        PortMux.__init__(self)
+        QObject.__init__(self)
+        # Port name -> queue with data received from the port
+        self.queues     = dict()
+        # Port name -> formatter of the port stream
+        self.formatters = dict()
+
+        self.subscribe('error', lambda port, msg: self.error.emit(msg))
+        self.subscribe('port_closed', self.port_closed.emit)
+
+    def add_port(self, name, baudrate=None):
+        self.queues[name] = ChunkBuffer()
+        # Not in the registry, metrics are updated by one thread each
+        self.formatters[name] = ChunkFormatter()
+        return PortMux.add_port(self, name, baudrate)
+
+    def remove_port(self, name):
+        PortMux.remove_port(self, name)
+        port_queue = self.queues.pop(name, None)
+        if port_queue is not None:
+            port_queue.close()
+        self.formatters.pop(name, None)
+
+    def deliver(self, name, data, decoded):
+        port_queue = self.queues.get(name)
+        formatter = self.formatters.get(name)
+        if port_queue is not None and formatter is not None:
+            # Monitored ports aren't spooled
+            port_queue.put(formatter.format(data, decoded), len(data))
+        PortMux.deliver(self, name, data, decoded)
+
+    def get_queue(self, name):
+        return self.queues[name]
+
+
+class HotplugModel(PortWatcher, QObject):
+    '''
+    Port watcher for GUI. Changes of port list are emitted as Qt signal.
+    '''
+
+    # Emitted with list of added ports and list of removed port names
+    ports_changed = pyqtSignal(object, object)
 
-    def port_config(self):
-        '''
-        Generate port configuration dictinoary. (Used in view)
-        Returns:
-            Dictionary.
-        '''
-        return {'baudrate': self._br, 'num_of_bits': self._bytesize, 
-                'parity': self._parity, 'num_of_stop': self._stopbits}
+    def __init__(self):
+        PortWatcher.__init__(self)
+        QObject.__init__(self)
 
-#==============================================================================
-# Signals
-#==============================================================================
+        self.subscribe('ports_changed', self.ports_changed.emit)
 
-    def emit_error(self, code, msg):
-        '''
-        Emits error signal. Signals:
-            0 = Fail to open port
-            1 = Fail to close port
-            2 = Fail to read from the port
-            3 = Fail to write to the port
-        Args:
-            code: int in range 0 - 3.
-        '''
-        if code in range(3):
-            self.error.emit(msg)
-        else:
-            logger.debug('Unknown error code.')
 
-    def emit_data_ready(self, data):
-        '''
-        Emits that data read from serial port is ready to send.
-        Args:
-            data: string
-        '''
-        self.data_ready.emit(data)
+class SearchModel(StreamSearch, QObject):
+    '''
+    Search in the stream spooled by the model. Results are emitted as Qt
+    signals.
+    '''
+
+    # Emitted with offset and length of the match (offset -1 - not found)
+    found = pyqtSignal(object, object)
+    error = pyqtSignal(object)
 
-    def emit_port_conf_change(self, value):
-        self.port_conf_change.emit(value)
+    def __init__(self, model):
+        StreamSearch.__init__(self, model.spool_path(), model.flush_spool)
+        QObject.__init__(self)
+
+        self.subscribe('found', self.found.emit)
+        self.subscribe('error', self.error.emit)
+
+
+class WriterModel(Writer, QObject):
+    '''
+    Writer thread for GUI. Statistics and errors are emitted as Qt signals.
+    '''
+
+    # Emitted with dictionary of counters after queuing and writing
+    stats_changed = pyqtSignal(object)
+    error = pyqtSignal(object)
+
+    def __init__(self, model):
+        Writer.__init__(self, model)
+        QObject.__init__(self)
+
+        self.subscribe('stats', self.stats_changed.emit)
+        self.subscribe('error', self.error.emit)
+
+
+class TransferModel(FileTransfer, QObject):
+    '''
+    File transfer for GUI. Progress and result are emitted as Qt signals.
+    '''
+
+    # Emitted with sent bytes and file size
+    progress = pyqtSignal(object, object)
+    # Emitted with success flag and message
+    finished = pyqtSignal(object, object)
+
+    def __init__(self, writer, path, mode):
+        FileTransfer.__init__(self, writer, path, mode)
+        QObject.__init__(self)
 
-    def emit_update_device_list(self, dev_list):
-        self.update_device_list.emit(dev_list)
+        self.subscribe('progress', self.progress.emit)
+        self.subscribe('finished', self.finished.emit)
 
 if __name__ == '__main__':
     a = Model()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Monitoring of several ports by one thread. All open ports are waited by one
+selector, so idle ports cost nothing and thread wakes up only for ports with
+data. Works on POSIX systems (port file descriptors are selectable).
+'''
+
+# System imports
+import  os
+import  queue
+import  logging
+import  selectors
+import  threading
+
+# PySerial imports
+import  serial
+from    serial.serialutil   import SerialException
+
+from config import config
+from line_decoder import LineDecoder
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class PortChannel:
+    '''
+    Port serviced by PortMux: serial object, decoder and counters.
+    '''
+
+    def __init__(self, name, baudrate=None):
+        self.name       = name
+        self.ser        = serial.Serial(baudrate=baudrate or
+                config['baudrate'], bytesize=config['bytesize'],
+                parity=config['parity'], stopbits=config['stopbits'],
+                timeout=0)
+        self.ser.port   = name
+        self.decoder    = LineDecoder(config['encoding'],
+                config['decode_errors'], config['eol'][config['rx_eol']],
+                config['rx_max_line'])
+        self.counters   = {'received': 0, 'delivered': 0, 'discarded': 0}
+
+    def fileno(self):
+        return self.ser.fileno()
+
+
+class PortMux(threading.Thread):
+    '''
+    Thread reading from any number of ports. Received data is tagged with
+    port name and passed to deliver().
+    Events:
+        'data': port name, received bytes and decoded text
+        'error': port name, error message
+        'port_closed': port name
+    '''
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.channels   = dict()
+        self.running    = True
+
+        self._selector  = selectors.DefaultSelector()
+        # Commands from other threads: (action, channel). Thread is woken up
+        # by writing to the pipe
+        self._commands  = queue.SimpleQueue()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def run(self):
+        '''
+        Run thread. Waits until one of the ports has data (or command
+        arrives) and reads everything available from ready ports.
+        '''
+        while self.running:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    self._process_commands()
+                else:
+                    self._read(key.data)
+
+        for channel in list(self.channels.values()):
+            self._close(channel)
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _read(self, channel):
+        try:
+            data = os.read(channel.fileno(), config['read_chunk'])
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            logger.error('Can\'t read from {}: {}'.format(channel.name, e))
+            self.notify('error', channel.name, 'Can\'t read from serial '
+                    'port {}.'.format(channel.name))
+            self._close(channel)
+            return None
+
+        if not data:
+            # Device disappeared
+            self._close(channel)
+            return None
+
+        channel.counters['received'] += len(data)
+        try:
+            decoded = channel.decoder.feed_text(data)
+        except UnicodeError as e:
+            logger.warn('Fail to decode bytes. Error: {}'.format(e))
+            channel.counters['discarded'] += len(data)
+            return None
+
+        self.deliver(channel.name, data, decoded)
+        channel.counters['delivered'] += len(data)
+
+    def _process_commands(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                action, channel = self._commands.get_nowait()
+            except queue.Empty:
+                break
+
+            if action == 'add' and channel.ser.isOpen():
+                self._selector.register(channel, selectors.EVENT_READ,
+                        channel)
+            elif action == 'remove':
+                self._close(channel)
+
+    def _close(self, channel):
+        if self.channels.get(channel.name) is channel:
+            del self.channels[channel.name]
+        try:
+            self._selector.unregister(channel)
+        except (KeyError, ValueError):
+            pass
+
+        try:
+            channel.ser.close()
+        except SerialException as e:
+            logger.debug('Fail to close port: {}'.format(e))
+        self.notify('port_closed', channel.name)
+
+    def _wake(self):
+        os.write(self._wake_w, b'x')
+
+    def add_port(self, name, baudrate=None):
+        '''
+        Open port and start reading from it.
+        Args:
+            name: port name.
+            baudrate: baudrate, default is taken from config.
+        Returns:
+            True if port is opened.
+        '''
+        if name in self.channels:
+            return True
+
+        channel = PortChannel(name, baudrate)
+        try:
+            channel.ser.open()
+        except SerialException as e:
+            logger.debug('Fail to open port: {}'.format(e))
+            self.notify('error', name, 'Can\'t open port: {}.'.format(name))
+            return False
+
+        self.channels[name] = channel
+        self._commands.put(('add', channel))
+        self._wake()
+
+        return True
+
+    def remove_port(self, name):
+        '''
+        Stop reading from the port and close it.
+        '''
+        channel = self.channels.get(name)
+        if channel:
+            self._commands.put(('remove', channel))
+            self._wake()
+
+    def stop(self):
+        '''
+        Stop thread, all ports are closed.
+        '''
+        self.running = False
+        self._wake()
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the mux
+        thread.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
+
+    def deliver(self, name, data, decoded):
+        '''
+        Pass received data to subscribers.
+        Args:
+            name: port name.
+            data: received bytes.
+            decoded: decoded text.
+        '''
+        self.notify('data', name, data, decoded)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Numeric values of received lines for plotting. Every line with numbers
+(CSV, "T=21.5 H=40" etc.) gives one sample, n-th number of the line goes to
+n-th channel. Samples are kept in preallocated NumPy ring buffer together
+with min/max pyramid (level k keeps min and max of aligned blocks of 2**k
+samples), so decimation to pixel columns reads about 2 values per column
+whatever number of samples is shown.
+
+NumPy is optional, plotting is not available without it.
+'''
+
+# System imports
+import  re
+import  math
+import  logging
+import  threading
+
+try:
+    import  numpy as np
+except ImportError:
+    np = None
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Numbers and line ends, so text is tokenized by one call. Tokens like
+# '1.2.3' aren't numbers and become NaN.
+TOKEN = re.compile(r'[-+]?\.?\d[\d.]*(?:[eE][-+]?\d+)?|\n')
+
+
+class PlotBuffer:
+    '''
+    Ring buffer of samples fed by the reader thread and read by the GUI
+    thread. Memory is allocated when plotting is enabled for the first time.
+    '''
+
+    def __init__(self, capacity=None, channels=None):
+        '''
+        Args:
+            capacity: number of kept samples, rounded up to power of two.
+            channels: maximum number of values taken from one line.
+        '''
+        capacity = capacity or config['plot_capacity']
+        self.capacity   = 1 << max(4, (int(capacity) - 1).bit_length())
+        self.channels   = channels or config['plot_channels']
+        self.enabled    = False
+        # Number of samples ever added and channels seen in lines
+        self.count      = 0
+        self.used       = 0
+        self.data       = None
+        # Level k (from 1) -> (mins, maxs), (channels, capacity >> k)
+        self.levels     = list()
+        # Incomplete line of the previous text
+        self._tail      = ''
+        self._lock      = threading.Lock()
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    def set_enabled(self, value):
+        if value and self.data is None:
+            if np is None:
+                logger.error('Plotting requires NumPy.')
+                return None
+            self._allocate()
+        self._tail = ''
+        self.enabled = bool(value)
+
+    def _allocate(self):
+        shape = (self.channels, self.capacity)
+        self.data = np.full(shape, np.nan, dtype=np.float32)
+        self.levels = [(np.full((self.channels, self.capacity >> k), np.nan,
+            dtype=np.float32), np.full((self.channels, self.capacity >> k),
+                np.nan, dtype=np.float32)) for k in range(1,
+                    self.capacity.bit_length() - 1)]
+
+    def clear(self):
+        with self._lock:
+            self.count  = 0
+            self.used   = 0
+            self._tail  = ''
+
+    def feed(self, text):
+        '''
+        Parse decoded text, last incomplete line is kept till the next call.
+        '''
+        if not self.enabled or not text:
+            return None
+
+        text = self._tail + text
+        end = text.rfind('\n') + 1
+        self._tail = text[end:]
+        if len(self._tail) > config['rx_max_line']:
+            self._tail = ''
+
+        tokens = TOKEN.findall(text, 0, end)
+        if len(tokens) == text.count('\n', 0, end):
+            return None
+
+        # Line of every number and its position in the line
+        newline = np.array(tokens, dtype='U1') == '\n'
+        numbers = [token for token in tokens if token != '\n']
+        try:
+            numbers = np.array(list(map(float, numbers)), dtype=np.float32)
+        except ValueError:
+            numbers = np.array(list(map(self._float, numbers)),
+                    dtype=np.float32)
+        lines = np.cumsum(newline)[~newline]
+        starts = np.flatnonzero(np.diff(lines, prepend=-1))
+        rows = np.cumsum(np.diff(lines, prepend=-1) != 0) - 1
+        positions = np.arange(len(lines)) - starts[rows]
+
+        keep = positions < self.channels
+        values = np.full((len(starts), self.channels), np.nan,
+                dtype=np.float32)
+        values[rows[keep], positions[keep]] = numbers[keep]
+
+        self.append(values, min(self.channels, int(positions.max()) + 1))
+
+    @staticmethod
+    def _float(token):
+        try:
+            return float(token)
+        except ValueError:
+            return math.nan
+
+    def append(self, values, width=None):
+        '''
+        Add samples.
+        Args:
+            values: array (samples, channels), NaN - no value.
+            width: number of used channels.
+        '''
+        capacity = self.capacity
+        if len(values) > capacity:
+            skipped = len(values) - capacity
+            values = values[skipped:]
+        else:
+            skipped = 0
+
+        with self._lock:
+            self.used = max(self.used, width or self.channels)
+            self.count += skipped
+            first = self.count
+            last = first + len(values)
+
+            # Level 0, at most two slices
+            start = first & (capacity - 1)
+            size = min(len(values), capacity - start)
+            self.data[:, start:start + size] = values[:size].T
+            self.data[:, :len(values) - size] = values[size:].T
+
+            # Blocks completed by the new samples, built from two halves
+            mins = maxs = self.data
+            for k, (level_mins, level_maxs) in enumerate(self.levels, 1):
+                blocks = np.arange(first >> k, last >> k)
+                if not len(blocks):
+                    break
+                left = (blocks << 1) & (mins.shape[1] - 1)
+                slots = blocks & (level_mins.shape[1] - 1)
+                level_mins[:, slots] = np.fmin(mins[:, left],
+                        mins[:, left + 1])
+                level_maxs[:, slots] = np.fmax(maxs[:, left],
+                        maxs[:, left + 1])
+                mins, maxs = level_mins, level_maxs
+
+            self.count = last
+
+    def columns(self, width, window=0):
+        '''
+        Decimate the last samples to pixel columns.
+        Args:
+            width: number of columns.
+            window: number of the last samples to show, 0 - all kept.
+        Returns:
+            (columns, mins, maxs, first, count): indices of non-empty
+            columns, minimum and maximum of every used channel in these
+            columns (arrays (channels, columns)), index of the first shown
+            sample and total number of samples. None if there are no samples.
+        '''
+        width = max(1, int(width))
+        with self._lock:
+            count = self.count
+            if not count or self.data is None:
+                return None
+
+            shown = min(count, self.capacity, window or self.capacity)
+            first = count - shown
+            used = self.used
+
+            # The largest blocks not exceeding samples per column
+            k = min(len(self.levels), max(0, int(math.log2(shown/width))))
+            if k:
+                level_mins, level_maxs = self.levels[k - 1]
+                blocks = np.arange(first >> k, count >> k)
+                slots = blocks & (level_mins.shape[1] - 1)
+                # Incomplete block at the end is taken from level 0
+                tail = np.arange(max(first, (count >> k) << k), count)
+                raw = tail & (self.capacity - 1)
+                positions = np.concatenate((blocks << k, tail))
+                mins = np.concatenate((level_mins[:used, slots],
+                    self.data[:used, raw]), axis=1)
+                maxs = np.concatenate((level_maxs[:used, slots],
+                    self.data[:used, raw]), axis=1)
+            else:
+                positions = np.arange(first, count)
+                mins = maxs = self.data[:used, positions & (self.capacity -
+                    1)]
+
+        # Block started before the window is put into the first column
+        columns = np.clip((positions - first)*width//shown, 0, width - 1)
+        starts = np.flatnonzero(np.diff(columns, prepend=-1))
+
+        return (columns[starts], np.fmin.reduceat(mins, starts, axis=1),
+                np.fmax.reduceat(maxs, starts, axis=1), first, count)
+
+    def last(self):
+        '''
+        Returns:
+            List of the last values of used channels (NaN - no value).
+        '''
+        with self._lock:
+            if not self.count:
+                return []
+            return self.data[:self.used,
+                    (self.count - 1) & (self.capacity - 1)].tolist()
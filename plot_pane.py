@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from PyQt5.QtWidgets    import QWidget
+from PyQt5.QtCore       import Qt
+from PyQt5.QtCore       import QTimer
+from PyQt5.QtCore       import QPointF
+from PyQt5.QtCore       import QRectF
+from PyQt5.QtGui        import QColor
+from PyQt5.QtGui        import QPainter
+from PyQt5.QtGui        import QPalette
+from PyQt5.QtGui        import QPolygonF
+
+import  numpy as np
+
+from config             import config
+
+# Colors of channels
+COLORS = ['#1F77B4', '#D62728', '#2CA02C', '#FF7F0E', '#9467BD', '#8C564B',
+        '#E377C2', '#17BECF']
+
+
+class PlotPane(QWidget):
+    '''
+    Live plot of the PlotBuffer. Samples are decimated to min/max of every
+    pixel column, so drawing cost depends on the width of the pane, not on
+    the number of shown samples. Mouse wheel changes number of shown
+    samples.
+    '''
+
+    def __init__(self, buffer, parent=None):
+        '''
+        Args:
+            buffer: PlotBuffer fed by the reader.
+        '''
+        QWidget.__init__(self, parent)
+
+        self.buffer     = buffer
+        # Number of the last samples shown (0 - all kept)
+        self.window     = config['plot_window']
+        # Number of samples when the plot was drawn
+        self._drawn     = None
+
+        self.setBackgroundRole(QPalette.Base)
+        self.setAutoFillBackground(True)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000//config['plot_fps'])
+
+    def refresh(self):
+        if self.isVisible() and self.buffer.count != self._drawn:
+            self.update()
+
+    def clear(self):
+        self.buffer.clear()
+        self.update()
+
+    def wheelEvent(self, event):
+        shown = self.window or self.buffer.capacity
+        if event.angleDelta().y() > 0:
+            shown = max(16, shown//2)
+        else:
+            shown = shown*2
+        self.window = 0 if shown >= self.buffer.capacity else shown
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        palette = self.palette()
+        fm = self.fontMetrics()
+        text_color = palette.color(QPalette.Text)
+        painter.setPen(text_color)
+
+        self._drawn = self.buffer.count
+        margin = fm.horizontalAdvance('-0.000e+00') + 8
+        area = QRectF(margin, fm.height() + 8, self.width() - margin - 8,
+                self.height() - 2*fm.height() - 16)
+        if area.width() < 2 or area.height() < 2:
+            return None
+
+        result = self.buffer.columns(area.width(), self.window)
+        if result is None:
+            painter.drawText(area, Qt.AlignCenter, 'No numeric data')
+            return None
+        columns, mins, maxs, first, count = result
+
+        with np.errstate(invalid='ignore'):
+            low, high = np.nanmin(mins), np.nanmax(maxs)
+        if not np.isfinite(low) or not np.isfinite(high):
+            return None
+        if high == low:
+            low, high = low - 1, high + 1
+        scale = (area.height() - 1)/(high - low)
+
+        # Frame, limits and range of shown samples
+        painter.setPen(palette.color(QPalette.Mid))
+        painter.drawRect(area)
+        painter.setPen(text_color)
+        painter.drawText(2, int(area.top()) + fm.ascent(), '{:.4g}'.format(
+            high))
+        painter.drawText(2, int(area.bottom()), '{:.4g}'.format(low))
+        painter.drawText(int(area.left()), int(area.bottom()) + fm.height() +
+                4, 'Samples {} - {} ({} shown)'.format(first, count - 1,
+                    count - first))
+
+        # Every column is a vertical segment from min to max, segments are
+        # joined into one polyline
+        x = np.repeat(area.left() + columns, 2).astype(float)
+        legend = int(area.left())
+        for channel, value in enumerate(self.buffer.last()):
+            color = QColor(COLORS[channel % len(COLORS)])
+            painter.setPen(color)
+
+            y = np.empty(2*len(columns))
+            y[0::2] = mins[channel]
+            y[1::2] = maxs[channel]
+            valid = np.isfinite(y)
+            y = area.bottom() - (y - low)*scale
+            painter.drawPolyline(QPolygonF([QPointF(px, py) for px, py in
+                zip(x[valid].tolist(), y[valid].tolist())]))
+
+            label = '{}: {:.6g}'.format(channel + 1, value)
+            painter.drawText(legend, fm.ascent() + 4, label)
+            legend += fm.horizontalAdvance(label) + 16
@@ -0,0 +1,346 @@
+from PyQt5.QtWidgets    import QWidget
+from PyQt5.QtWidgets    import QPlainTextEdit
+from PyQt5.QtWidgets    import QHBoxLayout
+from PyQt5.QtCore       import QTimer
+from PyQt5.QtGui        import QColor
+from PyQt5.QtGui        import QTextCharFormat
+from PyQt5.QtGui        import QTextCursor
+
+import re
+from bisect             import bisect_right
+from queue              import Empty
+from time               import monotonic
+from time               import perf_counter
+
+from config             import config
+from highlight          import Highlighter
+from line_decoder       import LineDecoder
+from text_pane          import TextPane
+
+# Byte in the text of HEX console row
+HEX_BYTE = re.compile('[0-9A-F]{2}')
+
+
+class PortPane(QWidget):
+    '''
+    Pair of consoles (text and HEX) showing data received from one port.
+    '''
+
+    def __init__(self, parent=None, metrics=None):
+        '''
+        Args:
+            metrics: registry for queue and rendering metrics, pane isn't
+                instrumented if None.
+        '''
+        QWidget.__init__(self, parent=parent)
+
+        self.queue      = None
+        self.metrics    = metrics
+        self.autoscroll = False
+        # Number of characters which can be drawn in one tick, adjusted to
+        # the measured drawing speed
+        self.tick_size  = config['render_min_chars']
+        # Stream offsets of shown chunks and (text line, HEX row, length of
+        # the text line) where every chunk starts, lines and rows are counted
+        # from the last clear()
+        self.mark_offsets   = list()
+        self.mark_positions = list()
+        # Number of HEX rows appended since the last clear()
+        self.hex_rows   = 0
+        # Bytes dropped by the queue which are already reported
+        self.dropped    = 0
+        # Runs the next tick as soon as events are handled when queue isn't
+        # drained, only one such tick is pending at a time
+        self._more      = QTimer(self)
+        self._more.setSingleShot(True)
+        self._more.setInterval(0)
+        self._more.timeout.connect(self.process_incoming)
+
+        # Editors pair box
+        editor_hbox = QHBoxLayout()
+        editor_hbox.setContentsMargins(0, 0, 0, 0)
+
+        # Text edit area
+        self.editer = TextPane(config['scrollback_lines'],
+                config['scrollback_bytes'], config['rx_max_line'])
+        self.editer.highlighter = Highlighter(text=True)
+        editor_hbox.addWidget(self.editer)
+
+        # HEX edit area
+        self.editor_hex = QPlainTextEdit()
+        self.editor_hex.scrollContentsBy = self.ModScrollContentsBy
+        self.editor_hex.setMaximumBlockCount(config['scrollback_lines'])
+
+        # font = QFont("serif", 10)
+        # font = self.editor_hex.document().defaultFont()
+        # fm = QFontMetrics(font)
+        # width = fm.width('0'*(config['hex_bytes_in_row']*2 +
+            # (floor(config['hex_bytes_in_row']/2) - 1) + 10))
+        # print(width)
+        # self.editor_hex.setFont(font)
+
+        # self.editor_hex.setFixedWidth(width)
+        self.editor_hex.setReadOnly(True)
+        editor_hbox.addWidget(self.editor_hex)
+
+        self.setLayout(editor_hbox)
+
+    def set_queue(self, queue):
+        self.queue = queue
+
+    def set_autoscroll(self, value):
+        self.autoscroll = value
+        self.editer.follow = bool(value)
+
+    def clear(self):
+        self.editer.clear()
+        self.editor_hex.clear()
+        self.mark_offsets.clear()
+        self.mark_positions.clear()
+        self.hex_rows = 0
+
+    def appendText(self, data):
+        self.editer.append(data[0], data[2] if len(data) > 2 else None)
+        self.append_hex(data[1])
+
+    def append_hex(self, rows):
+        if rows:
+            self.editor_hex.appendHtml(''.join(
+                '<p>{}</p>'.format(line) for line in rows))
+
+    def process_incoming(self):
+        '''
+        Take received chunks from the queue and show them. Chunks taken in
+        one tick are joined and every console is updated once. Amount of
+        data taken per tick is limited by the time budget, the rest is left
+        for the next tick.
+        Returns:
+            True if something was drawn.
+        '''
+        if self.queue is None:
+            return False
+
+        budget = config['render_budget_ms']/1000
+        deadline = perf_counter() + budget
+
+        scrollback = self.editer.scrollback
+        line = scrollback.dropped + max(0, len(scrollback) - 1)
+        column = len(scrollback[-1]) if len(scrollback) else 0
+        row = self.hex_rows
+
+        if self.metrics:
+            depth = self.queue.qsize()
+            self.metrics.gauges['queue_depth'] = depth
+            self.metrics.histogram('queue_depth', 'items').record(depth)
+            queue_age = self.metrics.histogram('queue_age', 'us')
+        now = monotonic()
+
+        text = list()
+        hex_rows = list()
+        # Position of every chunk in the joined text and its arrival time
+        stamps = list()
+        size = 0
+
+        # Data lost on queue overflow is marked where it's noticed
+        stats = self.queue.stats()
+        if stats['dropped'] > self.dropped:
+            marker = '[{} bytes dropped]\n'.format(stats['dropped'] -
+                    self.dropped)
+            if len(scrollback) and scrollback[-1]:
+                marker = '\n' + marker
+            self.dropped = stats['dropped']
+            text.append(marker)
+            line += marker.count('\n')
+            column = 0
+            size += len(marker)
+        if self.metrics:
+            self.metrics.gauges['queue_dropped'] = stats['dropped']
+            self.metrics.gauges['queue_spilled'] = stats['spill_size']
+        while size < self.tick_size and perf_counter() < deadline:
+            try:
+                msg = self.queue.get_nowait()
+            except Empty:
+                break
+
+            if self.metrics and len(msg) > 4:
+                queue_age.record((now - msg[4])*1e6)
+
+            if len(msg) > 3 and msg[3]:
+                # Highlight the end of already shown data, so rows of this
+                # tick are added first
+                self.append_hex(hex_rows)
+                self.hex_rows += len(hex_rows)
+                row, hex_rows = self.hex_rows, list()
+                self.recolor_hex(msg[3])
+
+            if len(msg) > 2 and msg[2] is not None:
+                self.mark_offsets.append(msg[2])
+                self.mark_positions.append((line, row + len(hex_rows),
+                    column))
+            # Long lines are wrapped by the scrollback into several lines
+            lines, column = scrollback.advance(column, msg[0])
+            line += lines
+            if len(msg) > 5:
+                stamps.append((size, msg[5]))
+
+            text.append(msg[0])
+            hex_rows.extend(msg[1])
+            size += len(msg[0])
+
+        if not text:
+            return False
+
+        start = perf_counter()
+        self.appendText([''.join(text), hex_rows, stamps])
+        self.hex_rows += len(hex_rows)
+        self._trim_marks()
+        if self.autoscroll:
+            self.editor_hex.ensureCursorVisible()
+            self.scroll_down()
+        elapsed = perf_counter() - start
+
+        if self.metrics:
+            self.metrics.histogram('render_time', 'us').record(elapsed*1e6)
+            self.metrics.histogram('render_chars', 'chars').record(size)
+
+        # Estimate how much can be drawn in the next tick
+        if size and elapsed:
+            self.tick_size = max(config['render_min_chars'],
+                    int(size/elapsed*budget))
+
+        # Don't wait for the timer if there is more data, but let event loop
+        # handle user input first
+        if self.queue.qsize() and not self._more.isActive():
+            self._more.start()
+
+        return True
+
+    def recolor_hex(self, carry):
+        '''
+        Highlight the last bytes in the HEX console: parts of matches which
+        continue in the next chunk.
+        Args:
+            carry: list of (number of bytes, color).
+        '''
+        doc = self.editor_hex.document()
+        for count, color in carry:
+            start = end = None
+            block = doc.lastBlock()
+            while count > 0 and block.isValid():
+                columns = [m.start() for m in HEX_BYTE.finditer(block.text())]
+                if columns and end is None:
+                    end = block.position() + columns[-1] + 2
+                taken = columns[-count:]
+                if taken:
+                    start = block.position() + taken[0]
+                count -= len(taken)
+                block = block.previous()
+
+            if start is None:
+                continue
+
+            cursor = QTextCursor(doc)
+            cursor.setPosition(start)
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+            fmt = QTextCharFormat()
+            fmt.setForeground(QColor(color))
+            cursor.mergeCharFormat(fmt)
+
+    def goto_offset(self, offset, length, read):
+        '''
+        Scroll both consoles to the data at the stream offset and select it.
+        Args:
+            offset: offset of the first byte in the stream.
+            length: number of bytes.
+            read: function returning stream bytes between two offsets.
+        Returns:
+            False if data isn't in the scrollback anymore.
+        '''
+        first = self._position(offset, read)
+        last = self._position(offset + max(1, length) - 1, read)
+        if first is None or last is None:
+            return False
+
+        self.editer.goto_line(first[0])
+
+        doc = self.editor_hex.document()
+        start = doc.findBlockByNumber(first[1])
+        end = doc.findBlockByNumber(last[1])
+        cursor = self.editor_hex.textCursor()
+        cursor.setPosition(start.position() + self._column(first[2]))
+        cursor.setPosition(end.position() + self._column(last[2]) + 2,
+                QTextCursor.KeepAnchor)
+        self.editor_hex.setTextCursor(cursor)
+        self.editor_hex.centerCursor()
+
+        return True
+
+    def _position(self, offset, read):
+        '''
+        Returns:
+            Text line index, HEX row index and byte index in the row of the
+            stream offset or None if it isn't shown.
+        '''
+        index = bisect_right(self.mark_offsets, offset) - 1
+        if index < 0:
+            return None
+
+        start = self.mark_offsets[index]
+        line, row, column = self.mark_positions[index]
+        eol = config['eol'][config['rx_eol']] or '\n'
+        # Text before the offset as the reader decoded it
+        decoder = LineDecoder(config['encoding'], config['decode_errors'])
+        text = decoder.decode(read(start, offset)).replace(eol, '\n')
+        lines, column = self.editer.scrollback.advance(column, text)
+        line += lines
+        if column and column == self.editer.scrollback.max_line and not \
+                read(offset, offset + len(eol)).startswith(
+                    eol.encode(config['encoding'])):
+            # Character at the offset is wrapped to the next line
+            line += 1
+        row += (offset - start)//config['hex_bytes_in_row']
+
+        line -= self.editer.scrollback.dropped
+        row -= self.hex_rows - self.editor_hex.blockCount()
+        if line < 0 or row < 0 or row >= self.editor_hex.blockCount():
+            return None
+
+        return line, row, (offset - start) % config['hex_bytes_in_row']
+
+    @staticmethod
+    def _column(index):
+        # Every byte takes two characters, pairs are separated by space
+        return index*2 + index//2
+
+    def _trim_marks(self):
+        '''
+        Forget marks of chunks which are dropped from both consoles.
+        '''
+        line = self.editer.scrollback.dropped
+        row = self.hex_rows - self.editor_hex.blockCount()
+
+        count = 0
+        for position in self.mark_positions[1:]:
+            if position[0] > line or position[1] > row:
+                break
+            count += 1
+
+        if count > 1024:
+            del self.mark_offsets[:count]
+            del self.mark_positions[:count]
+
+    def scroll_down(self):
+        self.editer.scroll_to_end()
+
+        sb = self.editor_hex.verticalScrollBar()
+        sb.setValue(sb.maximum())
+        self.editor_hex.moveCursor(QTextCursor.End)
+
+#==============================================================================
+# Events
+#==============================================================================
+    def ModScrollContentsBy(self, dx, dy):
+        if self.autoscroll:
+            self.editor_hex.ensureCursorVisible()
+        else:
+            QPlainTextEdit.scrollContentsBy(self.editor_hex, dx, dy)
@@ -3,9 +3,18 @@
 
 import logging
 
-import PyQt5.QtCore
 
 from model import Model
+from model import AsyncModel
+from model import ProcessModel
+from model import MuxModel
+from model import HotplugModel
+from model import SearchModel
+from model import WriterModel
+from model import TransferModel
+from fanout import FanoutServer
+from config import config
+from metrics import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -15,24 +24,61 @@ class Presenter:
 
     def __init__(self, view):
 
-        self.__model = Model()
+        # Port is read in a child process if configured, so GUI can't
+        # delay reading
+        if config['reader_process']:
+            self.__model = ProcessModel()
+        elif config['reader_mode'] == 'asyncio':
+            self.__model = AsyncModel()
+        else:
+            self.__model = Model()
         self.__view = view
+        # Thread for ports monitored in separate tabs, started on demand
+        self.__mux = None
 
-        # Periodically update ports list
-        # PyQt5.QtCore.QTimer.singleShot(10, self.scan_ports)
-        timer = PyQt5.QtCore.QTimer(self.__view)
-        timer.timeout.connect(self.scan_ports)
-        timer.start(1000)
+        if config['metrics_port']:
+            metrics.serve(config['metrics_port'])
+
+        # Ports list is updated by background watcher
+        self.__watcher = HotplugModel()
+        self.__watcher.ports_changed.connect(self.__view.update_devices)
+        self.__watcher.start()
 
         # Run communication and start thread
         self.__model.start()
 
+        # Search in the stream spooled by the model
+        self.__search = SearchModel(self.__model)
+        self.__search.found.connect(self.show_match)
+        self.__search.error.connect(self.__view.set_find_status)
+        self.__search.start()
+
+        # Commands are written by a separate thread
+        self.__writer = WriterModel(self.__model)
+        self.__writer.stats_changed.connect(self.__view.update_tx_stats)
+        self.__writer.error.connect(self.__view.show_error)
+        self.__writer.start()
+        # File being sent
+        self.__transfer = None
+        # Server sharing the stream with local clients
+        self.__fanout = None
+        if config['fanout_address']:
+            self.start_fanout(config['fanout_address'])
+
         # Signal connection
-        self.__view.send_data.connect(self.__model.write)
+        self.__view.send_data.connect(self.__writer.send)
         self.__view.baudrate_changed.connect(
                 lambda x: setattr(self.__model, 'br', x))
         self.__view.port_changed.connect(self.port_changed)
         self.__view.eol_changed.connect(self.__model.set_eol)
+        self.__view.recording_changed.connect(self.recording_changed)
+        self.__view.logging_changed.connect(self.logging_changed)
+        self.__view.replay_session.connect(self.replay_session)
+        self.__view.send_file.connect(self.send_file)
+        self.__view.cancel_transfer.connect(self.cancel_transfer)
+        self.__view.monitor_port.connect(self.monitor_port)
+        self.__view.close_monitor.connect(self.close_monitor)
+        self.__view.search_stream.connect(self.__search.find)
 
         self.__view.pause_m.connect(self.__model.pause)
         # self.__view.start_m.connect(self.start_model)
@@ -40,10 +86,19 @@ class Presenter:
 
         self.__model.error.connect(self.__view.show_error)
         self.__model.port_conf_change.connect(self.__view.update_status_bar)
-        self.__model.update_device_list.connect(self.__view.add_devices)
+        if config['reader_process']:
+            # Recording and logging are started by the child, failures come
+            # later
+            self.__model.recording_changed.connect(self.__view.set_recording)
+            self.__model.logging_changed.connect(self.__view.set_logging)
 
         self.__view.set_queue(self.__model.get_queue())
+        self.__view.set_plot_buffer(self.__model.plot)
+        self.__view.plotting_changed.connect(self.__model.set_plotting)
         self.__view.set_end_cmd(self.end_cmd)
+        if config['log_dir']:
+            self.__view.set_logging(True)
+            self.logging_changed(config['log_dir'])
         #self.__view.set_port(self.__model.port)
         self.__view.update_gui()
 
@@ -55,18 +110,107 @@ class Presenter:
         if not self.__model.paused.is_set():
             self.__model.resume()
 
-    def scan_ports(self):
-        if self.__model.scan_ports():
-            logger.info("Update port's list. Ports: {}.".format(
-                self.__model.current_ports))
-
     def port_changed(self, port):
         self.__model.set_port(port)
         self.__model.start_reading()
         self.__view.update_status_bar(self.__model.port_config())
 
+    def replay_session(self, path):
+        if self.__model.start_replay(path, config['replay_speed']):
+            self.__view.update_status_bar(self.__model.port_config())
+
+    def send_file(self, path, mode):
+        '''
+        Send file in a separate thread. Receiver responses are taken from
+        the data read by the model.
+        '''
+        if self.__transfer:
+            self.__view.show_error('File is already being sent.')
+            return None
+
+        try:
+            transfer = TransferModel(self.__writer, path, mode)
+        except (OSError, ValueError) as e:
+            self.__view.set_transferring(False)
+            self.__view.show_error('Can\'t send file: {}'.format(e))
+            return None
+
+        transfer.progress.connect(self.__view.show_transfer_progress)
+        transfer.finished.connect(self.transfer_finished)
+        self.__model.subscribe('data', transfer.feed)
+        self.__transfer = transfer
+        transfer.start()
+
+    def cancel_transfer(self):
+        if self.__transfer:
+            self.__transfer.cancel()
+
+    def transfer_finished(self, success, message):
+        self.__model.unsubscribe('data', self.__transfer.feed)
+        self.__transfer = None
+        self.__view.transfer_finished(success, message)
+
+    def recording_changed(self, path):
+        if not path:
+            self.__model.stop_recording()
+        elif not self.__model.start_recording(path):
+            self.__view.set_recording(False)
+
+    def logging_changed(self, directory):
+        if not directory:
+            self.__model.stop_logging()
+        elif not self.__model.start_logging(directory):
+            self.__view.set_logging(False)
+
+    def start_fanout(self, address):
+        '''
+        Re-broadcast received bytes to local clients, their data is sent
+        to the port like commands.
+        '''
+        try:
+            server = FanoutServer(address, self.__writer.send)
+        except (OSError, ValueError) as e:
+            logger.error('Fail to start fan-out server: {}'.format(e))
+            self.__view.show_error('Can\'t serve on {}: {}'.format(address,
+                e))
+            return None
+
+        self.__model.subscribe('data', server.broadcast)
+        server.start()
+        self.__fanout = server
+        logger.info('Serving the stream on {}.'.format(server.address))
+
+    def show_match(self, offset, length):
+        self.__view.show_match(offset, length, self.__search.read)
+
+    def monitor_port(self, port):
+        '''
+        Open port in a separate tab. All such ports are read by one thread.
+        '''
+        if not self.__mux:
+            self.__mux = MuxModel()
+            self.__mux.error.connect(self.__view.show_error)
+            self.__mux.port_closed.connect(self.__view.port_tab_closed)
+            self.__mux.start()
+
+        if self.__mux.add_port(port, int(self.__model.br)):
+            self.__view.add_port_tab(port, self.__mux.get_queue(port))
+
+    def close_monitor(self, port):
+        if self.__mux:
+            self.__mux.remove_port(port)
+
     def end_cmd(self):
         '''
         Stop model thread.
         '''
         self.__model.stop()
+        self.__watcher.stop()
+        self.__search.stop()
+        self.__writer.stop()
+        self.cancel_transfer()
+        if self.__fanout:
+            self.__fanout.stop()
+        metrics.stop()
+        if self.__mux:
+            self.__mux.stop()
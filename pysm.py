@@ -2,18 +2,99 @@
 # coding=utf-8
 
 import sys
+import atexit
+import argparse
 
-# Library imports
-from PyQt5.QtWidgets import QApplication
 
-# Local imports
-from    view        import View
-from    presenter   import Presenter
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serial monitor.')
+    parser.add_argument('--headless', action='store_true',
+            help='capture without GUI')
+    parser.add_argument('--port', help='serial port')
+    parser.add_argument('--baudrate', type=int, help='baudrate')
+    parser.add_argument('--out', default='-',
+            help='output file for headless mode (default: stdout)')
+    parser.add_argument('--raw', action='store_true',
+            help='write received bytes instead of decoded text')
+    parser.add_argument('--record', metavar='SESSION',
+            help='record received bytes to the session file')
+    parser.add_argument('--log', metavar='DIRECTORY',
+            help='log received bytes to rotating compressed files')
+    parser.add_argument('--log-codec', choices=['gzip', 'zstd'],
+            help='compression of log files (zstd requires zstandard)')
+    parser.add_argument('--replay', metavar='SESSION',
+            help='replay recorded session instead of reading the port')
+    parser.add_argument('--speed', type=float,
+            help='replay speed (1 - original timing, 0 - as fast as '
+            'possible)')
+    parser.add_argument('--framing', choices=['slip', 'cobs', 'length'],
+            help='decode received bytes as binary frames')
+    parser.add_argument('--frame-crc', choices=['crc16', 'crc32'],
+            help='CRC at the end of every frame')
+    parser.add_argument('--serve', metavar='ADDRESS',
+            help='share the stream with local clients on TCP PORT, '
+            'HOST:PORT or Unix socket path')
+    parser.add_argument('--process', action='store_true',
+            help='read and format received data in a child process')
+    parser.add_argument('--reader-mode', choices=['blocking', 'poll',
+            'asyncio'], help='how the port is waited for')
+    parser.add_argument('--duration', type=float, default=0,
+            help='stop capture after this many seconds')
+    parser.add_argument('--metrics', metavar='FILE',
+            help='write pipeline metrics to JSON file on exit')
+    parser.add_argument('--metrics-port', type=int, default=0,
+            help='serve pipeline metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('-v', '--verbose', action='store_true',
+            help='print debug messages')
+
+    # Unknown arguments are left for Qt
+    return parser.parse_known_args()[0]
+
 
 if __name__ == '__main__':
+    args = parse_args()
+
+    from config import config
+    from metrics import metrics
+    if args.metrics_port:
+        config['metrics_port'] = args.metrics_port
+    if args.framing:
+        config['framing'] = args.framing
+        config['frame_crc'] = args.frame_crc
+    if args.log:
+        config['log_dir'] = args.log
+    if args.log_codec:
+        config['log_codec'] = args.log_codec
+    if args.serve:
+        config['fanout_address'] = args.serve
+    if args.process:
+        config['reader_process'] = True
+    if args.reader_mode:
+        config['reader_mode'] = args.reader_mode
+    if args.speed is not None:
+        config['replay_speed'] = args.speed
+    if args.metrics:
+        atexit.register(metrics.dump, args.metrics)
+
+    if args.headless:
+        # Qt isn't imported in headless mode
+        from headless import run
+        sys.exit(run(args))
+
+    # Library imports
+    from PyQt5.QtWidgets import QApplication
+
+    # Local imports
+    from    view        import View
+    from    presenter   import Presenter
+
     app         = QApplication(sys.argv)
     gui         = View()
     presenter   = Presenter(gui)
+    if args.replay:
+        presenter.replay_session(args.replay)
+    elif args.port:
+        presenter.port_changed(args.port)
 
     gui.show()
     sys.exit(app.exec_())
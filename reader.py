@@ -0,0 +1,820 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# System imports
+import  os
+import  sys
+import  glob
+import  select
+import  struct
+import  logging
+import  threading
+import  contextlib
+import  time
+try:
+    import  fcntl
+    import  termios
+except ImportError:
+    fcntl = None
+from    time                import sleep
+from    sys                 import exit
+
+# PySerial imports
+import  serial
+import  serial.tools.list_ports
+from    serial.serialutil   import SerialException
+
+from config import config
+from line_decoder import LineDecoder
+from framing import make_decoder
+from framing import format_frame
+from recorder import SessionRecorder
+from rotating_log import RotatingLog
+from search import StreamSpool
+from replay import ReplaySerial
+from metrics import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+class Reader(threading.Thread):
+    '''
+    Serial port reader thread. Doesn't depend on Qt, events (errors, port
+    configuration changes, received data) are delivered to callbacks
+    registered with subscribe().
+    Events:
+        'port_conf_change': port configuration dictionary
+        'update_device_list': list of ports
+        'error': error message
+        'data_ready': data
+        'data': received bytes and decoded text
+        'frames': list of frame payloads decoded from received bytes (only
+        if framing is set)
+    '''
+
+    def __init__(self, port=None, baudrate=None):
+        threading.Thread.__init__(self)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.paused = threading.Event()
+        self.paused.clear()
+        # Held by the thread while reading, port is closed or changed only
+        # when the reading is canceled
+        self._io_lock = threading.RLock()
+        # Number of pending port changes (see _port_access()), the thread
+        # doesn't start the next read until they are done
+        self._io_requests = 0
+        self._io_cond   = threading.Condition()
+        # Bytes read from the port, put in the queue and thrown away
+        self.counters = {'received': 0, 'delivered': 0, 'discarded': 0}
+        # Pipeline instrumentation
+        self.rx_bytes       = metrics.meter('rx_bytes', 'B')
+        self.rx_chunk       = metrics.histogram('rx_chunk', 'B')
+        self.decode_time    = metrics.histogram('decode_time', 'us')
+        # Overrun counters reported by the driver when port was opened
+        self._overruns_base = 0
+        # Raw session recorder
+        self.recorder   = None
+        self._rec_lock  = threading.Lock()
+        # Temporary file with the whole received stream (for search)
+        self.spool      = None
+        # Continuous compressed log
+        self.log        = None
+        # Decoder of received bytes into lines
+        self.decoder = LineDecoder(config['encoding'], config['decode_errors'],
+                config['eol'][config['rx_eol']], config['rx_max_line'])
+        # Decoder of binary frames, replaces text decoding if set
+        self.framer     = None
+        self.frames     = metrics.meter('frames')
+        if config['framing']:
+            self.set_framing(config['framing'], config['frame_crc'])
+
+        # Set configuration from config file
+        self.set_configuration(port or config['port'],
+                baudrate or config['baudrate'],
+                config['parity'], config['bytesize'], config['stopbits'],
+                config['timeout'], config['eol'][0])
+
+        # PySerial object
+        self.ser = serial.Serial(baudrate=self._br, timeout=self.timeout,
+                bytesize=self._bytesize, parity=self._parity,
+                stopbits=self._stopbits)
+        # Serial port object while session is replayed instead of it
+        self._serial = None
+        # Flag for main cycle
+        self.running    = True
+        self.current_ports = []
+
+    def set_configuration(self, port=None, br=9600, parity=serial.PARITY_NONE, 
+            bytesize=serial.EIGHTBITS, stopbits=serial.STOPBITS_ONE, timeout=3,
+            eol='\n'):
+        self._port      = port or config['port']
+        self._br        = br or config['baudrate']
+        self._parity    = parity or config['parity']
+        self._bytesize  = bytesize or config['bytesize']
+        self._stopbits  = stopbits or config['stopbits']
+        self.timeout    = timeout or config['timeout']
+        self.eol        = eol or config['eol'][0]
+
+    def run(self):
+        '''
+        Run thread.
+        In every iteration waits for data from serial port, decodes it and
+        passes to deliver().
+        '''
+        try:
+            while self.running:
+                data = b''
+
+                if not self.paused.is_set():
+                    self.paused.wait()
+                if not self.running:
+                    break
+
+                # Port is being closed or changed by another thread
+                with self._io_cond:
+                    self._io_cond.wait_for(lambda: not self._io_requests or
+                            not self.running)
+
+                # If we doesn't choose any port and want to close the program
+                if not self.ser.isOpen():
+                    if not self.open_port():
+                        self.pause()
+                        continue
+
+                try:
+                    with self._io_lock:
+                        data = self.read_available()
+                except SerialException as e:
+                    logger.error('Error occured while reading data. ' + str(e))
+                    self.pause()
+                except (OSError, TypeError) as e:
+                    logger.error('Can\'t read from serial port.')
+                    self.close_port()
+                    self.emit_error(2, 'Can\'t read from serial port.')
+
+                if data:
+                    self.receive(data)
+        except KeyboardInterrupt:
+            if self.ser:
+                self.ser.close()
+            exit()
+        self.terminate()
+
+    def receive(self, data):
+        '''
+        Process bytes read from the port: count, record and decode them
+        (text or frames) and pass them to deliver().
+        '''
+        self.counters['received'] += len(data)
+        self.rx_bytes.add(len(data))
+        self.rx_chunk.record(len(data))
+        stamp = time.monotonic_ns()
+        self.record(data, stamp)
+
+        start = time.perf_counter_ns()
+        if self.framer:
+            decoded = self.decode_frames(data, stamp)
+        else:
+            try:
+                decoded = self.decoder.feed_text(data)
+            except UnicodeError as e:
+                logger.warn('Fail to decode bytes. Error: {}'.format(e))
+                self.counters['discarded'] += len(data)
+                return None
+        self.decode_time.record((time.perf_counter_ns() - start)//1000)
+
+        self.deliver(data, decoded, stamp)
+
+    def open_port(self):
+        if not self.ser.port:
+            self.emit_error(0, 'Port is not set.')
+            return False
+
+        if self.ser:
+            logger.debug('Opening port {}.'.format(self._port))
+            try:
+                self.ser.open()
+                self.decoder.reset()
+                if self.framer:
+                    self.framer.reset()
+                self._overruns_base = self.driver_overruns() or 0
+                self.resume()
+            except SerialException as e:
+                self.emit_error(0, 'Can\'t open port: ' + str(self._port) + '.')
+                logger.debug('Fail to open port: {}'.format(e))
+                return False
+
+        return True
+
+    def close_port(self):
+        if self.ser:
+            with self._port_access():
+                try:
+                    self.ser.close()
+                except SerialException as e:
+                    self.emit_error(1, 'Can\'t close port: ' + 
+                            str(self._port) + '.')
+                    logger.debug('Fail to close port: {}'.format(e))
+
+    @contextlib.contextmanager
+    def _port_access(self):
+        '''
+        Take the port from the reader thread: reading is canceled and the
+        thread doesn't start the next read until the block is left.
+        '''
+        with self._io_cond:
+            self._io_requests += 1
+        try:
+            self.cancel_read()
+            with self._io_lock:
+                yield
+        finally:
+            with self._io_cond:
+                self._io_requests -= 1
+                self._io_cond.notify_all()
+
+    def cancel_read(self):
+        '''
+        Wake up the thread if it's blocked on reading from the port.
+        '''
+        if self.ser.isOpen() and hasattr(self.ser, 'cancel_read'):
+            try:
+                self.ser.cancel_read()
+            except (OSError, TypeError) as e:
+                logger.debug('Fail to cancel reading: {}'.format(e))
+
+    def pause(self):
+        logger.debug('Pausing...')
+        if self.paused.isSet():
+            self.paused.clear()
+            self.cancel_read()
+
+    def resume(self):
+        logger.debug('Resuming...')
+        if not self.paused.isSet():
+            self.paused.set()
+
+    def start_reading(self):
+        logger.debug('Start reading...')
+        with self._port_access():
+            if self.ser.isOpen():
+                self.ser.close()
+            opened = self.open_port()
+
+        if not opened:
+            self.pause()
+            return
+        else:
+            self.resume()
+
+    def stop(self):
+        '''
+        Stop thread.
+        '''
+        logger.debug('Stopping...')
+        self.running = False
+
+        if not self.paused.isSet():
+            self.paused.set()
+        with self._io_cond:
+            self._io_cond.notify_all()
+        self.cancel_read()
+
+    def terminate(self):
+        if self.ser:
+            self.ser.close()
+        self.stop_recording()
+        self.stop_spool()
+        self.stop_logging()
+
+    def start_replay(self, path, speed=1.0):
+        '''
+        Replay recorded session instead of reading from the port, until
+        another port is set.
+        Args:
+            path: session file.
+            speed: replay speed, 1 - original timing, 0 - as fast as
+                possible.
+        Returns:
+            True if replay is started.
+        '''
+        try:
+            replay = ReplaySerial(path, speed, self.timeout)
+        except (OSError, ValueError) as e:
+            logger.error('Fail to open session: {}'.format(e))
+            self.emit_error(0, 'Can\'t open session: ' + str(path) + '.')
+            return False
+
+        with self._port_access():
+            if self.ser.isOpen():
+                self.close_port()
+            if self._serial is None:
+                self._serial = self.ser
+            self.ser = replay
+            self._port = path
+
+        self.start_reading()
+        return True
+
+    def set_framing(self, name, crc=None):
+        '''
+        Decode received bytes as binary frames instead of text.
+        Args:
+            name: 'slip', 'cobs', 'length' or None to decode text.
+            crc: None, 'crc16' or 'crc32'.
+        Returns:
+            True if framing is set.
+        '''
+        if not name:
+            self.framer = None
+            return True
+
+        try:
+            framer = make_decoder(name, crc, config['frame_max'],
+                    size=config['frame_length_size'],
+                    byteorder=config['frame_length_order'])
+        except ValueError as e:
+            logger.error('Fail to set framing: {}'.format(e))
+            return False
+
+        self.framer = framer
+        return True
+
+    def decode_frames(self, data, stamp):
+        '''
+        Decode frames, pass them to subscribers and to the recorder.
+        Returns:
+            Text with one frame per line.
+        '''
+        framer = self.framer
+        frames = framer.feed(data)
+        metrics.gauges['frame_errors'] = framer.errors
+        if not frames:
+            return ''
+
+        self.frames.add(len(frames))
+        with self._rec_lock:
+            if self.recorder:
+                try:
+                    self.recorder.write_frames(frames, stamp)
+                except OSError as e:
+                    logger.error('Fail to write frames: {}'.format(e))
+        self.notify('frames', frames)
+
+        return ''.join(format_frame(frame) + '\n' for frame in frames)
+
+    def start_recording(self, path):
+        '''
+        Start recording received bytes to the session file.
+        Args:
+            path: session file name.
+        Returns:
+            True if recording is started.
+        '''
+        try:
+            recorder = SessionRecorder(path, config['record_interval'])
+        except OSError as e:
+            logger.error('Fail to start recording: {}'.format(e))
+            self.emit_error(4, 'Can\'t open file for recording: ' +
+                    str(path) + '.')
+            return False
+
+        with self._rec_lock:
+            previous, self.recorder = self.recorder, recorder
+        if previous:
+            previous.close()
+
+        logger.debug('Recording to {}.'.format(path))
+        return True
+
+    def stop_recording(self):
+        with self._rec_lock:
+            recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.close()
+            logger.debug('Recording to {} is stopped.'.format(recorder.path))
+
+    def start_logging(self, directory):
+        '''
+        Start continuous compressed logging of received bytes to the
+        directory (see rotating_log.py).
+        Returns:
+            True if logging is started.
+        '''
+        try:
+            log = RotatingLog(directory)
+        except (OSError, ValueError) as e:
+            logger.error('Fail to start logging: {}'.format(e))
+            self.emit_error(4, 'Can\'t start logging to ' + str(directory) +
+                    ': ' + str(e))
+            return False
+
+        log.subscribe('error', lambda msg: self._log_failed(log, msg))
+        log.start()
+        with self._rec_lock:
+            previous, self.log = self.log, log
+        if previous:
+            previous.stop()
+
+        logger.debug('Logging to {}.'.format(directory))
+        return True
+
+    def stop_logging(self):
+        with self._rec_lock:
+            log, self.log = self.log, None
+        if log:
+            log.stop()
+            logger.debug('Logging to {} is stopped.'.format(log.directory))
+
+    def _log_failed(self, log, msg):
+        # Called by the log thread, which finishes by itself
+        with self._rec_lock:
+            if self.log is log:
+                self.log = None
+        self.emit_error(4, msg)
+
+    def start_spool(self):
+        '''
+        Start spooling received bytes to temporary files (at most
+        search_spool_max bytes are kept), which are removed by
+        stop_spool().
+        Returns:
+            True if spooling is started.
+        '''
+        if self.spool:
+            return True
+
+        try:
+            spool = StreamSpool(config['search_spool_max'])
+        except OSError as e:
+            logger.error('Fail to start spooling: {}'.format(e))
+            return False
+
+        with self._rec_lock:
+            self.spool = spool
+
+        return True
+
+    def stop_spool(self):
+        with self._rec_lock:
+            spool, self.spool = self.spool, None
+        if spool:
+            spool.close()
+
+    def spool_path(self):
+        '''
+        Returns:
+            Spool directory or None if stream isn't spooled.
+        '''
+        spool = self.spool
+        return spool.directory if spool else None
+
+    def flush_spool(self):
+        '''
+        Write buffered bytes to the spool file.
+        '''
+        with self._rec_lock:
+            if self.spool:
+                self.spool.flush()
+
+    def record(self, data, stamp):
+        '''
+        Append received bytes to the spool and to the session file if
+        recording.
+        '''
+        with self._rec_lock:
+            if self.spool:
+                try:
+                    self.spool.write(data, stamp)
+                except OSError as e:
+                    logger.error('Fail to write spool: {}'.format(e))
+                    self.spool.close()
+                    self.spool = None
+
+            if self.recorder:
+                try:
+                    self.recorder.write(data, stamp)
+                except OSError as e:
+                    logger.error('Fail to write recording: {}'.format(e))
+                    self.recorder.close()
+                    self.recorder = None
+                    self.emit_error(4, 'Recording is stopped: {}'.format(e))
+
+            if self.log:
+                self.log.write(data, stamp)
+
+    def scan_ports(self):
+        '''
+        Scans serial ports and if found changes in ports list (new one, one
+        dissapear etc.) update current port list.
+        Returns:
+            True if update.
+        '''
+        found_ports = self.list_serial_ports()
+        if found_ports != self.current_ports:
+            self.current_ports = found_ports
+            self.emit_update_device_list(self.current_ports)
+
+            return True
+
+        return False
+
+
+    def list_serial_ports(self):
+        """
+        Lists serial port names
+        """
+        return serial.tools.list_ports.comports()
+
+#==============================================================================
+# PySerial communication
+#==============================================================================
+    def read_available(self):
+        '''
+        Wait for data and read all bytes available in the port. In
+        'blocking' mode thread sleeps in read until the first byte arrives,
+        reading is canceled (pause, port change, stop) or timeout expires. In
+        'poll' mode port is checked every 5 ms.
+        Returns:
+            Bytes (empty if nothing was received).
+        '''
+        if config['reader_mode'] == 'poll':
+            if hasattr(self.ser, 'fileno'):
+                select.select([self.ser], [], [], 0.005)
+            else:
+                sleep(0.005)
+            size = self.ser.in_waiting
+            return self.read(size) if size else b''
+
+        data = self.ser.read(1)
+        if data:
+            size = min(self.ser.in_waiting, config['read_chunk'])
+            if size:
+                data += self.read(size)
+
+        return data
+
+    def read(self, size=1):
+        '''
+        Read all bytes in waiting buffer. 
+        Args:
+            size: integer specify number of bytes to read. Default is 1.
+        Returns:
+            String
+        '''
+        data = None
+
+        if self.ser.isOpen():
+            # logger.debug('Size to read: {}.'.format(size))
+            try:
+                data = self.ser.read(size)
+                self.flush_input()
+            except TypeError as e:
+                logger.error('Error while reading: {}.'.format(e))
+                self.emit_error(2, 'Fail reading from port: {}'.format(
+                    self._port))
+        else:
+            logger.info('Can\'t read from the port. Port isn\'t open.')
+
+        return data
+
+    def readline(self):
+        '''
+        Read line from serial port. Read byte by byte until program get '\n'
+        symbol.
+        Returns:
+            String
+        '''
+        data = b''
+
+        if self.ser.isOpen():
+            try:
+                data = self.ser.readline()
+                self.flush_input()
+            except SerialException as e:
+                logger.error(('Exception occured, while reading line from ' 
+                        'serial port.'))
+                self.emit_error(2, 'Fail reading from port: {}'.format(
+                    self._port))
+        else:
+            logger.info('Can\'t read from the port. Port isn\'t open.')
+
+        return data
+
+    def flush_input(self):
+        '''
+        Throw away bytes left in the input buffer after reading. Does
+        nothing in lossless mode.
+        '''
+        if config['lossless']:
+            return None
+
+        self.counters['discarded'] += self.ser.in_waiting
+        self.ser.flushInput()
+
+    def driver_overruns(self):
+        '''
+        Read number of overruns (hardware FIFO and driver buffer) counted by
+        the serial driver. Works only with Linux serial drivers supporting
+        TIOCGICOUNT.
+        Returns:
+            Integer or None if not supported.
+        '''
+        if not fcntl or not hasattr(termios, 'TIOCGICOUNT'):
+            return None
+
+        try:
+            buf = fcntl.ioctl(self.ser.fileno(), termios.TIOCGICOUNT,
+                    bytes(80))
+        except (OSError, AttributeError, SerialException):
+            return None
+
+        # struct serial_icounter_struct: cts, dsr, rng, dcd, rx, tx, frame,
+        # overrun, parity, brk, buf_overrun, reserved[9]
+        fields = struct.unpack('20i', buf)
+
+        return fields[7] + fields[10]
+
+    def capture_stats(self):
+        '''
+        Returns:
+            Dictionary with counters of received, delivered and discarded
+            bytes and number of overruns since the port was opened (None if
+            driver doesn't report them).
+        '''
+        stats = dict(self.counters)
+        overruns = self.driver_overruns() if self.ser.isOpen() else None
+        stats['overruns'] = None if overruns is None else \
+                overruns - self._overruns_base
+
+        return stats
+
+    def write(self, data):
+        '''
+        Write data to serial port.
+        Args:
+            data: data to send
+        '''
+        if self.ser.isOpen():
+            try:
+                self.ser.write((data + self.get_eol()).encode(
+                    config['encoding']))
+                self.ser.flush()
+            except SerialException as e:
+                logger.error(('Exception occured, while writing to serial port.'
+                        '{}').format(e))
+                self.emit_error(3, 'Fail writing to port: {}'.format(
+                    self._port))
+        else:
+            logger.info('Can\'t write to the port. Port isn\'t open.')
+
+#==============================================================================
+# Attributes
+#==============================================================================
+
+    @property
+    def br(self):
+        return self._br
+
+    @br.setter
+    def br(self, baudrate):
+        if self.ser.isOpen():
+            self.ser.reset_input_buffer()
+        if int(baudrate) in serial.Serial.BAUDRATES:
+            self._br = baudrate
+            self.ser.baudrate = baudrate
+
+        self.emit_port_conf_change(self.port_config())
+
+    @property
+    def port(self):
+        return self._port
+
+    # @port.setter
+    def set_port(self, port):
+        logger.debug('Set new port: {}.'.format(port))
+        with self._port_access():
+            if self.ser and self.ser.isOpen():
+                self.close_port()
+
+            # Stop replay
+            if self._serial is not None:
+                self.ser, self._serial = self._serial, None
+                self._port = self.ser.port
+
+            if self.ser.port != port:
+                self._port = port
+                self.ser.port = port
+            else:
+                return None
+
+    def set_eol(self, index):
+        if index < len(config['eol']) and index >= 0:
+            self.eol = config['eol'][index]
+        else:
+            logger.error('Can\t set up this type of End Of Line. Because it\'s '
+                    'not in standart list.')
+
+    def get_eol(self):
+        return self.eol
+
+#==============================================================================
+# Utils
+#==============================================================================
+    
+    def divide_text_in_blocks(self, string, length=4):
+        """
+        Divide string into substring of the 'length'.
+        Args:
+            string: string to divide.
+        Returns:
+            Divided string.
+        """
+        if length < 0:
+            return None
+
+        if len(string) < length:
+            return string
+
+        return ' '.join(string[i:i + length] for i in range(
+            0, len(string), length))
+
+
+    def port_config(self):
+        '''
+        Generate port configuration dictinoary. (Used in view)
+        Returns:
+            Dictionary.
+        '''
+        return {'baudrate': self._br, 'num_of_bits': self._bytesize, 
+                'parity': self._parity, 'num_of_stop': self._stopbits}
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the thread
+        which generated event (usually reader thread).
+        Args:
+            event: event name.
+            callback: callable.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def unsubscribe(self, event, callback):
+        # List is replaced, so it can be iterated by notify() meanwhile
+        self.callbacks[event] = [item for item in self.callbacks.get(event,
+            []) if item != callback]
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
+
+    def deliver(self, data, decoded, stamp=None):
+        '''
+        Pass received data to subscribers.
+        Args:
+            data: received bytes.
+            decoded: decoded text.
+            stamp: time.monotonic_ns() when data was read.
+        '''
+        self.counters['delivered'] += len(data)
+        self.notify('data', data, decoded)
+
+    def emit_error(self, code, msg):
+        '''
+        Emits error event. Codes:
+            0 = Fail to open port
+            1 = Fail to close port
+            2 = Fail to read from the port
+            3 = Fail to write to the port
+            4 = Fail to write recording or log
+        Args:
+            code: int in range 0 - 4.
+        '''
+        if code in range(5):
+            self.notify('error', msg)
+        else:
+            logger.debug('Unknown error code.')
+
+    def emit_data_ready(self, data):
+        '''
+        Emits that data read from serial port is ready to send.
+        Args:
+            data: string
+        '''
+        self.notify('data_ready', data)
+
+    def emit_port_conf_change(self, value):
+        self.notify('port_conf_change', value)
+
+    def emit_update_device_list(self, dev_list):
+        self.notify('update_device_list', dev_list)
+
+if __name__ == '__main__':
+    a = Reader()
+    print(a.list_serial_ports())
@@ -0,0 +1,709 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Serial port I/O, decoding and formatting (highlighting, HEX) in a child
+process, so GUI work in the main interpreter can't hold the GIL while the
+port is read. Doesn't depend on Qt.
+
+Formatted chunks (the same messages Model puts in its queue) are passed to
+the main process through a shared memory ring (SharedRing), written by the
+child and read by the consoles. Only small messages go over the pipe:
+commands and their results, errors, port state and counters.
+
+The child keeps a ChunkBuffer (queue_* in config.py) in front of the ring,
+so reading never waits for the GUI: when the ring is full chunks wait in
+the buffer and are spilled or dropped by its policy.
+'''
+
+# System imports
+import  time
+import  queue
+import  pickle
+import  struct
+import  logging
+import  threading
+import  itertools
+import  multiprocessing
+from    multiprocessing     import shared_memory
+
+# PySerial imports
+from    serial.serialutil   import SerialException
+
+from config import config
+from chunk_format import ChunkFormatter
+from reader import Reader
+from chunk_buffer import ChunkBuffer
+from chunk_buffer import DROP_NEWEST
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ring header: bytes written, bytes read, records written, records read.
+# Counters only grow, every one is updated by one side.
+HEADER      = struct.Struct('<QQQQ')
+# Record: length of pickled message, followed by the message
+RECORD      = struct.Struct('<I')
+
+# Interval (seconds) of counters sent by the child
+STATS_INTERVAL = 0.5
+
+
+class SharedRing:
+    '''
+    Ring of variable length records in shared memory with one producer and
+    one consumer (in different processes). Producer copies the record
+    before it advances the write counters, consumer reads the record before
+    it advances the read counters, so no lock is needed.
+    '''
+
+    def __init__(self, size=None, name=None):
+        '''
+        Args:
+            size: capacity (bytes) of a new ring (config['process_ring_size']
+                if None).
+            name: name of existing ring to attach to.
+        '''
+        if name is None:
+            size = size or config['process_ring_size']
+            self.shm = shared_memory.SharedMemory(create=True,
+                    size=HEADER.size + size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf        = self.shm.buf
+        self.capacity   = self.shm.size - HEADER.size
+        self.owner      = name is None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _counters(self):
+        return HEADER.unpack_from(self.buf, 0)
+
+    def _copy_in(self, position, data):
+        start = HEADER.size + position % self.capacity
+        first = min(len(data), HEADER.size + self.capacity - start)
+        self.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self.buf[HEADER.size:HEADER.size + len(data) - first] = \
+                    data[first:]
+
+    def _copy_out(self, position, length):
+        start = HEADER.size + position % self.capacity
+        first = min(length, HEADER.size + self.capacity - start)
+        data = bytes(self.buf[start:start + first])
+        if first < length:
+            data += bytes(self.buf[HEADER.size:HEADER.size + length - first])
+        return data
+
+    def write(self, data):
+        '''
+        Append record (producer side).
+        Returns:
+            False if there is no room for it.
+        Raises:
+            ValueError if record is larger than the ring.
+        '''
+        length = RECORD.size + len(data)
+        if length > self.capacity:
+            raise ValueError('Record of {} bytes doesn\'t fit the ring.'.format(
+                len(data)))
+
+        written, read, count, _ = self._counters()
+        if written + length - read > self.capacity:
+            return False
+
+        self._copy_in(written, RECORD.pack(len(data)) + data)
+        struct.pack_into('<Q', self.buf, 0, written + length)
+        struct.pack_into('<Q', self.buf, 16, count + 1)
+        return True
+
+    def read(self):
+        '''
+        Take the oldest record (consumer side).
+        Returns:
+            Bytes or None if ring is empty.
+        '''
+        _, read, count, taken = self._counters()
+        if taken == count:
+            return None
+
+        length, = RECORD.unpack(self._copy_out(read, RECORD.size))
+        data = self._copy_out(read + RECORD.size, length)
+        struct.pack_into('<Q', self.buf, 8, read + RECORD.size + length)
+        struct.pack_into('<Q', self.buf, 24, taken + 1)
+        return data
+
+    def pending(self):
+        '''
+        Returns:
+            Number of records and bytes in the ring.
+        '''
+        written, read, count, taken = self._counters()
+        return count - taken, written - read
+
+    def close(self):
+        '''
+        Detach from the ring, the creator also removes it.
+        '''
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RingQueue:
+    '''
+    Consumer side of the ring with the part of queue.Queue interface used
+    by consoles (see ChunkBuffer). Counters of the child buffer are reported
+    by stats().
+    '''
+
+    def __init__(self, ring, feed=None):
+        '''
+        Args:
+            ring: SharedRing written by the child.
+            feed: function called with decoded text of every taken message.
+        '''
+        self.ring       = ring
+        self.feed       = feed
+        # Counters of the buffer in the child (see ChunkBuffer.stats())
+        self.remote     = {'put': 0, 'dropped': 0, 'spilled': 0, 'size': 0,
+                'spill_size': 0}
+
+    def get_nowait(self):
+        '''
+        Raises:
+            queue.Empty if ring is empty.
+        '''
+        data = self.ring.read() if self.ring.buf is not None else None
+        if data is None:
+            raise queue.Empty
+
+        msg = pickle.loads(data)
+        if self.feed:
+            self.feed(msg[0])
+        return msg
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                if not block or (deadline is not None and
+                        time.monotonic() >= deadline):
+                    raise
+            time.sleep(0.005)
+
+    def qsize(self):
+        '''
+        Returns:
+            Number of messages in the ring (messages waiting in the child
+            buffer can't be taken yet).
+        '''
+        if self.ring.buf is None:
+            return 0
+        return self.ring.pending()[0]
+
+    def empty(self):
+        return not self.qsize()
+
+    def stats(self):
+        stats = dict(self.remote)
+        if self.ring.buf is not None:
+            stats['size'] += self.ring.pending()[1]
+        return stats
+
+
+class ChildReader(Reader):
+    '''
+    Reader running in the child process. Received data is formatted by
+    ChunkFormatter like in Model.deliver() and passed to the ring by a
+    separate thread, events are sent to the main process. Raw data for
+    'data' subscribers of the main process is sent over the pipe by another
+    thread, so slow subscribers can't delay reading.
+    '''
+
+    def __init__(self, ring, conn):
+        Reader.__init__(self)
+        self.ring       = ring
+        self.conn       = conn
+        # Connection is used by reader, pump, forward and command threads
+        self._send_lock = threading.Lock()
+        self.buffer     = ChunkBuffer()
+        self.formatter  = ChunkFormatter(metrics.histogram('hex_time', 'us'))
+        # Received bytes waiting to be sent over the pipe (file transfer
+        # responses, fan-out), sent only while forward_data is set
+        self.forward_data = False
+        self.forward    = ChunkBuffer(config['process_forward_max'],
+                DROP_NEWEST)
+        self._pump      = threading.Thread(target=self.pump, daemon=True)
+        self._forwarder = threading.Thread(target=self.forward_loop,
+                daemon=True)
+
+        # Port configuration is mirrored from the state
+        for event in ('update_device_list', 'error'):
+            self.subscribe(event, lambda *args, event=event: self.send(
+                'event', event, *args))
+
+        if config['search_spool']:
+            self.start_spool()
+
+    def send(self, *msg):
+        with self._send_lock:
+            try:
+                self.conn.send(msg)
+            except (OSError, ValueError):
+                # Main process is gone, command loop stops the child
+                pass
+
+    def start(self):
+        Reader.start(self)
+        self._pump.start()
+        self._forwarder.start()
+
+    def deliver(self, data, decoded, stamp=None):
+        self.buffer.put(self.formatter.format(data, decoded, self.spool,
+            stamp), len(data))
+        if self.forward_data:
+            self.forward.put((data, decoded), len(data))
+        Reader.deliver(self, data, decoded, stamp)
+
+    def pump(self):
+        '''
+        Move messages from the buffer to the ring, wait while the ring is
+        full. Counters are sent every STATS_INTERVAL.
+        '''
+        last = 0
+        data = None
+        while self.running:
+            now = time.monotonic()
+            if now - last >= STATS_INTERVAL:
+                self.send('stats', self.state())
+                last = now
+
+            if data is None:
+                try:
+                    msg = self.buffer.get(timeout=STATS_INTERVAL)
+                except queue.Empty:
+                    continue
+                data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+                if RECORD.size + len(data) > self.ring.capacity:
+                    logger.error('Chunk of {} bytes doesn\'t fit the ring, '
+                            'increase process_ring_size.'.format(len(data)))
+                    data = None
+                    continue
+
+            if self.ring.write(data):
+                data = None
+            else:
+                time.sleep(0.002)
+
+    def forward_loop(self):
+        '''
+        Send received bytes to the main process, waits while the pipe is
+        full (bytes are dropped by the buffer meanwhile).
+        '''
+        while self.running:
+            try:
+                data, decoded = self.forward.get(timeout=STATS_INTERVAL)
+            except queue.Empty:
+                continue
+            if self.forward_data:
+                self.send('data', data, decoded)
+
+    def open_port(self):
+        result = Reader.open_port(self)
+        self.send('state', self.state())
+        return result
+
+    def close_port(self):
+        Reader.close_port(self)
+        self.send('state', self.state())
+
+    def state(self):
+        '''
+        Returns:
+            Dictionary with port state and counters mirrored by
+            ProcessReader.
+        '''
+        return {'port': self._port, 'open': self.ser.isOpen(),
+                'paused': not self.paused.is_set(), 'eol': self.eol,
+                'config': self.port_config(), 'counters': dict(self.counters),
+                'buffer': self.buffer.stats(),
+                'forward': self.forward.stats(),
+                'spool': self.spool_path(),
+                'recording': self.recorder is not None,
+                'logging': self.log is not None}
+
+    def set_br(self, baudrate):
+        self.br = baudrate
+
+    def set_forward_data(self, value):
+        self.forward_data = value
+
+    def transmit(self, data):
+        '''
+        Write bytes to the port and wait until they are transmitted.
+        Raises:
+            SerialException if port isn't open.
+        '''
+        if not self.ser.isOpen():
+            raise SerialException('port isn\'t open')
+        self.ser.write(data)
+        self.ser.flush()
+
+
+# Commands accepted from the main process
+COMMANDS = {'set_port', 'start_reading', 'pause', 'resume', 'set_eol',
+        'set_br', 'start_recording', 'stop_recording', 'start_logging',
+        'stop_logging', 'start_replay', 'flush_spool', 'set_forward_data',
+        'transmit', 'state'}
+
+
+def serve(ring_name, conn, settings):
+    '''
+    Entry point of the child process: run reader and execute commands
+    until 'stop' is received or the main process is gone. Result is sent
+    only for calls with id, errors of other commands are sent as 'error'
+    event.
+    Args:
+        ring_name: name of the shared memory ring.
+        conn: pipe connection to the main process.
+        settings: config dictionary of the main process.
+    '''
+    config.update(settings)
+    ring = SharedRing(name=ring_name)
+    reader = ChildReader(ring, conn)
+    reader.start()
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == 'stop':
+            break
+
+        _, call_id, name, args = msg
+        result = error = None
+        try:
+            if name not in COMMANDS:
+                raise ValueError('Unknown command: {}.'.format(name))
+            result = getattr(reader, name)(*args)
+        except Exception as e:
+            error = str(e)
+        # State first, so it's updated when the caller gets the result
+        if name != 'state':
+            reader.send('state', reader.state())
+        if call_id is not None:
+            reader.send('result', call_id, result, error)
+        elif error is not None:
+            logger.error('Fail to execute {}: {}'.format(name, error))
+            reader.send('event', 'error', 'Reader process: {}'.format(error))
+
+    reader.stop()
+    reader.join(config['process_timeout'])
+    reader.buffer.close()
+    reader.forward.close()
+    ring.close()
+
+
+class RemotePort:
+    '''
+    Port of the child process for Writer: written bytes are transmitted
+    by the child.
+    '''
+
+    def __init__(self, reader):
+        self.reader     = reader
+
+    def isOpen(self):
+        return self.reader.state['open']
+
+    def write(self, data):
+        try:
+            self.reader.call('transmit', data, raise_error=True)
+        except RuntimeError as e:
+            raise SerialException(str(e))
+
+    def flush(self):
+        pass
+
+
+class ProcessReader(threading.Thread):
+    '''
+    Main process side of the reader running in the child process. Has the
+    part of Reader interface used by the GUI (port control, recording,
+    events), received data is taken from the queue (RingQueue). Thread
+    receives events from the child and passes them to callbacks.
+    Commands of the GUI are sent without waiting for the child (post()),
+    their results come as state changes and events.
+    Events:
+        'port_conf_change': port configuration dictionary
+        'update_device_list': list of ports
+        'error': error message
+        'recording': True if recording is running
+        'logging': True if logging is running
+        'data': received bytes and decoded text (only while subscribed)
+    '''
+
+    def __init__(self, feed=None):
+        '''
+        Args:
+            feed: function called with decoded text taken from the queue.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.ring       = SharedRing()
+        self.queue      = RingQueue(self.ring, feed)
+        self.ser        = RemotePort(self)
+        self.paused     = threading.Event()
+        # Port state mirrored from the child
+        self.state      = {'port': config['port'], 'open': False,
+                'paused': True, 'eol': config['eol'][0],
+                'config': {'baudrate': config['baudrate'],
+                    'num_of_bits': config['bytesize'],
+                    'parity': config['parity'],
+                    'num_of_stop': config['stopbits']},
+                'counters': {'received': 0, 'delivered': 0, 'discarded': 0},
+                'spool': None, 'recording': False, 'logging': False}
+        self.rx_bytes   = metrics.meter('rx_bytes', 'B')
+        # Call id -> [event, result, error]
+        self._calls     = dict()
+        self._ids       = itertools.count()
+        self._send_lock = threading.Lock()
+
+        # Child doesn't inherit Qt and threads of the GUI process
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(self.ring.name,
+            child_conn, dict(config)), daemon=True)
+
+    def start(self):
+        '''
+        Start the child process and wait for its first state.
+        '''
+        self.process.start()
+        threading.Thread.start(self)
+        state = self.call('state')
+        if state:
+            self.update_state(state)
+
+    def run(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            kind = msg[0]
+            if kind == 'result':
+                waiting = self._calls.get(msg[1])
+                if waiting:
+                    waiting[1:] = msg[2:]
+                    waiting[0].set()
+            elif kind in ('state', 'stats'):
+                self.update_state(msg[1])
+            elif kind == 'event':
+                self.notify(msg[1], *msg[2:])
+            elif kind == 'data':
+                self.notify('data', msg[1], msg[2])
+
+        if self.process.exitcode not in (None, 0):
+            self.notify('error', 'Reader process exited with code {}.'.format(
+                self.process.exitcode))
+
+    def update_state(self, state):
+        previous, self.state = self.state, state
+        received = state['counters']['received'] - \
+                previous['counters']['received']
+        if received > 0:
+            self.rx_bytes.add(received)
+        self.queue.remote = state['buffer']
+        if state['paused']:
+            self.paused.clear()
+        else:
+            self.paused.set()
+
+        dropped = state['forward']['dropped'] - \
+                previous.get('forward', {}).get('dropped', 0)
+        if dropped > 0:
+            logger.warning('{} received bytes aren\'t passed to \'data\' '
+                    'subscribers, they are too slow.'.format(dropped))
+
+        if any(state[name] != previous[name] for name in ('port', 'open',
+                'config')):
+            self.notify('port_conf_change', state['config'])
+        for name in ('recording', 'logging'):
+            if state[name] != previous[name]:
+                self.notify(name, state[name])
+
+    def call(self, name, *args, raise_error=False):
+        '''
+        Execute reader method in the child and wait for the result.
+        Args:
+            name: method name (see COMMANDS).
+            raise_error: raise RuntimeError if method fails, otherwise
+                error is logged.
+        Returns:
+            Result of the method or None if it fails or times out.
+        '''
+        call_id = next(self._ids)
+        waiting = [threading.Event(), None, None]
+        self._calls[call_id] = waiting
+        try:
+            with self._send_lock:
+                self.conn.send(('call', call_id, name, args))
+            if not waiting[0].wait(config['process_timeout']):
+                waiting[2] = 'reader process doesn\'t respond'
+        except (OSError, ValueError) as e:
+            waiting[2] = str(e)
+        finally:
+            self._calls.pop(call_id, None)
+
+        if waiting[2] is not None:
+            if raise_error:
+                raise RuntimeError(waiting[2])
+            logger.error('Fail to call {} in reader process: {}'.format(name,
+                waiting[2]))
+        return waiting[1]
+
+    def post(self, name, *args):
+        '''
+        Execute reader method in the child without waiting for it. Failure
+        is reported by 'error' event.
+        Args:
+            name: method name (see COMMANDS).
+        '''
+        try:
+            with self._send_lock:
+                self.conn.send(('call', None, name, args))
+        except (OSError, ValueError) as e:
+            logger.error('Fail to send {} to reader process: {}'.format(name,
+                e))
+            self.notify('error', 'Reader process doesn\'t respond.')
+
+    def stop(self):
+        '''
+        Stop the child process and remove the ring.
+        '''
+        try:
+            with self._send_lock:
+                self.conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        self.process.join(config['process_timeout'])
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.ring.close()
+
+    # Reader interface used by GUI, nothing waits for the child except
+    # state() and flush_spool() (called by search thread)
+    def set_port(self, port):
+        self.post('set_port', port)
+
+    def start_reading(self):
+        self.post('start_reading')
+
+    def pause(self):
+        self.post('pause')
+
+    def resume(self):
+        self.post('resume')
+
+    def set_eol(self, index):
+        self.post('set_eol', index)
+
+    def get_eol(self):
+        return self.state['eol']
+
+    @property
+    def br(self):
+        return self.state['config']['baudrate']
+
+    @br.setter
+    def br(self, baudrate):
+        self.post('set_br', baudrate)
+
+    @property
+    def port(self):
+        return self.state['port']
+
+    def port_config(self):
+        return self.state['config']
+
+    def capture_stats(self):
+        return dict(self.state['counters'])
+
+    def start_recording(self, path):
+        '''
+        Returns:
+            True, failure is reported by 'error' and 'recording' events.
+        '''
+        # Expected state, 'recording' event is emitted if the child fails
+        self.state['recording'] = True
+        self.post('start_recording', path)
+        return True
+
+    def stop_recording(self):
+        self.state['recording'] = False
+        self.post('stop_recording')
+
+    def start_logging(self, directory):
+        '''
+        Returns:
+            True, failure is reported by 'error' and 'logging' events.
+        '''
+        self.state['logging'] = True
+        self.post('start_logging', directory)
+        return True
+
+    def stop_logging(self):
+        self.state['logging'] = False
+        self.post('stop_logging')
+
+    def start_replay(self, path, speed=1.0):
+        '''
+        Returns:
+            True, failure is reported by 'error' event.
+        '''
+        self.post('start_replay', path, speed)
+        return True
+
+    def spool_path(self):
+        return self.state['spool']
+
+    def flush_spool(self):
+        self.call('flush_spool')
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        thread receiving messages of the child.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+        if event == 'data' and len(self.callbacks['data']) == 1:
+            self.post('set_forward_data', True)
+
+    def unsubscribe(self, event, callback):
+        # List is replaced, so it can be iterated by notify() meanwhile
+        self.callbacks[event] = [item for item in self.callbacks.get(event,
+            []) if item != callback]
+        if event == 'data' and not self.callbacks['data']:
+            self.post('set_forward_data', False)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Raw session recording. Received bytes are appended to the session file as
+is, side index file (<session>.idx) maps monotonic timestamps to offsets in
+the session file. Decoded binary frames (see framing.py) are written to
+<session>.frames. Both files are memory mapped when session is opened, so
+sessions of any size can be seeked by time and exported without loading
+them into memory.
+
+Export part of the session:
+    python3 ./recorder.py SESSION --start 10 --end 20 --out part.bin
+'''
+
+# System imports
+import  os
+import  sys
+import  mmap
+import  time
+import  struct
+import  argparse
+import  logging
+
+logger = logging.getLogger(__name__)
+
+# Index header: magic, wall clock time and monotonic time (ns) of the start
+HEADER  = struct.Struct('<8sdQ')
+MAGIC   = b'PYSMIDX1'
+# Index record: monotonic time (ns), offset of the first byte read at that
+# time
+RECORD  = struct.Struct('<QQ')
+# Frame record: monotonic time (ns) of reading, payload length; followed by
+# payload
+FRAME   = struct.Struct('<QI')
+
+
+class SessionRecorder:
+    '''
+    Appends received bytes to the session file. Index record is written for
+    the first chunk read after 'interval' seconds since the previous record,
+    so index grows by at most 16 bytes per interval.
+    '''
+
+    def __init__(self, path, interval=0.01):
+        '''
+        Args:
+            path: session file, existing file is overwritten.
+            interval: minimal time between index records (seconds).
+        '''
+        self.path       = path
+        self.interval   = int(interval*1e9)
+        self.offset     = 0
+        self._last      = None
+
+        self._data  = open(path, 'wb')
+        self._index = open(index_path(path), 'wb')
+        self._index.write(HEADER.pack(MAGIC, time.time(),
+            time.monotonic_ns()))
+        # Opened with the first frame
+        self._frames = None
+
+    def write(self, data, stamp=None):
+        '''
+        Append chunk to the session.
+        Args:
+            data: bytes.
+            stamp: time.monotonic_ns() when chunk was read.
+        '''
+        if not data:
+            return None
+
+        if stamp is None:
+            stamp = time.monotonic_ns()
+
+        if self._last is None or stamp - self._last >= self.interval:
+            self._index.write(RECORD.pack(stamp, self.offset))
+            self._last = stamp
+
+        self._data.write(data)
+        self.offset += len(data)
+
+    def write_frames(self, frames, stamp):
+        '''
+        Append decoded frames read at the same time.
+        Args:
+            frames: list of payloads.
+            stamp: time.monotonic_ns() when frames were read.
+        '''
+        if self._frames is None:
+            self._frames = open(frames_path(self.path), 'wb')
+
+        self._frames.write(b''.join(FRAME.pack(stamp, len(frame)) + frame
+            for frame in frames))
+
+    def flush(self):
+        self._data.flush()
+        self._index.flush()
+        if self._frames:
+            self._frames.flush()
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+        if self._frames:
+            self._frames.close()
+
+
+class SessionReader:
+    '''
+    Read-only memory mapped access to recorded session.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        self._data_file = open(path, 'rb')
+        self._index_file = open(index_path(path), 'rb')
+        self.data   = self._map(self._data_file)
+        self._index_map = index = self._map(self._index_file)
+
+        if len(index) < HEADER.size or \
+                HEADER.unpack_from(index)[0] != MAGIC:
+            raise ValueError('Invalid session index: {}.'.format(
+                index_path(path)))
+        _, self.wall_start, self.start = HEADER.unpack_from(index)
+
+        # Drop incomplete record (session is still being written)
+        count = (len(index) - HEADER.size)//RECORD.size
+        # Flat array: time, offset, time, offset...
+        self.index = memoryview(index)[HEADER.size:
+                HEADER.size + count*RECORD.size].cast('Q')
+
+    @staticmethod
+    def _map(fn):
+        if not os.fstat(fn.fileno()).st_size:
+            return b''
+
+        return mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def records(self):
+        return len(self.index)//2
+
+    def stamp(self, i):
+        '''
+        Returns:
+            Monotonic time (ns) of the i-th index record.
+        '''
+        return self.index[2*i]
+
+    def duration(self):
+        '''
+        Returns:
+            Time (seconds) between start of the recording and the last
+            index record.
+        '''
+        if not self.records:
+            return 0
+
+        return (self.stamp(self.records - 1) - self.start)/1e9
+
+    def offset_at(self, seconds):
+        '''
+        Find offset of the first byte received at or after given time.
+        Args:
+            seconds: time since start of the recording.
+        Returns:
+            Offset in the session file.
+        '''
+        stamp = self.start + int(seconds*1e9)
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.stamp(mid) < stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == self.records:
+            return len(self.data)
+
+        return self.index[2*lo + 1]
+
+    def time_at(self, offset):
+        '''
+        Find time (seconds since start) when byte at the offset was
+        received (with precision of index interval).
+        '''
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.index[2*mid + 1] <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if not lo:
+            return 0
+
+        return (self.stamp(lo - 1) - self.start)/1e9
+
+    def read(self, start=0, end=None):
+        '''
+        Returns:
+            memoryview on bytes [start, end) of the session. It should be
+            released before the session is closed.
+        '''
+        end = len(self.data) if end is None else min(end, len(self.data))
+        return memoryview(self.data)[start:end]
+
+    def export(self, out, start=0, end=None, chunk=1024*1024):
+        '''
+        Write part of the session between two moments of time to file.
+        Args:
+            out: binary file object.
+            start: seconds since start of the recording.
+            end: seconds since start of the recording, None - till the end.
+        Returns:
+            Number of written bytes.
+        '''
+        first = self.offset_at(start)
+        last = len(self.data) if end is None else self.offset_at(end)
+
+        for offset in range(first, last, chunk):
+            with self.read(offset, min(offset + chunk, last)) as data:
+                out.write(data)
+
+        return max(0, last - first)
+
+    def close(self):
+        self.index.release()
+        for mapped in [self.data, self._index_map]:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._data_file.close()
+        self._index_file.close()
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def frames_path(path):
+    return path + '.frames'
+
+
+def read_frames(path):
+    '''
+    Iterate over frames recorded with the session.
+    Yields:
+        (monotonic time in ns, payload).
+    '''
+    with open(frames_path(path), 'rb') as fn:
+        while True:
+            header = fn.read(FRAME.size)
+            if len(header) < FRAME.size:
+                break
+            stamp, size = FRAME.unpack(header)
+            payload = fn.read(size)
+            if len(payload) < size:
+                break
+            yield stamp, payload
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export part of session.')
+    parser.add_argument('session', help='session file')
+    parser.add_argument('--start', type=float, default=0,
+            help='seconds since start of the recording')
+    parser.add_argument('--end', type=float, help='seconds since start of '
+            'the recording (default: till the end)')
+    parser.add_argument('--out', default='-', help='output file')
+    args = parser.parse_args()
+
+    session = SessionReader(args.session)
+    if args.out == '-':
+        session.export(sys.stdout.buffer, args.start, args.end)
+    else:
+        with open(args.out, 'wb') as out:
+            session.export(out, args.start, args.end)
+    session.close()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Replay of recorded sessions (see recorder.py). ReplaySerial stands in for
+serial.Serial in Reader (and so in Model): recorded bytes become readable at
+the time they were received, scaled by the speed, and go through the same
+decoding, highlighting and rendering as bytes read from the port.
+
+Replay session in GUI at double speed:
+    python3 ./pysm.py --replay SESSION --speed 2
+'''
+
+# System imports
+import  time
+import  logging
+import  threading
+
+# PySerial imports
+import  serial
+from    serial.serialutil   import SerialException
+
+from recorder import SessionReader
+
+logger = logging.getLogger(__name__)
+
+
+class ReplaySerial:
+    '''
+    Read-only serial port replaying recorded session. Implements the part of
+    serial.Serial interface used by Reader. Timing precision is the interval
+    of the session index: bytes between two index records are available at
+    once.
+    '''
+
+    def __init__(self, path, speed=1.0, timeout=None):
+        '''
+        Args:
+            path: session file.
+            speed: replay speed, 1 - original timing, 0 - as fast as
+                possible.
+            timeout: read timeout (seconds), None - wait forever.
+        Raises:
+            OSError, ValueError if session can't be opened.
+        '''
+        # Check session before it's used as a port
+        SessionReader(path).close()
+
+        self.path       = path
+        self.port       = path
+        self.speed      = max(0.0, float(speed))
+        self.timeout    = timeout
+        # Settings are kept only to be reported
+        self.baudrate   = 9600
+        self.bytesize   = serial.EIGHTBITS
+        self.parity     = serial.PARITY_NONE
+        self.stopbits   = serial.STOPBITS_ONE
+
+        self.session    = None
+        # Offset of the next byte to read
+        self.position   = 0
+        # Index record which isn't due yet
+        self._record    = 0
+        self._started   = None
+        self._cancel    = threading.Event()
+
+    @property
+    def is_open(self):
+        return self.session is not None
+
+    def isOpen(self):
+        return self.is_open
+
+    @property
+    def finished(self):
+        '''
+        True if all bytes of the session are read.
+        '''
+        return self.is_open and self.position >= len(self.session)
+
+    def open(self):
+        '''
+        Start replay from the beginning of the session.
+        '''
+        if self.is_open:
+            raise SerialException('Port is already open.')
+
+        try:
+            self.session = SessionReader(self.path)
+        except (OSError, ValueError) as e:
+            raise SerialException('Can\'t open session {}: {}'.format(
+                self.path, e))
+
+        self.position   = 0
+        self._record    = 0
+        self._started   = time.monotonic()
+        self._cancel.clear()
+        logger.debug('Replaying {} ({:.1f} s) at speed {}.'.format(self.path,
+            self.session.duration(), self.speed or 'max'))
+
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    def _available(self):
+        '''
+        Returns:
+            Offset of the end of bytes received till now.
+        '''
+        session = self.session
+        if not self.speed:
+            return len(session)
+
+        # Recording time (ns since start) which is replayed now
+        now = int((time.monotonic() - self._started)*self.speed*1e9) + \
+                session.start
+        while self._record < session.records and \
+                session.stamp(self._record) <= now:
+            self._record += 1
+
+        if self._record == session.records:
+            return len(session)
+
+        return session.index[2*self._record + 1]
+
+    def _next_due(self):
+        '''
+        Returns:
+            Seconds till the next index record is due, None if all records
+            are due.
+        '''
+        session = self.session
+        if not self.speed or self._record >= session.records:
+            return None
+
+        due = (session.stamp(self._record) - session.start)/1e9/self.speed
+        return max(0, due - (time.monotonic() - self._started))
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise SerialException('Port is not open.')
+
+        return self._available() - self.position
+
+    def read(self, size=1):
+        '''
+        Wait until 'size' bytes are received, timeout expires or reading is
+        canceled.
+        Returns:
+            Bytes (may be less than size).
+        '''
+        if not self.is_open:
+            raise SerialException('Port is not open.')
+
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        while self._available() - self.position < size:
+            if self._cancel.is_set():
+                self._cancel.clear()
+                break
+
+            wait = self._next_due()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = remaining if wait is None else min(wait, remaining)
+            self._cancel.wait(wait)
+
+        end = min(self._available(), self.position + size)
+        data = bytes(self.session.data[self.position:end])
+        self.position = end
+
+        return data
+
+    def cancel_read(self):
+        self._cancel.set()
+
+    def reset_input_buffer(self):
+        if self.is_open:
+            self.position = self._available()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        '''
+        Written bytes are thrown away.
+        '''
+        if not self.is_open:
+            raise SerialException('Port is not open.')
+
+        logger.debug('Replay ignores {} written bytes.'.format(len(data)))
+        return len(data)
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Continuous compressed log of received bytes for long runs. Reader thread
+only appends bytes to the pending buffer, compression and writing are done
+by the log thread. Pending bytes are compressed in chunks (gzip members or
+zstd frames, both can be concatenated into one valid stream) and every
+chunk is flushed to disk when it's complete or after 'flush' seconds, so
+crash loses at most the last second of data.
+
+Log directory keeps files <prefix>-<date>-<time>-<n>.log.gz (or .log.zst).
+File is rotated when it reaches the size or age limit, the oldest files are
+removed to keep the directory within the disk budget. Side index file
+(<file>.idx) maps monotonic time of the first byte of every chunk to its
+offsets in uncompressed stream and in the file and its compressed length,
+so any part of the file can be decompressed without reading it from the
+beginning, and data after the last indexed chunk (crash while writing) is
+never read.
+
+zstd requires zstandard module.
+
+List logs and export part of a log:
+    python3 ./rotating_log.py DIRECTORY
+    python3 ./rotating_log.py LOG --start 10 --end 20 --out part.bin
+'''
+
+# System imports
+import  os
+import  sys
+import  gzip
+import  zlib
+import  time
+import  struct
+import  argparse
+import  logging
+import  threading
+
+try:
+    import  zstandard
+except ImportError:
+    zstandard = None
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Index header: magic, wall clock time and monotonic time (ns) of the start
+HEADER  = struct.Struct('<8sdQ')
+MAGIC   = b'PYSMLOG2'
+# Index record: monotonic time (ns) of the first byte of the chunk, offset
+# of the chunk in uncompressed stream and in the file, compressed length
+RECORD  = struct.Struct('<QQQQ')
+
+# Codec -> file extension
+EXTENSIONS = {
+    'gzip': '.log.gz',
+    'zstd': '.log.zst',
+}
+
+
+def compressor(codec, level):
+    '''
+    Returns:
+        Function compressing one chunk into independent gzip member or zstd
+        frame.
+    Raises:
+        ValueError for unknown or not available codec.
+    '''
+    if codec == 'gzip':
+        return lambda data: gzip.compress(data, level, mtime=0)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires zstandard module.')
+        return zstandard.ZstdCompressor(level=level).compress
+
+    raise ValueError('Unknown log codec: {}.'.format(codec))
+
+
+def decompressor(path):
+    '''
+    Returns:
+        Function decompressing one chunk of the log file.
+    '''
+    if path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise ValueError('zstd compression requires zstandard module.')
+        return zstandard.ZstdDecompressor().decompress
+
+    return gzip.decompress
+
+
+# Errors of decompression of truncated or corrupted chunk
+DECOMPRESS_ERRORS = (EOFError, OSError, zlib.error) + ((zstandard.ZstdError,)
+        if zstandard else ())
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def list_logs(directory, prefix='pysm'):
+    '''
+    Returns:
+        Paths of log files in the directory, from the oldest.
+    '''
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    return [os.path.join(directory, name) for name in sorted(names)
+            if name.startswith(prefix + '-') and
+            name.endswith(tuple(EXTENSIONS.values()))]
+
+
+class RotatingLog(threading.Thread):
+    '''
+    Log thread. Events:
+        'rotated': path of the closed file
+        'error': error message, logging is stopped
+    '''
+
+    def __init__(self, directory, prefix='pysm', codec=None, level=None):
+        '''
+        Args:
+            directory: log directory, created if doesn't exist.
+            prefix: prefix of log file names.
+            codec: 'gzip' or 'zstd'.
+            level: compression level.
+        Raises:
+            ValueError for unknown or not available codec, OSError if
+            directory can't be created.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        codec = codec or config['log_codec']
+        level = config['log_level'] if level is None else level
+
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.directory  = directory
+        self.prefix     = prefix
+        self.extension  = EXTENSIONS.get(codec, '')
+        self.compress   = compressor(codec, level)
+        os.makedirs(directory, exist_ok=True)
+
+        # Received (time, bytes) waiting for compression and their size
+        self._pending   = list()
+        self._size      = 0
+        self._cond      = threading.Condition()
+        self.running    = True
+        # Bytes received, written (uncompressed and compressed) and dropped
+        # because compression doesn't keep up, created and removed files
+        self.counters   = {'received': 0, 'written': 0, 'compressed': 0,
+                'dropped': 0, 'files': 0, 'removed': 0}
+
+        # Current file, its index, start time and offsets
+        self.path       = None
+        self._data      = None
+        self._index     = None
+        self._opened    = 0
+        self._raw       = 0
+        self._offset    = 0
+        # Number of the file, keeps names unique within one second
+        self._number    = 0
+
+    def write(self, data, stamp=None):
+        '''
+        Append received bytes, called by the reader thread.
+        Args:
+            data: bytes.
+            stamp: time.monotonic_ns() when bytes were read.
+        '''
+        if not data:
+            return None
+
+        with self._cond:
+            self.counters['received'] += len(data)
+            if self._size + len(data) > config['log_max_pending']:
+                self.counters['dropped'] += len(data)
+                return None
+
+            self._pending.append((stamp or time.monotonic_ns(), data))
+            self._size += len(data)
+            if self._size >= config['log_chunk']:
+                self._cond.notify()
+
+    def stop(self):
+        '''
+        Write pending bytes, close the file and stop the thread.
+        '''
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        running = True
+        try:
+            self._enforce_budget()
+            while running:
+                with self._cond:
+                    self._cond.wait_for(lambda: not self.running or
+                            self._size >= config['log_chunk'],
+                            config['log_flush'])
+                    pending = self._pending
+                    self._pending, self._size = list(), 0
+                    running = self.running
+
+                self._write_pending(pending)
+        except (OSError, ValueError) as e:
+            logger.error('Fail to write log: {}'.format(e))
+            self.running = False
+            self.notify('error', 'Logging is stopped: {}'.format(e))
+        finally:
+            self._close()
+
+    def _write_pending(self, pending):
+        '''
+        Write received bytes in chunks of about log_chunk bytes, so seeking
+        stays precise when compression falls behind.
+        '''
+        chunk, size, first = list(), 0, None
+        for stamp, data in pending:
+            if not chunk:
+                first = stamp
+            chunk.append(data)
+            size += len(data)
+            if size >= config['log_chunk']:
+                self._write_chunk(b''.join(chunk), first)
+                chunk, size = list(), 0
+
+        if chunk:
+            self._write_chunk(b''.join(chunk), first)
+
+    def _write_chunk(self, data, stamp):
+        if self._data and config['log_max_age'] and \
+                time.monotonic() - self._opened >= config['log_max_age']:
+            self._rotate()
+        if self._data is None:
+            self._open(stamp)
+
+        compressed = self.compress(data)
+        self._data.write(compressed)
+        self._data.flush()
+        # Index record is written after the chunk, so it never points to
+        # the data lost in crash
+        self._index.write(RECORD.pack(stamp, self._raw, self._offset,
+            len(compressed)))
+        self._index.flush()
+        if config['log_fsync']:
+            os.fsync(self._data.fileno())
+            os.fsync(self._index.fileno())
+
+        self._raw += len(data)
+        self._offset += len(compressed)
+        self.counters['written'] += len(data)
+        self.counters['compressed'] += len(compressed)
+
+        if self._offset >= config['log_max_size']:
+            self._rotate()
+
+    def _open(self, stamp):
+        '''
+        Start new file, which starts at time of its first chunk.
+        '''
+        while True:
+            name = '{}-{}-{:04d}{}'.format(self.prefix, time.strftime(
+                '%Y%m%d-%H%M%S'), self._number, self.extension)
+            self._number += 1
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                break
+
+        self._data = open(path, 'wb')
+        self._index = open(index_path(path), 'wb')
+        self._index.write(HEADER.pack(MAGIC, time.time() -
+            (time.monotonic_ns() - stamp)/1e9, stamp))
+        self.path = path
+        self._opened = time.monotonic()
+        self._raw = self._offset = 0
+        self.counters['files'] += 1
+        logger.debug('Logging to {}.'.format(path))
+
+    def _close(self):
+        if self._data is None:
+            return None
+
+        self._data.close()
+        self._index.close()
+        self._data = self._index = None
+
+        return self.path
+
+    def _rotate(self):
+        path = self._close()
+        if path:
+            self.notify('rotated', path)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        '''
+        Remove the oldest files (with their indexes) until the directory
+        fits into the budget. Current file isn't removed.
+        '''
+        budget = config['log_budget']
+        if not budget:
+            return None
+
+        files = list()
+        for path in list_logs(self.directory, self.prefix):
+            size = 0
+            for name in [path, index_path(path)]:
+                try:
+                    size += os.path.getsize(name)
+                except OSError:
+                    pass
+            files.append((path, size))
+
+        total = sum(size for path, size in files)
+        for path, size in files:
+            if total <= budget or path == self.path and self._data:
+                break
+            for name in [path, index_path(path)]:
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.counters['removed'] += 1
+            logger.debug('Removed old log {}.'.format(path))
+
+    def subscribe(self, event, callback):
+        '''
+        Args:
+            event: event name.
+            callback: callable.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
+
+
+class LogReader:
+    '''
+    Random access to the log file through its chunk index. Precision of
+    seeking by time is one chunk.
+    '''
+
+    def __init__(self, path):
+        '''
+        Raises:
+            ValueError if index is invalid, OSError if files can't be read.
+        '''
+        self.path = path
+        self.decompress = decompressor(path)
+
+        with open(index_path(path), 'rb') as fn:
+            index = fn.read()
+        if len(index) < HEADER.size or \
+                HEADER.unpack_from(index)[0] != MAGIC:
+            raise ValueError('Invalid log index: {}.'.format(
+                index_path(path)))
+        _, self.wall_start, self.start = HEADER.unpack_from(index)
+
+        # Drop incomplete record (crash while writing)
+        count = (len(index) - HEADER.size)//RECORD.size
+        # (time, uncompressed offset, file offset, compressed length) of
+        # every chunk
+        self.chunks = list(RECORD.iter_unpack(index[HEADER.size:
+            HEADER.size + count*RECORD.size]))
+
+        self._data = open(path, 'rb')
+
+    def __len__(self):
+        '''
+        Returns:
+            Number of uncompressed bytes in indexed chunks.
+        '''
+        if not self.chunks:
+            return 0
+        try:
+            return self.chunks[-1][1] + len(self.chunk(len(self.chunks) - 1))
+        except ValueError:
+            return self.chunks[-1][1]
+
+    def duration(self):
+        '''
+        Returns:
+            Time (seconds) between start of the file and the last chunk.
+        '''
+        if not self.chunks:
+            return 0
+        return (self.chunks[-1][0] - self.start)/1e9
+
+    def chunk_at(self, seconds):
+        '''
+        Returns:
+            Index of the chunk containing bytes received at the time since
+            start of the file.
+        '''
+        stamp = self.start + int(seconds*1e9)
+        lo, hi = 0, len(self.chunks)
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.chunks[mid][0] <= stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return max(0, lo - 1)
+
+    def chunk(self, i):
+        '''
+        Returns:
+            Decompressed i-th chunk.
+        Raises:
+            ValueError if chunk is truncated or corrupted.
+        '''
+        _, _, start, length = self.chunks[i]
+        self._data.seek(start)
+
+        try:
+            # Data after the chunk can be a partly written next chunk
+            return self.decompress(self._data.read(length))
+        except DECOMPRESS_ERRORS as e:
+            raise ValueError('Broken chunk {} of {}: {}'.format(i, self.path,
+                e))
+
+    def export(self, out, start=0, end=None):
+        '''
+        Write chunks received between two moments of time to file.
+        Args:
+            out: binary file object.
+            start: seconds since start of the file.
+            end: seconds since start of the file, None - till the end.
+        Returns:
+            Number of written bytes.
+        '''
+        if not self.chunks:
+            return 0
+
+        first = self.chunk_at(start)
+        last = len(self.chunks) if end is None else \
+                self.chunk_at(end) + 1
+
+        written = 0
+        for i in range(first, last):
+            try:
+                data = self.chunk(i)
+            except ValueError as e:
+                logger.warning(e)
+                break
+            out.write(data)
+            written += len(data)
+
+        return written
+
+    def close(self):
+        self._data.close()
+
+
+def describe(directory):
+    '''
+    Print logs of the directory with their start time, duration and size.
+    '''
+    for path in list_logs(directory):
+        try:
+            log = LogReader(path)
+        except (OSError, ValueError) as e:
+            print('{}: {}'.format(path, e))
+            continue
+
+        print('{}  {}  {:9.1f} s  {:10} B  {:10} B'.format(
+            os.path.basename(path), time.strftime('%Y-%m-%d %H:%M:%S',
+                time.localtime(log.wall_start)), log.duration(), len(log),
+            os.path.getsize(path)))
+        log.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List logs or export part '
+            'of a log.')
+    parser.add_argument('path', help='log directory or log file')
+    parser.add_argument('--start', type=float, default=0,
+            help='seconds since start of the log file')
+    parser.add_argument('--end', type=float, help='seconds since start of '
+            'the log file (default: till the end)')
+    parser.add_argument('--out', default='-', help='output file')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        describe(args.path)
+        sys.exit(0)
+
+    log = LogReader(args.path)
+    if args.out == '-':
+        log.export(sys.stdout.buffer, args.start, args.end)
+    else:
+        with open(args.out, 'wb') as out:
+            log.export(out, args.start, args.end)
+    log.close()
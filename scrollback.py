@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from array import array
+
+
+class RingBuffer:
+    '''
+    Fixed capacity list. When buffer is full, appending new item overwrites
+    the oldest one. Items are accessed by index in O(1).
+    '''
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Capacity of ring buffer should be positive.')
+
+        self._items     = [None]*capacity
+        self._capacity  = capacity
+        self._head      = 0
+        self._len       = 0
+
+    def __len__(self):
+        return self._len
+
+    def _index(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('Ring buffer index out of range.')
+
+        return (self._head + index) % self._capacity
+
+    def __getitem__(self, index):
+        return self._items[self._index(index)]
+
+    def __setitem__(self, index, value):
+        self._items[self._index(index)] = value
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._items[(self._head + i) % self._capacity]
+
+    def slot(self, index):
+        '''
+        Position of the item in the storage, it doesn't change until the
+        item is overwritten, so it can index parallel arrays.
+        '''
+        return self._index(index)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, item):
+        '''
+        Add item to the end of buffer.
+        Returns:
+            Overwritten item or None if buffer wasn't full.
+        '''
+        evicted = None
+        tail = (self._head + self._len) % self._capacity
+
+        if self._len == self._capacity:
+            evicted = self._items[tail]
+            self._head = (self._head + 1) % self._capacity
+        else:
+            self._len += 1
+
+        self._items[tail] = item
+
+        return evicted
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('Pop from empty ring buffer.')
+
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % self._capacity
+        self._len -= 1
+
+        return item
+
+    def clear(self):
+        self._items     = [None]*self._capacity
+        self._head      = 0
+        self._len       = 0
+
+
+class Scrollback:
+    '''
+    Bounded storage of received text split into lines. Last line is open and
+    is extended by the next appended text. Lines longer than max_line are
+    wrapped, so text without new lines doesn't make one huge line. When
+    number of lines or number of stored characters exceeds the limit the
+    oldest lines are dropped.
+
+    Arrival time of every line is kept in array of 32 bit milliseconds since
+    the first stamped line (epoch), parallel to the ring of lines, so times
+    cost 4 bytes per line. Times don't decrease, so lines of a time window
+    are found by binary search.
+    '''
+
+    def __init__(self, max_lines=100000, max_bytes=0, max_line=0):
+        '''
+        Args:
+            max_lines: maximum number of stored lines.
+            max_bytes: maximum number of stored characters, 0 - no limit.
+            max_line: maximum length of line, longer lines are wrapped,
+                0 - no limit.
+        '''
+        self.max_bytes  = max_bytes
+        self.max_line   = max_line
+        self._lines     = RingBuffer(max_lines)
+        # Number of stored characters
+        self.size       = 0
+        # Total number of lines dropped from the beginning
+        self.dropped    = 0
+        # Length of the longest line seen (used for horizontal scrolling)
+        self.max_len    = 0
+        # Milliseconds since epoch of every line, indexed by slot of the line
+        self._times     = array('I', bytes(4*max_lines))
+        # time.monotonic_ns() of the first stamped line, None - no times
+        self.epoch      = None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __getitem__(self, index):
+        return self._lines[index]
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def append(self, text, stamps=None):
+        '''
+        Append text to the scrollback.
+        Args:
+            text: string, can contain any number of new lines.
+            stamps: list of (position, stamp): position of the first
+                character in text of the piece received at stamp
+                (time.monotonic_ns()), sorted by position. Line gets time of
+                the piece where it starts.
+        Returns:
+            Number of lines dropped to fit into limits.
+        '''
+        if not text:
+            return 0
+
+        dropped = 0
+        times = self._to_ms(stamps) if stamps else None
+        piece = 0
+
+        if not len(self._lines):
+            self._lines.append('')
+            self._times[self._lines.slot(-1)] = 0
+        if times and not self._lines[-1]:
+            # Empty open line starts with this text
+            self._times[self._lines.slot(-1)] = times[0][1]
+
+        # Open line is extended by the first part
+        parts = text.split('\n')
+        opened = self._lines[-1]
+        parts[0] = opened + parts[0]
+        self.size -= len(opened)
+        lines = self._wrap(parts, -len(opened))
+
+        line = lines[0][0]
+        self._lines[-1] = line
+        self.size += len(line)
+        self.max_len = max(self.max_len, len(line))
+
+        # Lines without stamps get time of the previous line
+        current = self.time(-1)
+        for line, position in lines[1:]:
+            self.size += len(line)
+            self.max_len = max(self.max_len, len(line))
+            evicted = self._lines.append(line)
+            if evicted is not None:
+                self.size -= len(evicted)
+                dropped += 1
+            if times:
+                while piece + 1 < len(times) and \
+                        times[piece + 1][0] <= position:
+                    piece += 1
+                current = times[piece][1]
+            self._times[self._lines.slot(-1)] = current
+
+        # Keep at least the open line
+        while self.max_bytes and self.size > self.max_bytes and \
+                len(self._lines) > 1:
+            self.size -= len(self._lines.popleft())
+            dropped += 1
+
+        self.dropped += dropped
+
+        return dropped
+
+    def _wrap(self, parts, position):
+        '''
+        Split parts longer than max_line.
+        Args:
+            parts: lines of the text.
+            position: position of the first part in the text.
+        Returns:
+            List of (line, position of its first character in the text).
+        '''
+        size = self.max_line
+        lines = list()
+        for part in parts:
+            if size and len(part) > size:
+                lines.extend((part[i:i + size], position + i) for i in
+                        range(0, len(part), size))
+            else:
+                lines.append((part, position))
+            position += len(part) + 1
+
+        return lines
+
+    def advance(self, column, text):
+        '''
+        Count lines added by appending text, wrapped the same way as
+        append() does, without storing it.
+        Args:
+            column: length of the open line.
+            text: appended text.
+        Returns:
+            (number of added lines, length of the open line after text).
+        '''
+        size = self.max_line
+        if not size or column + len(text) <= size:
+            # No line gets longer than max_line
+            end = text.rfind('\n')
+            if end < 0:
+                return 0, column + len(text)
+            return text.count('\n'), len(text) - end - 1
+
+        lengths = [len(part) for part in text.split('\n')]
+        lengths[0] += column
+        # Line of length n takes (n - 1)//size + 1 wrapped lines
+        lines = len(lengths) - 1 + sum((length - 1)//size for length in
+                lengths if length)
+        last = lengths[-1]
+        return lines, last - (last - 1)//size*size if last else 0
+
+    def _to_ms(self, stamps):
+        if self.epoch is None:
+            self.epoch = stamps[0][1]
+        return [(position, min(0xFFFFFFFF, max(0, (stamp -
+            self.epoch)//1000000))) for position, stamp in stamps]
+
+    def time(self, index):
+        '''
+        Returns:
+            Arrival time of the line in milliseconds since epoch.
+        '''
+        return self._times[self._lines.slot(index)]
+
+    def find_time(self, ms):
+        '''
+        Returns:
+            Index of the first line arrived at or after ms since epoch,
+            number of lines if there is no such line.
+        '''
+        lo, hi = 0, len(self._lines)
+        while lo < hi:
+            middle = (lo + hi)//2
+            if self.time(middle) < ms:
+                lo = middle + 1
+            else:
+                hi = middle
+
+        return lo
+
+    def clear(self):
+        self._lines.clear()
+        self.size       = 0
+        self.dropped    = 0
+        self.max_len    = 0
+        self.epoch      = None
+
+    def text(self):
+        '''
+        Returns:
+            All stored lines as one string.
+        '''
+        return '\n'.join(self._lines)
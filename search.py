@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Search in the received stream. Stream is spooled by the reader to segment
+files in a temporary directory (StreamSpool), the oldest segment is removed
+when the spool exceeds its budget, so only the last 7/8 to whole
+search_spool_max bytes are searched. Search thread maps the segments and
+scans them chunk by chunk with mmap.find() (text and HEX patterns) or
+compiled bytes regex, so nothing is copied and GUI thread isn't blocked.
+New request cancels the running one. Matches crossing boundary of two
+segments are found in the seam: tail of one segment joined with the head of
+the next one (pattern length - 1 or 'search_overlap' bytes for regex).
+
+Literal patterns are anchored on their rarest byte (estimated from the end
+of the stream): single byte search runs at memchr() speed, which is several
+times faster than substring search on long repetitive streams.
+'''
+
+# System imports
+import  os
+import  re
+import  mmap
+import  queue
+import  shutil
+import  logging
+import  tempfile
+import  threading
+import  collections
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Kinds of patterns
+TEXT    = 'text'
+HEX     = 'hex'
+REGEX   = 'regex'
+
+# Size of the stream sample used to choose anchor byte of the pattern
+SAMPLE  = 1024*1024
+# Anchor byte is used only if it's rarer than 1/RARE in the sample
+RARE    = 4096
+# False candidates in one chunk after which substring search is used
+MISSES  = 64
+# Spool segment, named by stream offset of its first byte
+SEGMENT = 'stream-{:016d}'
+# Number of segments the spool budget is split into
+SEGMENTS = 8
+
+
+def compile_pattern(pattern, kind):
+    '''
+    Convert pattern entered by user into bytes or compiled bytes regex.
+    Args:
+        pattern: string.
+        kind: TEXT, HEX or REGEX.
+    Returns:
+        bytes or compiled regex.
+    Raises:
+        ValueError if pattern is invalid.
+    '''
+    if kind == HEX:
+        # Allow '0x' prefixes and any separators: 'DE AD', 'de:ad', '0xde'
+        digits = re.sub(r'0[xX]|[^0-9a-fA-F]', '', pattern)
+        if not digits or len(digits) % 2:
+            raise ValueError('Invalid HEX sequence: {}.'.format(pattern))
+        return bytes.fromhex(digits)
+
+    encoded = pattern.encode(config['encoding'])
+    if kind == REGEX:
+        try:
+            return re.compile(encoded)
+        except re.error as e:
+            raise ValueError('Invalid regular expression: {}.'.format(e))
+
+    if not encoded:
+        raise ValueError('Empty pattern.')
+    return encoded
+
+
+def list_segments(directory):
+    '''
+    Returns:
+        List of (stream offset, path, size) of spool segments in the
+        directory, sorted by offset.
+    '''
+    segments = list()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return segments
+
+    for name in names:
+        if not name.startswith('stream-'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            segments.append((int(name[7:]), path, os.path.getsize(path)))
+        except (ValueError, OSError):
+            # Not a segment or removed meanwhile
+            continue
+
+    return sorted(segments)
+
+
+class StreamSpool:
+    '''
+    Received stream written to segment files in a temporary directory.
+    When the current segment reaches 1/SEGMENTS of the budget a new one is
+    started and the oldest is removed, so between (SEGMENTS - 1)/SEGMENTS of
+    the budget and the whole budget is kept. Stream offsets are counted
+    from the start and don't change when segments are removed.
+    '''
+
+    def __init__(self, budget=0):
+        '''
+        Args:
+            budget: maximum number of kept bytes, 0 - no limit.
+        Raises:
+            OSError if directory or file can't be created.
+        '''
+        self.budget     = budget
+        self.directory  = tempfile.mkdtemp(prefix='pysm-')
+        # Stream offset of the next byte
+        self.offset     = 0
+        # (stream offset, path) of kept segments
+        self._segments  = collections.deque()
+        self._file      = None
+        self._open()
+
+    def _open(self):
+        path = os.path.join(self.directory, SEGMENT.format(self.offset))
+        self._file = open(path, 'wb')
+        self._segments.append((self.offset, path))
+
+    @property
+    def start(self):
+        '''
+        Stream offset of the oldest kept byte.
+        '''
+        return self._segments[0][0]
+
+    def write(self, data, stamp=None):
+        '''
+        Append received bytes.
+        Raises:
+            OSError if writing fails.
+        '''
+        if not data:
+            return None
+
+        self._file.write(data)
+        self.offset += len(data)
+        if self.budget and self.offset - self._segments[-1][0] >= \
+                self.budget//SEGMENTS:
+            self._file.close()
+            self._open()
+            while len(self._segments) > SEGMENTS:
+                _, path = self._segments.popleft()
+                os.unlink(path)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        '''
+        Close and remove the spool.
+        '''
+        self._file.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class StreamSearch(threading.Thread):
+    '''
+    Thread searching in the spooled stream.
+    Events:
+        'found': offset and length of the match, offset is -1 if nothing
+        is found
+        'error': error message
+    '''
+
+    def __init__(self, path=None, flush=None):
+        '''
+        Args:
+            path: spool directory (see StreamSpool).
+            flush: function called before search to write buffered data.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.path       = path
+        self.flush      = flush
+        self.chunk      = config['search_chunk']
+        # Offset of the last match, next search starts after it
+        self.position   = None
+        self._last      = None
+        # Index in the pattern and value of the byte searched first
+        self._anchor    = None
+
+        self._requests  = queue.SimpleQueue()
+
+    def find(self, pattern, kind=TEXT, backward=False):
+        '''
+        Find next (or previous) occurrence of the pattern. Search continues
+        from the last match if pattern isn't changed, otherwise starts from
+        the beginning (or the end) of the stream, and wraps around.
+        '''
+        self._requests.put((pattern, kind, backward))
+
+    def stop(self):
+        self._requests.put(None)
+
+    def read(self, start, end):
+        '''
+        Returns:
+            Bytes of the stream from start to end offset (only the kept
+            part).
+        '''
+        if not self.path or end <= start:
+            return b''
+
+        data = list()
+        for base, path, size in list_segments(self.path):
+            lo, hi = max(start, base), min(end, base + size)
+            if lo >= hi:
+                continue
+            try:
+                with open(path, 'rb') as fn:
+                    fn.seek(lo - base)
+                    data.append(fn.read(hi - lo))
+            except FileNotFoundError:
+                continue
+
+        return b''.join(data)
+
+    def run(self):
+        request = self._requests.get()
+        while request is not None:
+            try:
+                self._find(*request)
+            except (OSError, ValueError) as e:
+                logger.debug('Search failed: {}'.format(e))
+                self.notify('error', str(e))
+
+            # Only the latest request is handled
+            request = self._requests.get()
+            while not self._requests.empty() and request is not None:
+                request = self._requests.get()
+
+    def _cancelled(self):
+        return not self._requests.empty()
+
+    def _find(self, pattern, kind, backward):
+        if (pattern, kind) != self._last:
+            self._last = (pattern, kind)
+            self.position = None
+
+        needle = compile_pattern(pattern, kind)
+        if self.flush:
+            self.flush()
+
+        segments = list_segments(self.path) if self.path else []
+        first = segments[0][0] if segments else 0
+        size = segments[-1][0] + segments[-1][2] if segments else 0
+        if size <= first:
+            self.notify('found', -1, 0)
+            return None
+
+        if self.position is not None and self.position < first:
+            # Last match is removed from the spool
+            self.position = None
+
+        self._anchor = None
+        if isinstance(needle, bytes) and len(needle) > 1:
+            self._anchor = self._choose_anchor(needle,
+                    self.read(max(first, size - SAMPLE), size))
+        if backward:
+            end = size if self.position is None else self.position
+            spans = [(first, end), (end, size)]
+        else:
+            start = first if self.position is None else self.position + 1
+            spans = [(start, size), (first, start)]
+
+        for start, end in spans:
+            match = self._scan_segments(segments, needle, start, end,
+                    backward)
+            if match is None:
+                # Cancelled by new request
+                return None
+            if match[0] >= 0:
+                self.position = match[0]
+                self.notify('found', *match)
+                return None
+
+        self.notify('found', -1, 0)
+        if first:
+            self.notify('error', 'Not found in the last {} bytes, older '
+                    'data isn\'t kept (search_spool_max).'.format(
+                        size - first))
+
+    def _scan_segments(self, segments, needle, start, end, backward):
+        '''
+        Search matches starting in [start, end) of the stream in every
+        segment. Matches starting in the last overlap bytes of a segment
+        followed by the next one are searched in the seam of the two.
+        Returns:
+            (offset, length), (-1, 0) if not found, None if cancelled.
+        '''
+        overlap = self._overlap(needle)
+        order = range(len(segments))
+        for index in reversed(order) if backward else order:
+            base, path, size = segments[index]
+            seam = base + size
+            if overlap and index + 1 < len(segments) and \
+                    segments[index + 1][0] == base + size:
+                seam = max(base, base + size - overlap)
+
+            # (start, end, is seam) of the stream in this segment
+            spans = [(max(start, base), min(end, seam), False),
+                    (max(start, seam), min(end, base + size), True)]
+            for lo, hi, joined in reversed(spans) if backward else spans:
+                if lo >= hi:
+                    continue
+                if joined:
+                    match = self._scan_seam(needle, lo, hi, overlap,
+                            backward)
+                else:
+                    match = self._scan_segment(path, base, needle, lo, hi,
+                            backward)
+                if match is None or match[0] >= 0:
+                    return match
+
+        return -1, 0
+
+    def _scan_segment(self, path, base, needle, start, end, backward):
+        '''
+        Search matches starting in [start, end) of the stream in the mapped
+        segment.
+        Returns:
+            (offset, length), (-1, 0) if not found, None if cancelled.
+        '''
+        try:
+            fn = open(path, 'rb')
+        except FileNotFoundError:
+            # Removed from the spool meanwhile
+            return -1, 0
+        with fn, mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            match = self._scan(data, needle, start - base, end - base,
+                    backward)
+        if match is None or match[0] < 0:
+            return match
+        return match[0] + base, match[1]
+
+    def _scan_seam(self, needle, start, end, overlap, backward):
+        '''
+        Search matches starting in [start, end) of the stream, which can
+        continue up to overlap bytes into the next segment.
+        Returns:
+            (offset, length), (-1, 0) if not found, None if cancelled.
+        '''
+        data = self.read(start, end + overlap)
+        match = self._scan(data, needle, 0, end - start, backward)
+        if match is None or match[0] < 0:
+            return match
+        return match[0] + start, match[1]
+
+    @staticmethod
+    def _overlap(needle):
+        '''
+        Returns:
+            Maximum number of bytes a match can continue after its chunk.
+        '''
+        if isinstance(needle, bytes):
+            return len(needle) - 1
+        return config['search_overlap']
+
+    def _scan(self, data, needle, start, end, backward):
+        '''
+        Search matches starting in [start, end) chunk by chunk. Chunks
+        overlap, so matches crossing chunk boundary aren't missed (regex
+        matches are limited to 'search_overlap' bytes).
+        Returns:
+            (offset, length), (-1, 0) if not found, None if cancelled.
+        '''
+        overlap = self._overlap(needle)
+        chunks = range(start, end, self.chunk)
+        if backward:
+            chunks = reversed(chunks)
+
+        for lo in chunks:
+            if self._cancelled():
+                return None
+
+            hi = min(lo + self.chunk, end)
+            window = min(hi + overlap, len(data))
+
+            if isinstance(needle, bytes):
+                offset = self._find_literal(data, needle, lo, hi, window,
+                        backward)
+                if offset >= 0:
+                    return offset, len(needle)
+                continue
+
+            if backward:
+                match = None
+                for match_ in needle.finditer(data, lo, window):
+                    if match_.start() >= hi:
+                        break
+                    match = match_
+            else:
+                match = needle.search(data, lo, window)
+            if match and lo <= match.start() < hi:
+                return match.start(), max(1, match.end() - match.start())
+
+        return -1, 0
+
+    @staticmethod
+    def _choose_anchor(needle, sample):
+        '''
+        Returns:
+            (index, byte) of the pattern byte which is the rarest in the
+            sample or None if all bytes are frequent.
+        '''
+        counts = {byte: sample.count(byte) for byte in set(needle)}
+        byte = min(counts, key=counts.get)
+        if counts[byte]*RARE > max(len(sample), SAMPLE):
+            return None
+
+        return needle.index(byte), bytes([byte])
+
+    def _find_literal(self, data, needle, lo, hi, window, backward):
+        '''
+        Find pattern starting in [lo, hi), pattern can end before window.
+        Returns:
+            Offset of the match or -1.
+        '''
+        if self._anchor:
+            offset = self._find_anchored(data, needle, lo, hi, window,
+                    backward)
+            if offset is not None:
+                return offset
+
+        if backward:
+            offset = data.rfind(needle, lo, window)
+            # Skip match starting in the next chunk
+            while offset >= hi:
+                offset = data.rfind(needle, lo, offset + len(needle) - 1)
+        else:
+            offset = data.find(needle, lo, window)
+
+        return offset if lo <= offset < hi else -1
+
+    def _find_anchored(self, data, needle, lo, hi, window, backward):
+        '''
+        Search for the anchor byte and compare pattern around it.
+        Returns:
+            Offset of the match, -1 if there is no match or None if anchor
+            byte is too frequent in this chunk.
+        '''
+        index, byte = self._anchor
+        # Anchor byte positions of matches starting in [lo, hi)
+        first = lo + index
+        last = min(hi + index, window - len(needle) + index + 1)
+        size = len(needle)
+
+        position = last if backward else first
+        for _ in range(MISSES):
+            if backward:
+                position = data.rfind(byte, first, position)
+            else:
+                position = data.find(byte, position, last)
+            if position < 0:
+                return -1
+
+            start = position - index
+            if data[start:start + size] == needle:
+                return start
+            if not backward:
+                position += 1
+
+        return None
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        search thread.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
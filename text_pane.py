@@ -0,0 +1,298 @@
+from PyQt5.QtWidgets    import QAbstractScrollArea
+from PyQt5.QtWidgets    import QApplication
+from PyQt5.QtWidgets    import QMenu
+from PyQt5.QtCore       import Qt
+from PyQt5.QtGui        import QColor
+from PyQt5.QtGui        import QPainter
+from PyQt5.QtGui        import QPalette
+from PyQt5.QtGui        import QKeySequence
+
+from scrollback         import Scrollback
+
+
+class TextPane(QAbstractScrollArea):
+    '''
+    Read-only text view over the Scrollback. Only lines visible in the
+    viewport are painted, so cost of append and scroll doesn't depend on the
+    amount of stored text. Optional gutter shows arrival time of every line
+    (seconds since the first line), view can be limited to a time window.
+    '''
+
+    def __init__(self, max_lines=100000, max_bytes=0, max_line=0,
+            parent=None):
+        QAbstractScrollArea.__init__(self, parent)
+
+        self.scrollback = Scrollback(max_lines, max_bytes, max_line)
+        # Keep the last line visible when new text is appended
+        self.follow     = False
+        # Selected lines: (anchor, current) indexes in scrollback
+        self._sel       = None
+        # Highlighter of the text (only visible lines are highlighted)
+        self.highlighter = None
+        # Show arrival times in the gutter
+        self.show_times = False
+        # Shown time window: (first, last) milliseconds, None - all lines
+        self.window     = None
+
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.viewport().setBackgroundRole(QPalette.Base)
+        self.viewport().setAutoFillBackground(True)
+        self.viewport().setCursor(Qt.IBeamCursor)
+
+    def append(self, text, stamps=None):
+        '''
+        Append text to the end of the pane.
+        Args:
+            text: string
+            stamps: arrival times of pieces of text, see Scrollback.append().
+        '''
+        if not text:
+            return None
+
+        dropped = self.scrollback.append(text, stamps)
+        if dropped and self._sel:
+            self._sel = tuple(max(0, i - dropped) for i in self._sel)
+
+        sb = self.verticalScrollBar()
+        value = sb.value()
+        self._update_scrollbars()
+
+        if self.follow:
+            sb.setValue(sb.maximum())
+        elif dropped and self.window is None:
+            # Keep the same lines in the viewport
+            sb.setValue(max(0, value - dropped))
+
+        self.viewport().update()
+
+    def clear(self):
+        self.scrollback.clear()
+        self._sel = None
+        self._update_scrollbars()
+        self.viewport().update()
+
+    def set_show_times(self, value):
+        self.show_times = bool(value)
+        self._update_scrollbars()
+        self.viewport().update()
+
+    def set_window(self, start=None, end=None):
+        '''
+        Show only lines arrived in the time window.
+        Args:
+            start, end: seconds since the first line, None - show all lines.
+        '''
+        if start is None:
+            self.window = None
+        else:
+            self.window = (int(start*1000), int(end*1000))
+        self._update_scrollbars()
+        self.verticalScrollBar().setValue(0)
+        self.viewport().update()
+
+    def goto_time(self, seconds):
+        '''
+        Select the first line arrived at or after the time.
+        Args:
+            seconds: seconds since the first line.
+        '''
+        self.goto_line(self.scrollback.find_time(int(seconds*1000)))
+
+    def toPlainText(self):
+        return self.scrollback.text()
+
+    def scroll_to_end(self):
+        sb = self.verticalScrollBar()
+        sb.setValue(sb.maximum())
+
+    def copy(self):
+        selection = self._selection()
+        if not selection:
+            return None
+
+        lines = [self.scrollback[i].rstrip('\r') for i in range(
+            selection[0], selection[1] + 1)]
+        QApplication.clipboard().setText('\n'.join(lines))
+
+    def goto_line(self, index):
+        '''
+        Select the line and scroll it to the middle of the viewport.
+        Args:
+            index: line index in the scrollback.
+        '''
+        if not len(self.scrollback):
+            return None
+
+        index = max(0, min(index, len(self.scrollback) - 1))
+        first, last = self._bounds()
+        if not first <= index < last:
+            self.set_window(None)
+            first = 0
+        self._sel = (index, index)
+        self.verticalScrollBar().setValue(index - first -
+                self._visible_lines()//2)
+        self.viewport().update()
+
+    def selectAll(self):
+        first, last = self._bounds()
+        if last > first:
+            self._sel = (first, last - 1)
+            self.viewport().update()
+
+#==============================================================================
+# Utils
+#==============================================================================
+
+    def _line_height(self):
+        return self.fontMetrics().lineSpacing()
+
+    def _bounds(self):
+        '''
+        Returns:
+            Index of the first shown line and index after the last one.
+        '''
+        if self.window is None:
+            return 0, len(self.scrollback)
+
+        return (self.scrollback.find_time(self.window[0]),
+                self.scrollback.find_time(self.window[1] + 1))
+
+    def _gutter_width(self):
+        if not self.show_times:
+            return 0
+        return self.fontMetrics().horizontalAdvance('00000.000') + 8
+
+    def _visible_lines(self):
+        return max(1, self.viewport().height()//self._line_height())
+
+    def _update_scrollbars(self):
+        visible = self._visible_lines()
+        vsb = self.verticalScrollBar()
+        first, last = self._bounds()
+        vsb.setRange(0, max(0, last - first - visible))
+        vsb.setPageStep(visible)
+
+        width = self.viewport().width() - self._gutter_width()
+        text_width = self.scrollback.max_len*\
+                self.fontMetrics().averageCharWidth()
+        hsb = self.horizontalScrollBar()
+        hsb.setRange(0, max(0, text_width - width))
+        hsb.setPageStep(width)
+
+    def _selection(self):
+        if not self._sel or not len(self.scrollback):
+            return None
+
+        last = len(self.scrollback) - 1
+        return (min(min(self._sel), last), min(max(self._sel), last))
+
+    def _line_at(self, y):
+        first, last = self._bounds()
+        index = first + self.verticalScrollBar().value() + \
+                y//self._line_height()
+        return max(first, min(index, last - 1))
+
+#==============================================================================
+# Events
+#==============================================================================
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        palette = self.palette()
+        fm = self.fontMetrics()
+        lh = self._line_height()
+
+        start, end = self._bounds()
+        first = start + self.verticalScrollBar().value()
+        last = min(end, first + self._visible_lines() + 1)
+        gutter = self._gutter_width()
+        x = gutter + 2 - self.horizontalScrollBar().value()
+        width = self.viewport().width()
+        selection = self._selection()
+
+        if gutter:
+            painter.fillRect(0, 0, gutter, self.viewport().height(),
+                    palette.alternateBase())
+            painter.setPen(palette.color(QPalette.Dark))
+            for i in range(first, last):
+                painter.drawText(0, (i - first)*lh, gutter - 4, lh,
+                        Qt.AlignRight | Qt.AlignVCenter, '{:.3f}'.format(
+                            self.scrollback.time(i)/1000))
+            # Text scrolled horizontally doesn't cover the gutter
+            painter.setClipRect(gutter, 0, width - gutter,
+                    self.viewport().height())
+
+        for i in range(first, last):
+            top = (i - first)*lh
+            if selection and selection[0] <= i <= selection[1]:
+                painter.fillRect(gutter, top, width - gutter, lh,
+                        palette.highlight())
+                color = palette.color(QPalette.HighlightedText)
+            else:
+                color = palette.color(QPalette.Text)
+
+            line = self.scrollback[i].rstrip('\r')
+            spans = self.highlighter.spans(line) if self.highlighter else ()
+            if not spans:
+                painter.setPen(color)
+                painter.drawText(x, top + fm.ascent(), line)
+                continue
+
+            # Draw line piece by piece, highlighted pieces with their colors
+            position, left = 0, x
+            for start, end, span_color in spans:
+                for piece, pen in [(line[position:start], color),
+                        (line[start:end], QColor(span_color))]:
+                    painter.setPen(pen)
+                    painter.drawText(left, top + fm.ascent(), piece)
+                    left += fm.horizontalAdvance(piece)
+                position = end
+            painter.setPen(color)
+            painter.drawText(left, top + fm.ascent(), line[position:])
+
+    def resizeEvent(self, event):
+        QAbstractScrollArea.resizeEvent(self, event)
+        self._update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def mousePressEvent(self, event):
+        first, last = self._bounds()
+        if event.button() == Qt.LeftButton and last > first:
+            line = self._line_at(event.pos().y())
+            self._sel = (line, line)
+            self.viewport().update()
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton and self._sel:
+            self._sel = (self._sel[0], self._line_at(event.pos().y()))
+            self.viewport().update()
+
+    def keyPressEvent(self, event):
+        sb = self.verticalScrollBar()
+        if event.matches(QKeySequence.Copy):
+            self.copy()
+        elif event.matches(QKeySequence.SelectAll):
+            self.selectAll()
+        elif event.key() == Qt.Key_Home:
+            sb.setValue(sb.minimum())
+        elif event.key() == Qt.Key_End:
+            sb.setValue(sb.maximum())
+        elif event.key() == Qt.Key_PageUp:
+            sb.triggerAction(sb.SliderPageStepSub)
+        elif event.key() == Qt.Key_PageDown:
+            sb.triggerAction(sb.SliderPageStepAdd)
+        elif event.key() == Qt.Key_Up:
+            sb.triggerAction(sb.SliderSingleStepSub)
+        elif event.key() == Qt.Key_Down:
+            sb.triggerAction(sb.SliderSingleStepAdd)
+        else:
+            QAbstractScrollArea.keyPressEvent(self, event)
+
+    def contextMenuEvent(self, event):
+        menu = QMenu(self)
+        action = menu.addAction('Copy', self.copy)
+        action.setEnabled(self._selection() is not None)
+        menu.addAction('Select All', self.selectAll)
+        menu.exec_(event.globalPos())
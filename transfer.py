@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Sending files over the serial port: raw stream, XMODEM-CRC (128 byte
+blocks, falls back to checksum if receiver asks for it) and YMODEM (1024
+byte blocks, file name and size in the header block). File is sent by
+a separate thread, receiver responses are taken from the data received by
+the reader, so neither reading nor GUI is blocked.
+'''
+
+# System imports
+import  os
+import  time
+import  logging
+import  binascii
+import  threading
+from    collections         import deque
+
+# PySerial imports
+from    serial.serialutil   import SerialException
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+RAW     = 'raw'
+XMODEM  = 'xmodem'
+YMODEM  = 'ymodem'
+MODES   = [RAW, XMODEM, YMODEM]
+
+SOH     = 0x01
+STX     = 0x02
+EOT     = 0x04
+ACK     = 0x06
+NAK     = 0x15
+CAN     = 0x18
+CRC     = ord('C')
+# Padding of the last block
+SUB     = 0x1A
+
+# Seconds between progress events
+PROGRESS_INTERVAL = 0.1
+
+
+class TransferError(Exception):
+    pass
+
+
+class TransferCanceled(TransferError):
+    pass
+
+
+class FileTransfer(threading.Thread):
+    '''
+    Thread sending one file.
+    Events:
+        'progress': sent bytes of the file, file size
+        'finished': True if file is sent, message
+    '''
+
+    def __init__(self, writer, path, mode=RAW):
+        '''
+        Args:
+            writer: Writer of the port, its transmit() is used to write.
+            path: file to send.
+            mode: RAW, XMODEM or YMODEM.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        if mode not in MODES:
+            raise ValueError('Unknown transfer mode: {}.'.format(mode))
+
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.writer     = writer
+        self.path       = path
+        self.mode       = mode
+        self.size       = os.path.getsize(path)
+        self.sent       = 0
+        # Blocks sent again after NAK or timeout
+        self.retransmits = 0
+        # Bytes received from the port
+        self._input     = deque()
+        self._received  = threading.Condition()
+        self._canceled  = threading.Event()
+        self._last_progress = 0
+
+    def feed(self, data, decoded=None):
+        '''
+        Pass bytes received from the port (signature of Reader 'data'
+        event).
+        '''
+        if self.mode == RAW:
+            return None
+
+        with self._received:
+            self._input.extend(data)
+            self._received.notify()
+
+    def cancel(self):
+        self._canceled.set()
+        with self._received:
+            self._received.notify()
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            with open(self.path, 'rb') as fn:
+                if self.mode == RAW:
+                    self._send_raw(fn)
+                elif self.mode == XMODEM:
+                    self._send_xmodem(fn)
+                else:
+                    self._send_ymodem(fn)
+        except (TransferError, SerialException, OSError) as e:
+            logger.error('Fail to send {}: {}'.format(self.path, e))
+            if self.mode != RAW and not isinstance(e, SerialException):
+                self._abort()
+            self.notify('finished', False, 'Fail to send {}: {}'.format(
+                os.path.basename(self.path), e))
+            return None
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        message = 'Sent {} ({} B) in {:.1f} s, {:.0f} B/s'.format(
+                os.path.basename(self.path), self.size, elapsed,
+                self.size/elapsed)
+        if self.retransmits:
+            message += ', {} blocks resent'.format(self.retransmits)
+        logger.info(message)
+        self.notify('finished', True, message)
+
+    def _progress(self, sent, force=False):
+        self.sent = sent
+        now = time.monotonic()
+        if force or now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.notify('progress', sent, self.size)
+
+    def _check_canceled(self):
+        if self._canceled.is_set():
+            raise TransferCanceled('canceled')
+
+    def _send_raw(self, fn):
+        sent = 0
+        while True:
+            self._check_canceled()
+            chunk = fn.read(config['transfer_chunk'])
+            if not chunk:
+                break
+            self.writer.transmit(chunk)
+            sent += len(chunk)
+            self._progress(sent)
+        self._progress(sent, True)
+
+#==============================================================================
+# XMODEM/YMODEM
+#==============================================================================
+
+    def _read_byte(self, timeout):
+        '''
+        Returns:
+            Next received byte or None on timeout.
+        '''
+        deadline = time.monotonic() + timeout
+        with self._received:
+            while not self._input:
+                self._check_canceled()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._received.wait(remaining)
+
+            return self._input.popleft()
+
+    def _wait(self, expected):
+        '''
+        Wait for one of the expected responses, other bytes are skipped.
+        Returns:
+            Received response.
+        Raises:
+            TransferError on timeout or if receiver canceled transfer.
+        '''
+        deadline = time.monotonic() + config['transfer_timeout']
+        canceled = False
+        while True:
+            byte = self._read_byte(max(0, deadline - time.monotonic()))
+            if byte is None:
+                raise TransferError('receiver doesn\'t respond')
+            if byte == CAN:
+                # Two CAN in a row
+                if canceled:
+                    raise TransferCanceled('canceled by receiver')
+                canceled = True
+                continue
+            canceled = False
+            if byte in expected:
+                return byte
+
+    def _abort(self):
+        try:
+            self.writer.transmit(bytes([CAN]*3))
+        except (SerialException, OSError):
+            pass
+
+    def _start(self):
+        '''
+        Wait for receiver to start transfer.
+        Returns:
+            True if receiver asks for CRC, False for checksum.
+        '''
+        return self._wait([CRC, NAK]) == CRC
+
+    def _block(self, number, data, size, crc, pad=SUB):
+        data = data.ljust(size, bytes([pad]))
+        header = bytes([SOH if size == 128 else STX, number & 0xFF,
+            0xFF - (number & 0xFF)])
+        if crc:
+            check = binascii.crc_hqx(data, 0).to_bytes(2, 'big')
+        else:
+            check = bytes([sum(data) & 0xFF])
+
+        return header + data + check
+
+    def _send_block(self, block):
+        '''
+        Send block until it's acknowledged.
+        '''
+        for attempt in range(config['transfer_retries']):
+            self._check_canceled()
+            if attempt:
+                self.retransmits += 1
+            # Responses to the previous blocks are stale
+            with self._received:
+                self._input.clear()
+            self.writer.transmit(block)
+            try:
+                if self._wait([ACK, NAK]) == ACK:
+                    return None
+            except TransferCanceled:
+                raise
+            except TransferError as e:
+                logger.debug('Block isn\'t acknowledged: {}'.format(e))
+
+        raise TransferError('block isn\'t acknowledged after {} '
+                'attempts'.format(config['transfer_retries']))
+
+    def _send_data(self, fn, first, size, crc):
+        '''
+        Send file in blocks numbered from 'first'.
+        '''
+        number, sent = first, 0
+        while True:
+            data = fn.read(size)
+            if not data:
+                break
+            # Short tail fits into 128 byte block
+            block_size = 128 if len(data) <= 128 else size
+            self._send_block(self._block(number, data, block_size, crc))
+            number += 1
+            sent += len(data)
+            self._progress(sent)
+        self._progress(sent, True)
+
+    def _send_eot(self):
+        '''
+        End of file. YMODEM receivers answer NAK to the first EOT.
+        '''
+        with self._received:
+            self._input.clear()
+        for _ in range(config['transfer_retries']):
+            self.writer.transmit(bytes([EOT]))
+            try:
+                if self._wait([ACK, NAK]) == ACK:
+                    return None
+            except TransferCanceled:
+                raise
+            except TransferError:
+                pass
+        raise TransferError('end of transfer isn\'t acknowledged')
+
+    def _send_xmodem(self, fn):
+        crc = self._start()
+        self._send_data(fn, 1, 128, crc)
+        self._send_eot()
+
+    def _send_ymodem(self, fn):
+        self._start()
+        name = os.path.basename(self.path).encode('utf-8', 'replace')
+        header = name + b'\0' + '{} {:o}'.format(self.size,
+                int(os.path.getmtime(self.path))).encode()
+        if len(header) > 1024:
+            raise TransferError('file name is too long')
+        self._send_block(self._block(0, header, 128 if len(header) <= 128
+            else 1024, True, 0))
+
+        self._start()
+        self._send_data(fn, 1, 1024, True)
+        self._send_eot()
+
+        # Empty header ends the batch
+        self._start()
+        self._send_block(self._block(0, b'', 128, True, 0))
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        transfer thread.
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)
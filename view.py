@@ -16,6 +16,12 @@ from PyQt5.QtWidgets    import QStatusBar
 from PyQt5.QtWidgets    import QMenuBar
 from PyQt5.QtWidgets    import QFileDialog
 from PyQt5.QtWidgets    import QComboBox
+from PyQt5.QtWidgets    import QTabWidget
+from PyQt5.QtWidgets    import QTabBar
+from PyQt5.QtWidgets    import QMenu
+from PyQt5.QtWidgets    import QShortcut
+from PyQt5.QtWidgets    import QInputDialog
+from PyQt5.QtWidgets    import QProgressBar
 from PyQt5.QtCore       import QPoint
 from PyQt5.QtCore       import QTimer
 from PyQt5.QtCore       import pyqtSignal
@@ -24,6 +30,7 @@ from PyQt5.QtCore       import Qt
 from PyQt5.QtGui        import QFont
 from PyQt5.QtGui        import QTextCursor
 from PyQt5.QtGui        import QFontMetrics
+from PyQt5.QtGui        import QKeySequence
 
 from math               import floor
 from queue              import Queue
@@ -31,7 +38,10 @@ from queue              import Queue
 import qtawesome        as qta
 
 from config             import config
+from metrics            import metrics
 from status_button      import StatusButton
+from port_pane          import PortPane
+from search             import SEGMENTS
 
 
 class View(QWidget):
@@ -48,6 +58,24 @@ class View(QWidget):
     pause_m             = pyqtSignal(object)
     # Continue model
     start_m             = pyqtSignal(object)
+    # Start (file name) or stop (empty string) recording
+    recording_changed   = pyqtSignal(object)
+    # Start (directory) or stop (empty string) continuous logging
+    logging_changed     = pyqtSignal(object)
+    # Replay session (file name) instead of the port
+    replay_session      = pyqtSignal(object)
+    # Send file: path, mode ('raw', 'xmodem', 'ymodem')
+    send_file           = pyqtSignal(object, object)
+    cancel_transfer     = pyqtSignal()
+    # Plot is shown (True) or hidden
+    plotting_changed    = pyqtSignal(object)
+    # Monitor port in a separate tab
+    monitor_port        = pyqtSignal(object)
+    # Stop monitoring port shown in a separate tab
+    close_monitor       = pyqtSignal(object)
+    # Search in received stream: pattern, kind ('text', 'hex', 'regex'),
+    # search backward
+    search_stream       = pyqtSignal(object, object, object)
 
     def __init__(self):
         QWidget.__init__(self)
@@ -55,12 +83,25 @@ class View(QWidget):
         self.queue      = None
         self.end_cmd    = None
         self.autoscroll = False
+        self.line_times = config['line_times']
         self.msg_sent   = False
+        self.recording  = False
+        self.logging    = False
+        self.transferring = False
+        # Port name -> PortPane of ports monitored in separate tabs
+        self.port_panes = dict()
+        # PlotBuffer of the main port and its pane (created when shown)
+        self.plot_buffer = None
+        self.plot_pane  = None
 
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_gui)
         self.timer.start(100)
 
+        self.metrics_timer = QTimer()
+        self.metrics_timer.timeout.connect(self.update_metrics)
+        self.metrics_timer.start(1000)
+
         self.resize(1000, 600)
         self.__initUI()
 
@@ -73,6 +114,14 @@ class View(QWidget):
         self.menubar = QMenuBar()
         file_menu = self.menubar.addMenu('File')
         file_menu.addAction('Save', self.save_to_file)
+        self.rec_action = file_menu.addAction('Start recording...',
+                self.toggle_recording)
+        self.log_action = file_menu.addAction('Start logging...',
+                self.toggle_logging)
+        file_menu.addAction('Replay session...', self.open_replay)
+        self.transfer_action = file_menu.addAction('Send file...',
+                self.toggle_transfer)
+        file_menu.addAction('Save metrics...', self.save_metrics)
         file_menu.addAction('Quit', self.close)
         vbox.addWidget(self.menubar)
 
@@ -86,6 +135,10 @@ class View(QWidget):
         cmd_btn.clicked.connect(self.emit_send_data)
         cmd_hbox.addWidget(cmd_btn)
 
+        # Sent bytes, bytes waiting in the writer queue and write latency
+        self.tx_label = QLabel()
+        cmd_hbox.addWidget(self.tx_label)
+
         self.stat_btn = StatusButton(self.emit_start_m, self.emit_pause_m,
                 parent=self)
         cmd_hbox.addWidget(self.stat_btn)
@@ -96,46 +149,92 @@ class View(QWidget):
 
         vbox.addLayout(cmd_hbox)
 
-        # Editors pair box
-        editor_hbox = QHBoxLayout()
-
-        # Text edit area
-        self.editer = QPlainTextEdit()
-        self.editer.scrollContentsBy = self.ModScrollContentsBy
-        self.editer.setReadOnly(True)
-        editor_hbox.addWidget(self.editer)
-
-        # HEX edit area
-        self.editor_hex = QPlainTextEdit()
-        self.editor_hex.scrollContentsBy = self.ModScrollContentsBy
-
-        # font = QFont("serif", 10)
-        # font = self.editor_hex.document().defaultFont()
-        # fm = QFontMetrics(font)
-        # width = fm.width('0'*(config['hex_bytes_in_row']*2 +
-            # (floor(config['hex_bytes_in_row']/2) - 1) + 10))
-        # print(width)
-        # self.editor_hex.setFont(font)
-
-        # self.editor_hex.setFixedWidth(width)
-        self.editor_hex.setReadOnly(True)
-        editor_hbox.addWidget(self.editor_hex)
-
-        vbox.addLayout(editor_hbox)
+        # Consoles of the main port and of ports monitored in other tabs.
+        # Tabs are shown only if there is more than one port.
+        self.tabs = QTabWidget()
+        self.tabs.setTabsClosable(True)
+        self.tabs.setTabBarAutoHide(True)
+        self.tabs.tabCloseRequested.connect(self.close_tab)
+
+        self.main_pane = PortPane(metrics=metrics)
+        self.main_pane.editer.set_show_times(self.line_times)
+        self.editer = self.main_pane.editer
+        self.editor_hex = self.main_pane.editor_hex
+        self.tabs.addTab(self.main_pane, 'Main')
+        self.tabs.tabBar().setTabButton(0, QTabBar.RightSide, None)
+
+        vbox.addWidget(self.tabs)
+
+        # Search in the whole received stream
+        find_hbox = QHBoxLayout()
+
+        self.find_edit = QLineEdit()
+        self.find_edit.setPlaceholderText('Find')
+        if config['search_spool_max']:
+            # The oldest of SEGMENTS spool segments is removed at the limit
+            size = config['search_spool_max']
+            self.find_edit.setToolTip('Searches the last {}-{} MB of the '
+                    'received stream (search_spool_max)'.format(
+                        (size - size//SEGMENTS)//2**20, size//2**20))
+        self.find_edit.returnPressed.connect(self.emit_search_stream)
+        find_hbox.addWidget(self.find_edit)
+
+        self.find_kind = QComboBox()
+        self.find_kind.addItem('Text', 'text')
+        self.find_kind.addItem('HEX', 'hex')
+        self.find_kind.addItem('Regex', 'regex')
+        find_hbox.addWidget(self.find_kind)
+
+        find_btn = QPushButton('Previous')
+        find_btn.clicked.connect(lambda: self.emit_search_stream(True))
+        find_hbox.addWidget(find_btn)
+
+        find_btn = QPushButton('Next')
+        find_btn.clicked.connect(lambda: self.emit_search_stream())
+        find_hbox.addWidget(find_btn)
+
+        self.find_label = QLabel()
+        find_hbox.addWidget(self.find_label, 1)
+
+        QShortcut(QKeySequence.Find, self, self.find_edit.setFocus)
+        QShortcut(QKeySequence.FindNext, self, self.emit_search_stream)
+        QShortcut(QKeySequence.FindPrevious, self,
+                lambda: self.emit_search_stream(True))
+
+        vbox.addLayout(find_hbox)
 
         # Settings area
         stng_hbox = QHBoxLayout()
 
         # - Autoscroll
-        chk_btn = QCheckBox('Autoscroll')
-        chk_btn.stateChanged.connect(self.set_autoscroll)
-        stng_hbox.addWidget(chk_btn)
+        self.autoscroll_btn = QCheckBox('Autoscroll')
+        self.autoscroll_btn.stateChanged.connect(self.set_autoscroll)
+        stng_hbox.addWidget(self.autoscroll_btn)
 
         cmd_btn = QPushButton('Clear')
-        cmd_btn.clicked.connect(self.editer.clear)
-        cmd_btn.clicked.connect(self.editor_hex.clear)
+        cmd_btn.clicked.connect(lambda: self.tabs.currentWidget().clear())
         stng_hbox.addWidget(cmd_btn)
 
+        # - Plot of numbers in received lines
+        self.plot_btn = QCheckBox('Plot')
+        self.plot_btn.setEnabled(False)
+        self.plot_btn.toggled.connect(self.show_plot)
+        stng_hbox.addWidget(self.plot_btn)
+
+        # - Arrival times of lines and time window of the text console
+        self.times_btn = QCheckBox('Times')
+        self.times_btn.setChecked(self.line_times)
+        self.times_btn.toggled.connect(self.set_line_times)
+        stng_hbox.addWidget(self.times_btn)
+
+        self.time_edit = QLineEdit()
+        self.time_edit.setPlaceholderText('Go to time (s) or from-to')
+        self.time_edit.setToolTip('Seconds since the first line: "12.5" '
+                'selects the first line received since then, "10-20" shows '
+                'only lines received in the window, empty shows all lines.')
+        self.time_edit.returnPressed.connect(self.goto_time)
+        stng_hbox.addWidget(self.time_edit)
+
         stng_hbox.addStretch(1)
 
         # - Ending of line
@@ -178,6 +277,12 @@ class View(QWidget):
         ports_hbox_name.addSpacing(4)
         ports_hbox_name.addLayout(self.ports_hbox)
 
+        # Port name -> button
+        self.port_buttons = dict()
+        self.no_devs = QLabel('No ports found.')
+        self.ports_hbox.addWidget(self.no_devs)
+        self.ports_hbox.addStretch()
+
         # ComboBox if there is more than 5 ports
         self.ports_cb = QComboBox()
 
@@ -186,6 +291,15 @@ class View(QWidget):
         # Status Bar
         self.status_bar = QStatusBar()
 
+        self.metrics_label = QLabel()
+        self.status_bar.addWidget(self.metrics_label, 1)
+
+        # Progress of file transfer, shown only while sending
+        self.transfer_bar = QProgressBar()
+        self.transfer_bar.setMaximumWidth(200)
+        self.transfer_bar.hide()
+        self.status_bar.addWidget(self.transfer_bar)
+
         self.status_label = QLabel()
         self.status_label.setAlignment(Qt.AlignRight)
 
@@ -194,45 +308,64 @@ class View(QWidget):
 
         self.setLayout(vbox)
 
-    def remove_all_widgets(self, layout):
-        while layout.count() != 0:
-            child = layout.takeAt(0)
-            if child.layout() != 0:
-                lay = child.layout()
-                del lay
-            elif child.widget() != 0:
-                wid = child.widget()
-                del wid
-            del child
-
-    def add_devices(self, dev_list):
-        # print('Ports: {}'.format(dev_list))
-
-        # If number of devices is more than 5 use ComboBox
-        # TODO
-        if len(dev_list) > 5 and False:
-            self.ports_cb.clear()
-            for device in dev_list:
-                self.ports_cb.addItem(device.device)
-
-            self.ports_hbox.addWidget(self.ports_cb)
-        else:
-            self.remove_all_widgets(self.ports_hbox)
-            if not dev_list:
-                no_devs = QLabel('No ports found.')
-                self.ports_hbox.addWidget(no_devs)
+    def update_devices(self, added, removed):
+        '''
+        Update port buttons: only buttons of added and removed ports are
+        changed.
+        Args:
+            added: list of added ports (ListPortInfo).
+            removed: list of removed port names.
+        '''
+        for name in removed:
+            btn = self.port_buttons.pop(name, None)
+            if btn:
+                self.ports_hbox.removeWidget(btn)
+                btn.deleteLater()
+
+        for device in added:
+            if device.device in self.port_buttons:
+                continue
+
+            device_btn = QPushButton(device.device)
+            device_btn.setStyleSheet('padding: 3px;')
+            device_btn.clicked.connect(
+                    lambda checked, btn=device_btn: self.changePort(btn))
+            device_btn.setContextMenuPolicy(Qt.CustomContextMenu)
+            device_btn.customContextMenuRequested.connect(
+                    lambda pos, btn=device_btn: self.port_menu(btn, pos))
+            self.port_buttons[device.device] = device_btn
+
+            # Keep buttons sorted by name, after 'No ports' label
+            index = sorted(self.port_buttons).index(device.device)
+            self.ports_hbox.insertWidget(index + 1, device_btn)
+
+        self.no_devs.setVisible(not self.port_buttons)
+        self.update()
 
-                return None
+    def show_match(self, offset, length, read):
+        '''
+        Show found data in the main port consoles.
+        Args:
+            offset: stream offset of the match, -1 if nothing is found.
+            length: length of the match.
+            read: function returning stream bytes between two offsets.
+        '''
+        if offset < 0:
+            self.find_label.setText('Not found.')
+            return None
 
-            for device in dev_list:
-                device_btn = QPushButton(device.device)
-                device_btn.setStyleSheet('padding: 3px;')
-                device_btn.clicked.connect(lambda: self.changePort(device_btn))
-                self.ports_hbox.addWidget(device_btn)
+        # Don't jump back to the end when new data arrives
+        self.autoscroll_btn.setChecked(False)
+        self.tabs.setCurrentWidget(self.main_pane)
 
-            self.ports_hbox.addStretch()
+        if self.main_pane.goto_offset(offset, length, read):
+            self.find_label.setText('Found at offset {}.'.format(offset))
+        else:
+            self.find_label.setText('Found at offset {}, it\'s out of '
+                    'scrollback.'.format(offset))
 
-        self.update()
+    def set_find_status(self, text):
+        self.find_label.setText(text)
 
     def show_error(self, text):
         msg = QMessageBox(
@@ -245,12 +378,42 @@ class View(QWidget):
 
     def set_queue(self, queue):
         self.queue = queue
+        self.main_pane.set_queue(queue)
 
     def set_end_cmd(self, end_cmd):
         self.end_cmd = end_cmd
 
     def set_autoscroll(self, value):
         self.autoscroll = value
+        for pane in [self.main_pane] + list(self.port_panes.values()):
+            pane.set_autoscroll(value)
+
+    def set_line_times(self, value):
+        self.line_times = value
+        for pane in [self.main_pane] + list(self.port_panes.values()):
+            pane.editer.set_show_times(value)
+
+    def goto_time(self):
+        '''
+        Apply time from the time box to the text console of the current tab.
+        '''
+        pane = self.tabs.currentWidget()
+        if not isinstance(pane, PortPane):
+            pane = self.main_pane
+
+        text = self.time_edit.text().strip()
+        start, dash, end = text.partition('-')
+        try:
+            if not text:
+                pane.editer.set_window(None)
+            elif dash:
+                pane.editer.set_window(float(start or 0), float(end or
+                    'inf'))
+            else:
+                pane.editer.goto_time(float(text))
+        except ValueError:
+            self.status_bar.showMessage('Invalid time: {}'.format(text),
+                    3000)
 
     # def set_port(self, value):
         # self.port_edit.insert(value)
@@ -274,41 +437,106 @@ class View(QWidget):
 
         self.status_label.setText(string)
 
+    def update_metrics(self):
+        '''
+        Show summary of the pipeline metrics in the status bar.
+        '''
+        self.metrics_label.setText(metrics.summary())
+
+    def update_tx_stats(self, stats):
+        '''
+        Show writer statistics next to the command box.
+        Args:
+            stats: dictionary from Writer.stats().
+        '''
+        text = 'Sent {} B'.format(stats['sent'])
+        if stats['pending']:
+            text += ', queued {} B'.format(stats['pending'])
+        if stats['commands']:
+            text += ', {:.1f} ms'.format(stats['latency'])
+        self.tx_label.setText(text)
+        self.tx_label.setToolTip('Commands: {}, dropped: {} B, p99 latency: '
+                '{:.1f} ms'.format(stats['commands'], stats['dropped'],
+                    stats['latency_p99']))
+
     def update_gui(self):
         self.process_incoming()
         self.update()
 
-    def appendText(self, data):
-        pos = QPoint(self.editer.textCursor().position(), 0)
-        # self.editer.moveCursor(QTextCursor.End)
-        self.editer.insertPlainText(data[0])
-        # self.editer.appendHtml(data[0])
-        self.editer.cursorForPosition(pos)
+    def process_incoming(self):
+        if self.main_pane.process_incoming() and self.stat_btn.status:
+            self.stat_btn.status = 0
 
-        for line in data[1]:
-            self.editor_hex.appendHtml(line)
+        for pane in self.port_panes.values():
+            pane.process_incoming()
 
-    def process_incoming(self):
-        while self.queue.qsize():
-            try:
-                msg = self.queue.get(0)
-
-                if self.stat_btn.status:
-                    self.stat_btn.status = 0
-                # self.editer.appendPlainText(msg)
-                self.appendText(msg)
-                if self.autoscroll:
-                    self.editer.ensureCursorVisible()
-                    self.editor_hex.ensureCursorVisible()
-                    self.scroll_down()
-            except Queue.empty:
-                pass
-
-    def scroll_down(self):
-        for editor in [self.editer, self.editor_hex]:
-            sb = editor.verticalScrollBar()
-            sb.setValue(sb.maximum())
-            editor.moveCursor(QTextCursor.End)
+    def add_port_tab(self, port, queue):
+        '''
+        Show port monitored in a separate tab.
+        Args:
+            port: port name.
+            queue: queue with data received from the port.
+        '''
+        pane = PortPane()
+        pane.set_queue(queue)
+        pane.set_autoscroll(self.autoscroll)
+        pane.editer.set_show_times(self.line_times)
+        self.port_panes[port] = pane
+        self.tabs.setCurrentIndex(self.tabs.addTab(pane, port))
+
+    def port_tab_closed(self, port):
+        '''
+        Mark tab of the port which was closed (e.g. device disconnected).
+        '''
+        pane = self.port_panes.get(port)
+        if pane:
+            self.tabs.setTabText(self.tabs.indexOf(pane),
+                    '{} (closed)'.format(port))
+
+    def set_plot_buffer(self, buffer):
+        '''
+        Args:
+            buffer: PlotBuffer of the main port.
+        '''
+        self.plot_buffer = buffer
+        self.plot_btn.setEnabled(buffer.available())
+        if not buffer.available():
+            self.plot_btn.setToolTip('Plotting requires NumPy.')
+
+    def show_plot(self, value):
+        if value and self.plot_pane is None:
+            # NumPy is imported only when plot is used
+            from plot_pane import PlotPane
+            self.plot_pane = PlotPane(self.plot_buffer)
+            self.tabs.setCurrentIndex(self.tabs.addTab(self.plot_pane,
+                'Plot'))
+        elif not value and self.plot_pane is not None:
+            self.tabs.removeTab(self.tabs.indexOf(self.plot_pane))
+            self.plot_pane.deleteLater()
+            self.plot_pane = None
+
+        self.plotting_changed.emit(value)
+
+    def close_tab(self, index):
+        pane = self.tabs.widget(index)
+        if pane is self.plot_pane:
+            self.plot_btn.setChecked(False)
+            return None
+
+        for port, port_pane in list(self.port_panes.items()):
+            if port_pane is pane:
+                del self.port_panes[port]
+                self.close_monitor.emit(port)
+
+        self.tabs.removeTab(index)
+        pane.deleteLater()
+
+    def port_menu(self, btn, pos):
+        menu = QMenu(self)
+        action = menu.addAction('Monitor in new tab',
+                lambda: self.monitor_port.emit(btn.text()))
+        action.setEnabled(btn.text() not in self.port_panes)
+        menu.exec_(btn.mapToGlobal(pos))
 
     def changePort(self, btn):
         if not self.msg_sent:
@@ -322,10 +550,96 @@ class View(QWidget):
 #==============================================================================
 
     def save_to_file(self):
+        '''
+        Save text console of the current tab, main one if plot is shown.
+        '''
+        pane = self.tabs.currentWidget()
+        if not isinstance(pane, PortPane):
+            pane = self.main_pane
+
         _file = QFileDialog.getSaveFileName()
         if _file[0]:
             with open(_file[0], 'w+') as fn:
-                fn.write(self.editer.toPlainText())
+                fn.write(pane.editer.toPlainText())
+
+    def save_metrics(self):
+        _file = QFileDialog.getSaveFileName(self, 'Save metrics',
+                'metrics.json')
+        if _file[0]:
+            try:
+                metrics.dump(_file[0])
+            except OSError as e:
+                self.show_error('Can\'t save metrics: {}'.format(e))
+
+    def toggle_recording(self):
+        if self.recording:
+            self.set_recording(False)
+            self.recording_changed.emit('')
+            return None
+
+        _file = QFileDialog.getSaveFileName(self, 'Record session')
+        if _file[0]:
+            self.set_recording(True)
+            self.recording_changed.emit(_file[0])
+
+    def toggle_logging(self):
+        if self.logging:
+            self.set_logging(False)
+            self.logging_changed.emit('')
+            return None
+
+        directory = QFileDialog.getExistingDirectory(self, 'Log directory')
+        if directory:
+            self.set_logging(True)
+            self.logging_changed.emit(directory)
+
+    def open_replay(self):
+        _file = QFileDialog.getOpenFileName(self, 'Replay session')
+        if _file[0]:
+            self.replay_session.emit(_file[0])
+
+    def toggle_transfer(self):
+        if self.transferring:
+            self.cancel_transfer.emit()
+            return None
+
+        _file = QFileDialog.getOpenFileName(self, 'Send file')
+        if not _file[0]:
+            return None
+
+        modes = ['Raw', 'XMODEM', 'YMODEM']
+        mode, ok = QInputDialog.getItem(self, 'Send file', 'Protocol:', modes,
+                0, False)
+        if ok:
+            self.set_transferring(True)
+            self.send_file.emit(_file[0], mode.lower())
+
+    def set_transferring(self, value):
+        self.transferring = value
+        self.transfer_action.setText('Cancel sending' if value else
+                'Send file...')
+        self.transfer_bar.setValue(0)
+        self.transfer_bar.setVisible(value)
+
+    def show_transfer_progress(self, sent, total):
+        self.transfer_bar.setValue(int(100*sent/total) if total else 100)
+
+    def transfer_finished(self, success, message):
+        self.set_transferring(False)
+        if success:
+            self.status_bar.showMessage(message, 10000)
+        else:
+            self.show_error(message)
+
+    def set_recording(self, value):
+        self.recording = value
+        self.rec_action.setText('Stop recording' if value else
+                'Start recording...')
+
+    def set_logging(self, value):
+        self.logging = value
+        self.log_action.setText('Stop logging' if value else
+                'Start logging...')
 
 #==============================================================================
 # Signals
@@ -335,6 +649,12 @@ class View(QWidget):
         self.send_data.emit(self.get_cmd())
         self.cmd_edit.clear()
 
+    def emit_search_stream(self, backward=False):
+        if self.find_edit.text():
+            self.find_label.setText('Searching...')
+            self.search_stream.emit(self.find_edit.text(),
+                    self.find_kind.currentData(), backward)
+
     def emit_br_changed(self, value):
         baudrate = self.br_menu.itemText(value)[:-5]
         self.baudrate_changed.emit(baudrate)
@@ -358,13 +678,6 @@ class View(QWidget):
 #==============================================================================
 # Events
 #==============================================================================
-    def ModScrollContentsBy(self, dx, dy):
-        for editor in [self.editer, self.editor_hex]:
-            if self.autoscroll:
-                editor.ensureCursorVisible()
-            else:
-                QPlainTextEdit.scrollContentsBy(editor, dx, dy)
-
     def closeEvent(self, event):
         self.end_cmd()
         QWidget.closeEvent(self, event)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+Asynchronous writing to the serial port. Commands are queued by the GUI and
+written by the writer thread, so slow links and hardware flow control don't
+block the caller. Commands queued back to back are written at once, optional
+pacing keeps minimal time between commands.
+'''
+
+# System imports
+import  time
+import  queue
+import  logging
+import  threading
+
+# PySerial imports
+from    serial.serialutil   import SerialException
+
+from config import config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Writer(threading.Thread):
+    '''
+    Writer thread of the port opened by Reader.
+    Events:
+        'stats': dictionary with counters (see stats())
+        'error': error message
+    '''
+
+    def __init__(self, reader):
+        '''
+        Args:
+            reader: Reader which port (reader.ser) is written and which end
+                of line (reader.get_eol()) is appended to commands.
+        '''
+        threading.Thread.__init__(self, daemon=True)
+        # Event name -> list of callbacks
+        self.callbacks  = dict()
+        self.reader     = reader
+        # (encoded command, time of queuing), None stops the thread
+        self.queue      = queue.Queue()
+        # Counters and last_latency are guarded by _stats_lock: commands are
+        # queued by several threads (GUI, fan-out server)
+        self.counters   = {'queued': 0, 'sent': 0, 'dropped': 0,
+                'commands': 0}
+        self.last_latency = 0
+        self._stats_lock = threading.Lock()
+        # Updated under lock (writer and file transfer threads)
+        self.tx_bytes   = metrics.meter('tx_bytes', 'B')
+        self.tx_latency = metrics.histogram('tx_latency', 'us')
+        # Time when the previous command was written
+        self._last_write = 0
+        # Serializes writing of commands and file transfers
+        self.lock       = threading.Lock()
+
+    def send(self, data):
+        '''
+        Queue command. Strings are followed by the current end of line and
+        encoded.
+        Args:
+            data: str or bytes.
+        Returns:
+            True if command is queued.
+        '''
+        if isinstance(data, str):
+            try:
+                data = (data + self.reader.get_eol()).encode(
+                        config['encoding'])
+            except UnicodeError as e:
+                self.notify('error', 'Can\'t encode command: {}'.format(e))
+                return False
+
+        if not data:
+            return False
+
+        with self._stats_lock:
+            self.counters['queued'] += len(data)
+        self.queue.put((data, time.monotonic()))
+        self.notify('stats', self.stats())
+
+        return True
+
+    def stop(self):
+        self.queue.put(None)
+
+    def stats(self):
+        '''
+        Returns:
+            Dictionary with numbers of queued, sent, dropped (port isn't
+            open or write failed) and pending bytes, number of written
+            commands and write latency (time from queuing to the end of
+            writing, ms) of the last and 99% of commands.
+        '''
+        with self._stats_lock:
+            stats = dict(self.counters)
+            stats['latency'] = self.last_latency
+        stats['pending'] = stats['queued'] - stats['sent'] - \
+                stats['dropped']
+        stats['latency_p99'] = self.tx_latency.percentile(0.99)/1000
+
+        return stats
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            pacing = config['tx_pacing_ms']/1000
+            if pacing:
+                # Every command is written separately
+                delay = self._last_write + pacing - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                # Commands queued while the previous one was written
+                size = len(item[0])
+                while size < config['tx_max_batch']:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self.queue.put(None)
+                        break
+                    batch.append(item)
+                    size += len(item[0])
+
+            self.write(batch)
+            self.notify('stats', self.stats())
+
+    def write(self, batch):
+        '''
+        Write commands at once and wait until they are transmitted.
+        Args:
+            batch: list of (bytes, time of queuing).
+        '''
+        data = b''.join(command for command, _ in batch)
+
+        try:
+            self.transmit(data)
+        except (SerialException, OSError, TypeError) as e:
+            logger.error('Fail writing to port: {}'.format(e))
+            with self._stats_lock:
+                self.counters['dropped'] += len(data)
+            self.notify('error', 'Fail writing to port {}: {}'.format(
+                self.reader.port, e))
+            return None
+
+        now = time.monotonic()
+        self._last_write = now
+        for _, queued in batch:
+            self.tx_latency.record((now - queued)*1e6)
+        with self._stats_lock:
+            self.last_latency = (now - batch[0][1])*1000
+            self.counters['sent'] += len(data)
+            self.counters['commands'] += len(batch)
+
+    def transmit(self, data):
+        '''
+        Write bytes to the port and wait until they are transmitted. Can be
+        called from other threads (file transfer), bytes aren't counted in
+        stats().
+        Raises:
+            SerialException, OSError if port isn't open or writing fails.
+        '''
+        with self.lock:
+            ser = self.reader.ser
+            if not ser.isOpen():
+                raise SerialException('port isn\'t open')
+            ser.write(data)
+            ser.flush()
+            self.tx_bytes.add(len(data))
+
+    def subscribe(self, event, callback):
+        '''
+        Register callback for the event. Callbacks are called from the
+        writer thread ('stats' also from the thread calling send()).
+        '''
+        self.callbacks.setdefault(event, list()).append(callback)
+
+    def notify(self, event, *args):
+        for callback in self.callbacks.get(event, []):
+            callback(*args)